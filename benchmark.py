@@ -0,0 +1,547 @@
+"""
+AudioHub 性能基准测试。
+
+用法:
+    python benchmark.py output-path [音频文件]
+    python benchmark.py catalog-memory [--entries N]
+    python benchmark.py conversion-presets [--corpus 目录] [--seconds N] [--threads N]
+    python benchmark.py waveform-peaks [FLAC 文件] [--seconds N]
+    python benchmark.py loudness [音频文件] [--seconds N]
+    python benchmark.py duplicate-matching [--entries N] [--duplicates N]
+    python benchmark.py exact-duplicates [--files N] [--max-size MB]
+
+不指定音频文件时使用程序生成的测试信号，保证每次测量的输入完全相同。
+"""
+import gc
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import av
+import numpy as np
+
+import main as audiohub   # 下面的 main() 会遮住模块名
+from main import (AudioRingBuffer, AudioPlayerThread, FileCatalog, TpdfDither, SampleGain, CONVERSION_PRESETS, convert_audio,
+                  compute_peaks, load_cached_peaks, save_cached_peaks, measure_loudness,
+                  compute_fingerprint, DuplicateFinderThread, LibraryIndex, SIGNATURE_ROWS)
+
+
+def generate_test_frames(seconds=30, rate=44100, frame_samples=1152):
+    """生成一段立体声 fltp 测试信号，帧长与 MP3 相同，用来模拟短帧编码的解码输出。"""
+    t = np.arange(int(seconds * rate), dtype=np.float32) / rate
+    signal = (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    frames = []
+    for start in range(0, len(signal), frame_samples):
+        block = signal[start:start + frame_samples]
+        frame = av.AudioFrame.from_ndarray(np.vstack([block, block]), format='fltp', layout='stereo')
+        frame.sample_rate = rate
+        frame.pts = start
+        frames.append(frame)
+    return frames
+
+
+def decode_file_frames(file_path):
+    with av.open(file_path) as container:
+        return list(container.decode(container.streams.audio[0]))
+
+
+class RingSink:
+    """把数据写进 AudioRingBuffer，写满时像音频回调那样立即读走，模拟完整的输出路径。"""
+    def __init__(self, capacity_bytes):
+        self.ring = AudioRingBuffer(capacity_bytes)
+        self.scratch = np.zeros(capacity_bytes, dtype=np.uint8)
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        view = memoryview(data)
+        offset = 0
+        while offset < len(view):
+            written = self.ring.write(view[offset:])
+            offset += written
+            if offset < len(view):
+                self.ring.read_into(self.scratch, self.ring.available_read)
+        self.writes += 1
+        self.bytes += len(view)
+
+
+def legacy_output_path(frames, sink):
+    """旧路径：每帧 resample -> to_ndarray() -> tobytes() -> 写出。"""
+    resampler = av.AudioResampler(format='s16', layout='stereo', rate=frames[0].sample_rate)
+    for frame in frames:
+        for out_frame in resampler.resample(frame):
+            sink.write(out_frame.to_ndarray().tobytes())
+
+
+def batched_output_path(frames, sink, batch_frames=2048):
+    """新路径：重采样器攒批，直接从帧平面写入环形缓冲区。"""
+    resampler = av.AudioResampler(format='s16', layout='stereo', rate=frames[0].sample_rate, frame_size=batch_frames)
+    frame_bytes = 2 * 2
+    for frame in frames + [None]:
+        for out_frame in resampler.resample(frame):
+            sink.write(memoryview(out_frame.planes[0])[:out_frame.samples * frame_bytes])
+
+
+class TracingRingSink(RingSink):
+    """
+    在每次写出时读取 tracemalloc 的峰值，累计两次写出之间临时分配的字节数。
+    CPython 没有累计分配量的计数器，峰值减去区间起点就是该区间内同时存活的临时缓冲区大小。
+    """
+    def __init__(self, capacity_bytes):
+        super().__init__(capacity_bytes)
+        self.transient = 0
+        self._base = tracemalloc.get_traced_memory()[0]
+
+    def write(self, data):
+        super().write(data)
+        current, peak = tracemalloc.get_traced_memory()
+        self.transient += max(0, peak - self._base)
+        tracemalloc.reset_peak()
+        # 传进来的 bytes 在本次调用返回后就会释放，不应计入下一区间的起点
+        self._base = current - (len(data) if isinstance(data, bytes) else 0)
+
+
+def measure_transient_allocations(path_func, frames):
+    tracemalloc.start()
+    sink = TracingRingSink(1 << 20)
+    path_func(frames, sink)
+    tracemalloc.stop()
+    return sink.transient
+
+
+def run_output_path(args):
+    frames = decode_file_frames(args.file) if args.file else generate_test_frames()
+    audio_seconds = sum(f.samples for f in frames) / frames[0].sample_rate
+    print(f"输入: {len(frames)} 帧, {audio_seconds:.1f} 秒音频\n")
+    print(f"{'路径':<8}{'吞吐 MB/s':>12}{'写出次数/s':>14}{'临时分配 MB/s':>16}{'PCM 缓冲区分配/s':>18}")
+
+    for name, path_func in (("旧路径", legacy_output_path), ("新路径", batched_output_path)):
+        best = None
+        for _ in range(args.repeat):
+            sink = RingSink(1 << 20)
+            start = time.perf_counter()
+            path_func(frames, sink)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best[0]:
+                best = (elapsed, sink.bytes, sink.writes)
+        elapsed, total_bytes, writes = best
+
+        transient = measure_transient_allocations(path_func, frames)
+        pcm_buffers = transient / (total_bytes / max(writes, 1))
+        print(f"{name:<8}{total_bytes / elapsed / 1e6:>12.1f}{writes / elapsed:>14.0f}"
+              f"{transient / elapsed / 1e6:>16.1f}{pcm_buffers / elapsed:>18.0f}")
+
+
+def generate_scan_chunks(entries, chunk_size=1000, files_per_directory=200):
+    """按扫描线程的格式分块生成文件记录，目录结构类似 艺术家/专辑/曲目。"""
+    for start in range(0, entries, chunk_size):
+        chunk = []
+        for i in range(start, min(start + chunk_size, entries)):
+            directory = f"/music/artist{i // (files_per_directory * 10):05d}/album{i // files_per_directory:06d}/"
+            name = f"{i % files_per_directory:03d} - track{i:07d}.flac"
+            chunk.append({'name': name, 'path': directory + name, 'size': 20_000_000 + i, 'mtime': 1_700_000_000_000_000_000 + i})
+        yield chunk
+
+
+def build_legacy_layout(entries):
+    """旧布局：每个文件一个 dict，列表和按路径的字典各引用一次，标记另存一个集合。"""
+    audio_files, path_to_info_map, marked_files = [], {}, set()
+    for chunk in generate_scan_chunks(entries):
+        for info in chunk:
+            file_info = {'name': info['name'], 'path': info['path'], 'size': info['size'],
+                         'mtime': info['mtime'], 'marked': False}
+            audio_files.append(file_info)
+            path_to_info_map[info['path']] = file_info
+    return audio_files, path_to_info_map, marked_files
+
+
+def build_catalog(entries):
+    catalog = FileCatalog()
+    for chunk in generate_scan_chunks(entries):
+        catalog.append(chunk)
+    return catalog
+
+
+def legacy_lookup(layout, path):
+    return layout[1].get(path)
+
+
+def catalog_lookup(catalog, path):
+    return catalog.find(path)
+
+
+def run_catalog_memory(args):
+    probe_paths = [path for chunk in generate_scan_chunks(args.entries, chunk_size=max(1, args.entries // 1000))
+                   for path in [chunk[0]['path']]]
+    print(f"条目数: {args.entries}, 按路径查找 {len(probe_paths)} 次\n")
+    print(f"{'布局':<10}{'常驻内存 MB':>14}{'字节/条':>10}{'构建 s':>10}{'查找 µs/次':>14}")
+
+    for name, build, lookup in (("旧布局", build_legacy_layout, legacy_lookup),
+                                ("列式目录", build_catalog, catalog_lookup)):
+        # tracemalloc 会拖慢分配，构建耗时单独测一次
+        gc.collect()
+        start = time.perf_counter()
+        layout = build(args.entries)
+        elapsed = time.perf_counter() - start
+        del layout
+        gc.collect()
+        tracemalloc.start()
+        layout = build(args.entries)
+        gc.collect()
+        resident = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for path in probe_paths:
+            lookup(layout, path)
+        lookup_us = (time.perf_counter() - start) / len(probe_paths) * 1e6
+        print(f"{name:<10}{resident / 1e6:>14.1f}{resident / args.entries:>10.0f}{elapsed:>10.2f}{lookup_us:>14.2f}")
+        del layout
+
+
+# 固定的测试语料：(文件名, 采样率, 编码器, 采样格式)。96 kHz 的文件转 MP3 时需要重采样到 44.1 kHz
+CONVERSION_CORPUS = (
+    ("cd_44k.wav", 44100, 'pcm_s16le', 's16'),
+    ("dvd_48k.wav", 48000, 'pcm_s16le', 's16'),
+    ("hires_96k.flac", 96000, 'flac', 's32'),
+)
+CONVERSION_TARGETS = (("MP3 192k", 'mp3', 'mp3', {'b:a': '192k'}), ("FLAC", 'flac', 'flac', {}))
+
+
+def write_test_file(path, rate, codec, sample_format, seconds, rng):
+    """写一个立体声测试文件：几个谐波加上噪声，rng 的种子固定时内容每次都相同。"""
+    t = np.arange(int(seconds * rate)) / rate
+    tone = sum(0.2 / k * np.sin(2 * np.pi * 220 * k * t) for k in range(1, 6))
+    left = tone + 0.05 * rng.standard_normal(len(t))
+    right = np.roll(tone, 37) + 0.05 * rng.standard_normal(len(t))
+    scale = 2 ** 15 - 1 if sample_format == 's16' else 2 ** 31 - 1
+    samples = (np.clip(np.stack([left, right]), -1, 1) * scale).astype(np.int16 if sample_format == 's16' else np.int32)
+
+    with av.open(path, mode='w') as container:
+        stream = container.add_stream(codec, rate=rate, layout='stereo')
+        stream.format = sample_format
+        for start in range(0, samples.shape[1], 4096):
+            frame = av.AudioFrame.from_ndarray(samples[:, start:start + 4096].T.reshape(1, -1).copy(),
+                                               format=sample_format, layout='stereo')
+            frame.sample_rate = rate
+            frame.pts = start
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+
+def generate_corpus(directory, seconds):
+    """按 CONVERSION_CORPUS 生成测试文件，每次运行内容完全相同。"""
+    rng = np.random.default_rng(0)
+    paths = []
+    for name, rate, codec, sample_format in CONVERSION_CORPUS:
+        path = os.path.join(directory, name)
+        write_test_file(path, rate, codec, sample_format, seconds, rng)
+        paths.append(path)
+    return paths
+
+
+def audio_seconds(path):
+    with av.open(path) as container:
+        stream = container.streams.audio[0]
+        return float(stream.duration * stream.time_base) if stream.duration else float(container.duration / av.time_base)
+
+
+def run_conversion_presets(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.corpus:
+            sources = sorted(os.path.join(args.corpus, f) for f in os.listdir(args.corpus)
+                             if f.lower().endswith(('.mp3', '.wav', '.flac', '.ogg', '.m4a')))
+        else:
+            sources = generate_corpus(work_dir, args.seconds)
+        durations = {path: audio_seconds(path) for path in sources}
+        threads = "预设" if args.threads is None else args.threads
+        print(f"语料: {len(sources)} 个文件, 共 {sum(durations.values()):.0f} 秒音频, 编解码线程: {threads}\n")
+        print(f"{'预设':<12}" + "".join(f"{name + ' 实时倍数':>18}" for name, _, _, _ in CONVERSION_TARGETS))
+
+        for key, preset in CONVERSION_PRESETS.items():
+            row = f"{preset['name']:<12}"
+            for _, codec, extension, options in CONVERSION_TARGETS:
+                # 源文件已是目标格式时会直接复制数据包，测不到编码速度
+                jobs = [path for path in sources if not path.lower().endswith("." + extension)]
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    for path in jobs:
+                        output_path = os.path.join(work_dir, "out." + extension)
+                        convert_audio(path, output_path, codec, dict(options, preset=key), threads=args.threads)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                row += f"{sum(durations[path] for path in jobs) / best:>18.1f}x"
+            print(row)
+
+
+def decode_only(file_path):
+    with av.open(file_path) as container:
+        for _ in container.decode(container.streams.audio[0]):
+            pass
+
+
+def run_waveform_peaks(args):
+    # 要求的是单核上的速度：有条件时把进程绑定到一个核心上，FLAC 解码器的多线程也就无从发挥
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+        print("已绑定到单个 CPU 核心")
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_path = args.file
+        if not file_path:
+            file_path = os.path.join(work_dir, "peaks_test.flac")
+            write_test_file(file_path, 44100, 'flac', 's16', args.seconds, np.random.default_rng(0))
+        seconds = audio_seconds(file_path)
+        print(f"输入: {os.path.basename(file_path)}, {seconds:.0f} 秒音频\n")
+        print(f"{'步骤':<14}{'耗时 ms':>12}{'实时倍数':>12}")
+
+        for name, func in (("仅解码", decode_only), ("波形概览", compute_peaks)):
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = func(file_path)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:<14}{best * 1000:>12.1f}{seconds / best:>11.0f}x")
+
+        # 缓存目录换成临时目录，不碰用户的真实缓存
+        audiohub.PEAK_CACHE_DIR = os.path.join(work_dir, "peaks")
+        save_cached_peaks(file_path, result, os.stat(file_path))
+        start = time.perf_counter()
+        cached = load_cached_peaks(file_path)
+        elapsed = time.perf_counter() - start
+        assert cached is not None and np.array_equal(cached, result)
+        print(f"{'读取缓存':<14}{elapsed * 1000:>12.2f}{'':>12}")
+        print(f"\n要求: 波形概览在单核上快于 50x 实时 -> {'通过' if seconds / best > 50 else '未通过'}")
+
+
+def gain_output_path(frames, sink, sample_format, gain, dither):
+    """与播放线程相同的增益处理：s16 抖动时并入量化前的缩放，其余格式在帧平面上原地相乘，再写进环形缓冲区。"""
+    resampler = av.AudioResampler(format='flt' if dither else sample_format, layout='stereo',
+                                  rate=frames[0].sample_rate, frame_size=2048)
+    tpdf = TpdfDither() if dither else None
+    dtype = AudioPlayerThread.SAMPLE_DTYPES[sample_format]
+    sample_gain = SampleGain()
+    for frame in frames + [None]:
+        for out_frame in resampler.resample(frame):
+            count = out_frame.samples * 2
+            if tpdf is not None:
+                sink.write(tpdf.process(np.frombuffer(out_frame.planes[0], dtype=np.float32, count=count), gain))
+                continue
+            if gain != 1.0:
+                sample_gain.apply(np.frombuffer(out_frame.planes[0], dtype=dtype, count=count), gain)
+            sink.write(memoryview(out_frame.planes[0])[:count * np.dtype(dtype).itemsize])
+
+
+def run_loudness(args):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+        print("已绑定到单个 CPU 核心")
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_path = args.file
+        if not file_path:
+            file_path = os.path.join(work_dir, "loudness_test.flac")
+            write_test_file(file_path, 44100, 'flac', 's16', args.seconds, np.random.default_rng(0))
+        seconds = audio_seconds(file_path)
+        print(f"输入: {os.path.basename(file_path)}, {seconds:.0f} 秒音频\n")
+        print(f"{'步骤':<14}{'耗时 ms':>12}{'实时倍数':>12}")
+        for name, func in (("仅解码", decode_only), ("响度分析", measure_loudness)):
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = func(file_path)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:<14}{best * 1000:>12.1f}{seconds / best:>11.0f}x")
+        print(f"整合响度 {result[0]:.2f} LUFS, 真峰值 {result[1]:.2f} dBTP")
+
+    # 播放时的增益开销：同一条输出路径分别以增益 1 和 -6 dB 运行，差值折算到每秒音频
+    frames = generate_test_frames()
+    frame_seconds = sum(f.samples for f in frames) / frames[0].sample_rate
+    gain = 10 ** (-6 / 20)
+    print(f"\n{'输出路径':<22}{'无增益 ms':>12}{'有增益 ms':>12}{'增益开销 µs/秒音频':>20}{'占单核':>10}{'临时分配 KB/s':>16}")
+    # (名称, 输出格式, 无增益时是否抖动, 有增益时是否抖动)；16 位音源加了增益后要转成浮点再抖动量化
+    for name, sample_format, plain_dither, gain_dither in (("s16 (16 位音源)", 's16', False, True),
+                                                           ("s16 (高位深音源)", 's16', True, True),
+                                                           ("flt", 'flt', False, False),
+                                                           ("s32", 's32', False, False)):
+        timings = []
+        for value, dither in ((1.0, plain_dither), (gain, gain_dither)):
+            best = None
+            for _ in range(args.repeat):
+                sink = RingSink(1 << 20)
+                start = time.perf_counter()
+                gain_output_path(frames, sink, sample_format, value, dither)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        transient = measure_transient_allocations(
+            lambda frames, sink: gain_output_path(frames, sink, sample_format, gain, gain_dither), frames)
+        overhead = (timings[1] - timings[0]) / frame_seconds
+        print(f"{name:<22}{timings[0] * 1000:>12.1f}{timings[1] * 1000:>12.1f}{overhead * 1e6:>20.1f}"
+              f"{overhead * 100:>9.3f}%{transient / frame_seconds / 1024:>16.1f}")
+
+
+def flip_bits(data, rate, rng):
+    """按给定比例随机翻转字节串中的位，模拟转码带来的指纹差异。"""
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    bits ^= (rng.random(len(bits)) < rate).astype(np.uint8)
+    return np.packbits(bits).tobytes()
+
+
+def run_duplicate_matching(args):
+    """
+    在 N 个随机指纹中埋入若干对重复 (细指纹翻转 5% 的位，粗签名翻转 2%)，
+    测量局部敏感哈希加核实这一步的耗时、候选对数量和查全率。指纹计算的速度单独按实时倍数给出。
+    """
+    rng = np.random.default_rng(0)
+    fine_words = 420
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_path = os.path.join(work_dir, "fingerprint_test.flac")
+        write_test_file(file_path, 44100, 'flac', 's16', 60, rng)
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            compute_fingerprint(file_path)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"计算一个指纹: {best * 1000:.1f} ms (只解码开头 {audiohub.FINGERPRINT_SECONDS} 秒)")
+
+        index = LibraryIndex(os.path.join(work_dir, "library.db"))
+        entries = []
+        for i in range(args.entries):
+            fine = rng.integers(0, 2 ** 32, fine_words, dtype=np.uint32).tobytes()
+            signature = rng.integers(0, 256, SIGNATURE_ROWS * 4, dtype=np.uint8).tobytes()
+            entries.append((f"/bench/{i:07d}.flac", 1, 180.0 + i % 100, fine, signature))
+        for i in range(args.duplicates):
+            path, mtime, duration, fine, signature = entries[i]
+            entries.append((path[:-5] + ".mp3", mtime, duration, flip_bits(fine, 0.05, rng),
+                            flip_bits(signature, 0.02, rng)))
+        index.save_fingerprints(entries)
+        signatures = {path: (mtime, duration, signature) for path, mtime, duration, _, signature in entries}
+
+        finder = DuplicateFinderThread([], index)
+        start = time.perf_counter()
+        groups = finder._match(signatures)
+        elapsed = time.perf_counter() - start
+        found = sum(1 for group in groups if len(group) == 2 and group[0][:-5] == group[1][:-4])
+        print(f"指纹数: {len(entries)}, 埋入的重复: {args.duplicates}")
+        print(f"匹配耗时: {elapsed:.2f} 秒, 找到 {len(groups)} 组, 查全率 {found / max(args.duplicates, 1):.1%}, "
+              f"误报 {len(groups) - found} 组")
+
+
+def run_exact_duplicates(args):
+    """
+    生成 N 个随机内容的文件：九成大小各不相同，5% 是前面文件的完全拷贝，
+    5% 与前面的文件大小相同、只有中间一个字节不同 (部分哈希会撞上，只能靠完整哈希区分的最坏情况)。
+    比较对所有文件做完整哈希与先按大小分桶、再部分哈希、最后只对碰撞做完整哈希所读的字节数和耗时，
+    以及哈希都已缓存后再次查找的耗时。文件刚写入，都在页缓存里，耗时主要反映哈希计算本身。
+    """
+    rng = np.random.default_rng(0)
+    max_size = int(args.max_size * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as work_dir:
+        files, contents = [], []
+        for i in range(args.files):
+            path = os.path.join(work_dir, f"{i:05d}.flac")
+            kind = rng.random() if contents else 0.0
+            if kind < 0.9:
+                data = rng.bytes(int(rng.integers(64 * 1024, max_size)))
+            else:
+                data = bytearray(contents[int(rng.integers(len(contents)))])
+                if kind >= 0.95: data[len(data) // 2] ^= 0xFF
+            contents.append(bytes(data))
+            with open(path, 'wb') as f: f.write(data)
+            stat = os.stat(path)
+            files.append((path, stat.st_mtime_ns, stat.st_size))
+        total_bytes = sum(size for _, _, size in files)
+        del contents
+
+        start = time.perf_counter()
+        naive = {}
+        for path, _, _ in files:
+            naive.setdefault(audiohub.content_hash(path), []).append(path)
+        naive_time = time.perf_counter() - start
+        naive_groups = sum(1 for paths in naive.values() if len(paths) > 1)
+
+        bytes_read = [0]
+        original_hash = audiohub.content_hash
+        def counting_hash(path, partial=False):
+            size = os.path.getsize(path)
+            bytes_read[0] += min(size, 2 * audiohub.HASH_HEAD_TAIL) if partial else size
+            return original_hash(path, partial)
+        audiohub.content_hash = counting_hash
+        try:
+            index = LibraryIndex(os.path.join(work_dir, "library.db"))
+            summary = {DuplicateFinderThread.FAILED: 0, 'hashed': 0, 'failures': []}
+            finder = DuplicateFinderThread(files, index, acoustic=False)
+            start = time.perf_counter()
+            groups = finder._find_exact(summary)
+            bucketed_time = time.perf_counter() - start
+            start = time.perf_counter()
+            finder._find_exact(summary)
+            cached_time = time.perf_counter() - start
+        finally:
+            audiohub.content_hash = original_hash
+
+        print(f"文件数: {len(files)}, 总大小: {total_bytes / 2 ** 20:.0f} MB, 重复组: {naive_groups}")
+        print(f"全部完整哈希: {naive_time:.2f} 秒, 读取 {total_bytes / 2 ** 20:.0f} MB")
+        print(f"分桶 + 部分哈希: {bucketed_time:.2f} 秒, 读取 {bytes_read[0] / 2 ** 20:.0f} MB "
+              f"({bytes_read[0] / total_bytes:.1%}), 找到 {len(groups)} 组"
+              f"{'' if len(groups) == naive_groups else ' (与完整哈希的结果不一致!)'}")
+        print(f"哈希已缓存时再次查找: {cached_time * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AudioHub 性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    output_parser = subparsers.add_parser("output-path", help="比较播放输出路径的吞吐量和内存分配")
+    output_parser.add_argument("file", nargs="?", help="用于测试的音频文件，缺省时使用生成的测试信号")
+    output_parser.add_argument("--repeat", type=int, default=5)
+    output_parser.set_defaults(func=run_output_path)
+
+    catalog_parser = subparsers.add_parser("catalog-memory", help="比较文件目录旧布局与列式目录的内存占用")
+    catalog_parser.add_argument("--entries", type=int, default=1_000_000)
+    catalog_parser.set_defaults(func=run_catalog_memory)
+
+    presets_parser = subparsers.add_parser("conversion-presets", help="测量各转换预设的实时倍数 (音频时长 / 转换耗时)")
+    presets_parser.add_argument("--corpus", help="用作语料的音频文件目录，缺省时生成固定的测试语料")
+    presets_parser.add_argument("--seconds", type=float, default=30, help="生成的每个语料文件的时长")
+    presets_parser.add_argument("--threads", type=int, help="覆盖预设的编解码线程数，0 表示自动")
+    presets_parser.add_argument("--repeat", type=int, default=3)
+    presets_parser.set_defaults(func=run_conversion_presets)
+
+    peaks_parser = subparsers.add_parser("waveform-peaks", help="测量波形概览的计算速度 (实时倍数) 和缓存读取耗时")
+    peaks_parser.add_argument("file", nargs="?", help="用于测试的音频文件，缺省时生成一个 FLAC 测试文件")
+    peaks_parser.add_argument("--seconds", type=float, default=300, help="生成的测试文件的时长")
+    peaks_parser.add_argument("--repeat", type=int, default=3)
+    peaks_parser.set_defaults(func=run_waveform_peaks)
+
+    loudness_parser = subparsers.add_parser("loudness", help="测量响度分析的速度和播放时音量标准化增益的开销")
+    loudness_parser.add_argument("file", nargs="?", help="用于测试的音频文件，缺省时生成一个 FLAC 测试文件")
+    loudness_parser.add_argument("--seconds", type=float, default=300, help="生成的测试文件的时长")
+    loudness_parser.add_argument("--repeat", type=int, default=3)
+    loudness_parser.set_defaults(func=run_loudness)
+
+    duplicates_parser = subparsers.add_parser("duplicate-matching", help="测量按声学指纹查找重复的匹配耗时和查全率")
+    duplicates_parser.add_argument("--entries", type=int, default=100_000)
+    duplicates_parser.add_argument("--duplicates", type=int, default=1000, help="埋入的重复对数")
+    duplicates_parser.add_argument("--repeat", type=int, default=3)
+    duplicates_parser.set_defaults(func=run_duplicate_matching)
+
+    exact_parser = subparsers.add_parser("exact-duplicates", help="比较查找完全相同的文件时分桶加部分哈希与全部完整哈希的读取量和耗时")
+    exact_parser.add_argument("--files", type=int, default=500)
+    exact_parser.add_argument("--max-size", type=float, default=8, help="生成的文件的最大大小 (MB)")
+    exact_parser.set_defaults(func=run_exact_duplicates)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,32 @@
 import os
 import sys
+import json
 import time
+import threading
+import sqlite3
 import queue
+import struct
+import hashlib
+import itertools
+import mmap
 import subprocess
+import multiprocessing
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from enum import Enum, auto
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QFileDialog,
                              QPushButton, QLabel, QLineEdit, QComboBox, QMessageBox,
                              QAction, QMenu, QToolBar, QStatusBar, QSpinBox,
-                             QTreeWidget, QTreeWidgetItem, QHeaderView, QSlider, QStyle, QStyleOptionSlider, 
-                             QSplitter, QListWidget,QListWidgetItem) # <--- 修改导入
-from PyQt5.QtCore import Qt, QSize, QThread, pyqtSignal, QTimer
-from PyQt5.QtGui import QIcon, QFont
+                             QTableView, QAbstractItemView, QHeaderView, QSlider, QStyle, QStyleOptionSlider, 
+                             QSplitter, QListWidget,QListWidgetItem, QActionGroup,
+                             QDialog, QProgressBar, QTableWidget, QTableWidgetItem) # <--- 修改导入
+from PyQt5.QtCore import (Qt, QThread, pyqtSignal, QTimer, QObject, QFileSystemWatcher,
+                          QAbstractTableModel, QModelIndex, QItemSelection, QItemSelectionModel, QLineF, QRect)
+from PyQt5.QtGui import QIcon, QFont, QPainter, QColor
 import pyaudio
 import av          # This is the new core library
+import numpy as np
     
 class ClickableSlider(QSlider):
     """
@@ -22,6 +36,58 @@ class ClickableSlider(QSlider):
     """
     def __init__(self, orientation, parent=None):
         super(ClickableSlider, self).__init__(orientation, parent)
+        self._peaks = None              # 波形概览: (段数, 2) 的 int8 数组，每段的最小值和最大值
+        self._peak_fraction = 1.0       # _peaks 覆盖了整首歌的多少 (后台还在计算时小于 1)
+        self._waveform_cache = None     # (缓存键, 线段列表)
+
+    def set_peaks(self, peaks, fraction=1.0):
+        """在滑轨后面画出波形概览；peaks 为 None 时不画。fraction 小于 1 时只画出开头这一部分。"""
+        self._peaks = peaks
+        self._peak_fraction = fraction
+        self._waveform_cache = None
+        self.update()
+
+    def paintEvent(self, event):
+        if self._peaks is not None and len(self._peaks) and self.orientation() == Qt.Horizontal:
+            opt = QStyleOptionSlider()
+            self.initStyleOption(opt)
+            groove = self.style().subControlRect(QStyle.CC_Slider, opt, QStyle.SC_SliderGroove, self)
+            handle = self.style().subControlRect(QStyle.CC_Slider, opt, QStyle.SC_SliderHandle, self)
+            lines = self._waveform_lines(groove)
+            painter = QPainter(self)
+            painter.setPen(QColor("#b0bec5"))
+            painter.drawLines(lines)
+            # 已播放的部分换一种颜色
+            painter.setClipRect(QRect(groove.left(), 0, handle.center().x() - groove.left(), self.height()))
+            painter.setPen(QColor("#42a5f5"))
+            painter.drawLines(lines)
+            painter.end()
+        super().paintEvent(event)
+
+    def _waveform_lines(self, groove):
+        """
+        每个像素列一条竖线，覆盖该列对应各段的最小到最大值，按整首歌的峰值归一化，较安静的录音也看得清。
+        结果按尺寸缓存，播放时的重绘不必重算。
+        """
+        key = (groove.left(), groove.width(), self.height(), self._peak_fraction)
+        if self._waveform_cache is not None and self._waveform_cache[0] == key:
+            return self._waveform_cache[1]
+        width = int(groove.width() * self._peak_fraction)
+        lines = []
+        if width > 0:
+            peaks = self._peaks
+            starts = np.linspace(0, len(peaks), width, endpoint=False).astype(np.intp)
+            lows = np.minimum.reduceat(peaks[:, 0], starts).astype(np.float32)
+            highs = np.maximum.reduceat(peaks[:, 1], starts).astype(np.float32)
+            scale = (self.height() / 2 - 1) / max(1, int(np.abs(peaks.astype(np.int16)).max()))
+            middle = self.height() / 2
+            tops = middle - highs * scale
+            bottoms = middle - lows * scale
+            left = groove.left()
+            lines = [QLineF(left + x, top, left + x, bottom)
+                     for x, (top, bottom) in enumerate(zip(tops.tolist(), bottoms.tolist()))]
+        self._waveform_cache = (key, lines)
+        return lines
 
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
@@ -54,351 +120,3486 @@ class ClickableSlider(QSlider):
                     self.minimum(), self.maximum(), slider_pos, slider_len, opt.upsideDown
                 )
 
-                # Clamp the value to be within the valid range, just in case
-                if value < self.minimum():
-                    value = self.minimum()
-                if value > self.maximum():
-                    value = self.maximum()
+                # Clamp the value to be within the valid range, just in case
+                if value < self.minimum():
+                    value = self.minimum()
+                if value > self.maximum():
+                    value = self.maximum()
+
+                if self.value() != value:
+                    self.setValue(value)
+
+                # 依然调用super()，以支持“点击后直接拖动”的无缝体验
+                super().mousePressEvent(event)
+
+
+PEAK_COUNT = 2048   # 波形概览把整首歌均分成这么多段
+PEAK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".audiohub", "peaks")
+PEAK_CACHE_HEADER = struct.Struct("<4sB3xqqI")   # 标识, 版本, 文件大小, 修改时间(ns), 段数
+PEAK_CACHE_MAGIC, PEAK_CACHE_VERSION = b"AHPK", 1
+
+
+def compute_peaks(file_path, peak_count=PEAK_COUNT, progress_callback=None, should_stop=None):
+    """
+    解码整首歌，按时间均分成 peak_count 段，返回形如 (peak_count, 2) 的 int8 数组：
+    每段所有声道中的最小值和最大值，±127 对应满幅。
+    解码出的帧先攒起来，够若干整段时一次性 reshape 成 (声道, 段, 每段样本数) 求最值，
+    Python 层面只有按帧的循环，逐样本的工作都在 NumPy 里完成。
+    progress_callback(peaks, filled) 在每次算出新的段后调用，peaks 的前 filled 段已经可用；
+    should_stop() 返回 True 时中止并返回 None。
+    """
+    with av.open(file_path) as container:
+        stream = container.streams.audio[0]
+        if stream.duration:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration:
+            duration = container.duration / av.time_base
+        else:
+            raise ValueError("无法获取时长")
+        samples_per_peak = max(1, int(np.ceil(duration * stream.rate / peak_count)))
+        peaks = np.zeros((peak_count, 2), dtype=np.int8)
+        filled = 0
+        pending, pending_samples = [], 0
+        full_scale = None
+
+        def reduce(data, count):
+            """把 data 的前 count 段写入 peaks。"""
+            nonlocal filled
+            count = min(count, peak_count - filled)
+            if count <= 0: return
+            blocks = data[:, :count * samples_per_peak].reshape(data.shape[0], count, -1)
+            lows = blocks.min(axis=(0, 2)).astype(np.float32)
+            highs = blocks.max(axis=(0, 2)).astype(np.float32)
+            peaks[filled:filled + count, 0] = np.clip(np.round(lows * (127 / full_scale)), -127, 127)
+            peaks[filled:filled + count, 1] = np.clip(np.round(highs * (127 / full_scale)), -127, 127)
+            filled += count
+
+        for frame in container.decode(stream):
+            if should_stop is not None and should_stop():
+                return None
+            data = frame.to_ndarray()
+            if not frame.format.is_planar:
+                data = data.reshape(-1, len(frame.layout.channels)).T
+            if full_scale is None:
+                full_scale = 1.0 if data.dtype.kind == 'f' else float(np.iinfo(data.dtype).max)
+            pending.append(data)
+            pending_samples += data.shape[1]
+            if pending_samples >= samples_per_peak:
+                data = np.concatenate(pending, axis=1) if len(pending) > 1 else pending[0]
+                count = pending_samples // samples_per_peak
+                reduce(data, count)
+                rest = data[:, count * samples_per_peak:]
+                pending, pending_samples = ([rest], rest.shape[1]) if rest.shape[1] else ([], 0)
+                if progress_callback is not None: progress_callback(peaks, filled)
+        if pending_samples and filled < peak_count:
+            data = np.concatenate(pending, axis=1)
+            samples_per_peak = data.shape[1]
+            reduce(data, 1)
+        # 实际时长比文件头记录的短时，后面的段保持为 0
+        return peaks
+
+
+def _peak_cache_path(file_path):
+    key = hashlib.sha1(os.fsencode(file_path)).hexdigest()
+    return os.path.join(PEAK_CACHE_DIR, key + ".peaks")
+
+
+def load_cached_peaks(file_path):
+    """读取波形概览的缓存。文件大小或修改时间与缓存不符、或没有缓存时返回 None。"""
+    try:
+        stat = os.stat(file_path)
+        with open(_peak_cache_path(file_path), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < PEAK_CACHE_HEADER.size: return None
+    magic, version, size, mtime, count = PEAK_CACHE_HEADER.unpack_from(data)
+    if (magic, version, size, mtime) != (PEAK_CACHE_MAGIC, PEAK_CACHE_VERSION, stat.st_size, stat.st_mtime_ns):
+        return None
+    peaks = np.frombuffer(data, dtype=np.int8, offset=PEAK_CACHE_HEADER.size)
+    return peaks.reshape(count, 2) if len(peaks) == count * 2 else None
+
+
+def save_cached_peaks(file_path, peaks, stat):
+    """把波形概览写入缓存，每首歌一个小文件 (2048 段约 4 KB)。stat 是开始计算前文件的状态。"""
+    cache_path = _peak_cache_path(file_path)
+    try:
+        os.makedirs(PEAK_CACHE_DIR, exist_ok=True)
+        temp_path = cache_path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(PEAK_CACHE_HEADER.pack(PEAK_CACHE_MAGIC, PEAK_CACHE_VERSION,
+                                           stat.st_size, stat.st_mtime_ns, len(peaks)))
+            f.write(peaks.tobytes())
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Error writing peak cache: {e}")
+
+
+class PeakOverviewThread(QThread):
+    """
+    在后台为正在播放的歌曲计算波形概览。计算过程中定期发出已算好的部分，
+    进度条上的波形从左往右逐步画出；算完后写入缓存，下次打开同一首歌直接读取。
+    """
+    peaks_updated = pyqtSignal(str, object, float)   # 文件路径, 已算好的段, 占整首歌的比例
+
+    UPDATE_INTERVAL = 0.1
+
+    def __init__(self, file_path, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self._stopped = False
+        self._next_update = 0.0
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self):
+        try:
+            stat = os.stat(self.file_path)
+            peaks = compute_peaks(self.file_path, progress_callback=self._report, should_stop=lambda: self._stopped)
+        except (av.FFmpegError, OSError, ValueError, IndexError) as e:
+            print(f"Error computing peaks for {self.file_path}: {e}")
+            return
+        if peaks is None: return
+        save_cached_peaks(self.file_path, peaks, stat)
+        self.peaks_updated.emit(self.file_path, peaks, 1.0)
+
+    def _report(self, peaks, filled):
+        now = time.perf_counter()
+        if now >= self._next_update:
+            self._next_update = now + self.UPDATE_INTERVAL
+            self.peaks_updated.emit(self.file_path, peaks[:filled].copy(), filled / len(peaks))
+
+
+class PreparedTrack:
+    """
+    一个已经打开并预先解码了若干帧的音轨。
+    无缝播放时，播放线程会在当前曲目结束前用它提前准备好下一首。
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.container = av.open(file_path)
+        self.audio_stream = self.container.streams.audio[0]
+        self.sample_rate = self.audio_stream.rate
+        self.channels = self.audio_stream.layout.nb_channels
+        self.layout_name = self.audio_stream.layout.name
+        self.source_format = self.audio_stream.codec_context.format.name
+        self.source_bits = self.audio_stream.codec_context.format.bits
+
+        if self.audio_stream.duration:
+            self.duration_sec = float(self.audio_stream.duration * self.audio_stream.time_base)
+        elif self.container.duration:
+            self.duration_sec = float(self.container.duration / av.time_base)
+        else:
+            self.duration_sec = 0.0
+
+        self._decoder = self.container.decode(self.audio_stream)
+        self._buffered = deque()
+        self._trim_before_sec = None    # 跳转后需要丢弃的预滚动数据的截止时间
+
+    def prefetch(self, frame_count):
+        """预先解码最多 frame_count 帧，消除切歌时的打开和首帧解码延迟。"""
+        while len(self._buffered) < frame_count:
+            try:
+                self._buffered.append(next(self._decoder))
+            except StopIteration:
+                break
+
+    def frames(self):
+        """依次产出预解码的帧和剩余的解码帧，跳转后会先裁掉目标位置之前的数据。"""
+        while True:
+            if self._buffered:
+                frame = self._buffered.popleft()
+            else:
+                try:
+                    frame = next(self._decoder)
+                except StopIteration:
+                    return
+            if self._trim_before_sec is not None:
+                frame = self._trim_preroll(frame)
+                if frame is None:
+                    continue
+            yield frame
+
+    def seek(self, position_sec):
+        """
+        在已打开的容器内原地跳转，不再关闭并重新打开文件。
+        容器只能定位到目标之前的关键帧，多解出来的预滚动数据由 frames() 按采样精度丢弃。
+        """
+        pts_target = int(position_sec / self.audio_stream.time_base)
+        self.container.seek(pts_target, stream=self.audio_stream, backward=True)
+        self.audio_stream.codec_context.flush_buffers()
+        self._decoder = self.container.decode(self.audio_stream)
+        self._buffered.clear()
+        self._trim_before_sec = position_sec
+
+    def _trim_preroll(self, frame):
+        """丢弃帧中位于跳转目标之前的采样；整帧都在目标之前时返回 None。"""
+        if frame.pts is None or frame.time_base is None:
+            self._trim_before_sec = None
+            return frame
+
+        frame_start_sec = float(frame.pts * frame.time_base)
+        skip = int(round((self._trim_before_sec - frame_start_sec) * frame.sample_rate))
+        if skip >= frame.samples:
+            return None
+        self._trim_before_sec = None
+        if skip <= 0:
+            return frame
+
+        array = frame.to_ndarray()
+        if frame.format.is_planar:
+            array = array[:, skip:]
+        else:
+            array = array[:, skip * frame.layout.nb_channels:]
+        trimmed = av.AudioFrame.from_ndarray(np.ascontiguousarray(array), format=frame.format.name, layout=frame.layout.name)
+        trimmed.sample_rate = frame.sample_rate
+        trimmed.time_base = frame.time_base
+        trimmed.pts = frame.pts + int(skip / frame.sample_rate / frame.time_base)
+        return trimmed
+
+    def close(self):
+        if self.container:
+            self.container.close()
+            self.container = None
+
+
+class AudioRingBuffer:
+    """
+    预分配的单生产者/单消费者环形缓冲区。
+    解码线程只移动写指针，音频回调线程只移动读指针。两个指针都是单调递增的整数，
+    在 GIL 下的读写是原子的，因此数据通路上不需要任何锁。
+    """
+    def __init__(self, capacity_bytes):
+        self.capacity = capacity_bytes
+        self._buffer = np.zeros(capacity_bytes, dtype=np.uint8)
+        self._write_pos = 0
+        self._read_pos = 0
+        self._discard_until = 0
+
+    @property
+    def write_position(self):
+        """累计写入的字节数 (包括后来被丢弃的部分)。"""
+        return self._write_pos
+
+    @property
+    def read_position(self):
+        """回调线程累计读到的位置，与 write_position 处于同一坐标系。"""
+        return self._read_pos
+
+    @property
+    def available_read(self):
+        return self._write_pos - max(self._read_pos, self._discard_until)
+
+    @property
+    def available_write(self):
+        return self.capacity - self.available_read
+
+    def write(self, data):
+        """写入尽可能多的数据，返回实际写入的字节数。只能由生产者调用。"""
+        source = np.frombuffer(data, dtype=np.uint8)
+        count = min(len(source), self.available_write)
+        if count <= 0:
+            return 0
+        start = self._write_pos % self.capacity
+        first = min(count, self.capacity - start)
+        self._buffer[start:start + first] = source[:first]
+        if count > first:
+            self._buffer[:count - first] = source[first:count]
+        self._write_pos += count
+        return count
+
+    def read_into(self, out, nbytes):
+        """把最多 nbytes 字节复制到 out 中，返回实际读取的字节数。只能由消费者调用。"""
+        read_pos = max(self._read_pos, self._discard_until)
+        count = min(nbytes, self._write_pos - read_pos)
+        if count <= 0:
+            self._read_pos = read_pos
+            return 0
+        start = read_pos % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self._buffer[start:start + first]
+        if count > first:
+            out[first:count] = self._buffer[:count - first]
+        self._read_pos = read_pos + count
+        return count
+
+    def discard_pending(self):
+        """丢弃所有尚未播放的数据（跳转、切歌时使用）。只能由生产者调用。"""
+        self._discard_until = self._write_pos
+
+
+class TpdfDither:
+    """
+    把交错的 float32 PCM 量化为 s16，量化前叠加 ±1 LSB 的三角概率分布(TPDF)抖动，
+    使截断误差变成与信号无关的白噪声。只在确实要降低位深时使用。
+    """
+    def __init__(self):
+        self._rng = np.random.default_rng()
+        self._noise = np.empty(0, dtype=np.float32)
+        self._work = np.empty(0, dtype=np.float32)
+        self._output = np.empty(0, dtype=np.int16)
+
+    def process(self, samples, gain=1.0):
+        """
+        返回量化后的 int16 数组。数组在下次调用时会被复用，调用方需在此之前用完。
+        gain 是音量标准化的线性增益，并入量化前原本就有的那次缩放，不多花一次遍历。
+        """
+        count = len(samples)
+        if count > len(self._output):
+            self._noise = np.empty(count, dtype=np.float32)
+            self._work = np.empty(count, dtype=np.float32)
+            self._output = np.empty(count, dtype=np.int16)
+        noise, work, output = self._noise[:count], self._work[:count], self._output[:count]
+
+        np.multiply(samples, 32767.0 * gain, out=work)
+        # 两个独立均匀分布之差即为三角分布
+        self._rng.random(out=noise, dtype=np.float32)
+        np.add(work, noise, out=work)
+        self._rng.random(out=noise, dtype=np.float32)
+        np.subtract(work, noise, out=work)
+        np.rint(work, out=work)
+        np.clip(work, -32768, 32767, out=work)
+        output[:] = work
+        return output
+
+
+class SampleGain:
+    """
+    把音量标准化的增益原地乘到交错 PCM 上，不产生新的数组。
+    浮点数据直接相乘；整数数据先复制进复用的 float64 缓冲区，乘完再写回原数组，
+    不让 NumPy 每批都临时分配类型转换用的缓冲区。增益已按真峰值留出余量，写回时不会溢出。
+    """
+    def __init__(self):
+        self._work = np.empty(0, dtype=np.float64)
+
+    def apply(self, samples, gain):
+        if samples.dtype.kind == 'f':
+            np.multiply(samples, gain, out=samples)
+            return
+        if len(samples) > len(self._work):
+            self._work = np.empty(len(samples), dtype=np.float64)
+        work = self._work[:len(samples)]
+        np.copyto(work, samples)
+        np.multiply(work, gain, out=work)
+        np.rint(work, out=work)
+        np.copyto(samples, work, casting='unsafe')
+
+
+class AudioPlayerThread(QThread):
+    # 播放位置不再通过信号逐帧发送，而是写入 published_position 由界面定时读取
+    playback_started = pyqtSignal(str, float)
+    playback_finished = pyqtSignal()
+    playback_error = pyqtSignal(str)
+    seek_completed = pyqtSignal(int, float)   # 跳转目标(秒), 实测跳转耗时(毫秒)
+    track_changed = pyqtSignal(str)   # 无缝切换到下一首时发出
+    buffer_underrun = pyqtSignal(int)  # 输出缓冲区欠载的累计次数
+    output_format_changed = pyqtSignal(str)   # 当前输出格式与转换路径的描述
+
+    FRAMES_PER_BUFFER = 1024     # 每次音频回调请求的采样帧数
+    DEFAULT_BUFFER_MS = 250      # 环形缓冲区默认深度
+    PRIME_MS = 60                # 开始输出前至少要缓冲的音频长度
+    OUTPUT_BATCH_FRAMES = 2048   # 重采样器把零碎的小帧攒成这么大的一批再写入缓冲区
+    POSITION_UPDATE_HZ = 50      # 刷新 published_position 的频率
+    PRELOAD_AHEAD_SEC = 5.0      # 距离曲目结束多少秒时开始准备下一首
+    PRELOAD_FRAMES = 8           # 提前解码的帧数
+    STREAM_IDLE_TIMEOUT = 2.0    # 空闲多久后才真正关闭输出设备
+
+    # 可直接交给设备的采样格式，以及对应的显示名称
+    OUTPUT_FORMATS = {'s16': pyaudio.paInt16, 's32': pyaudio.paInt32, 'flt': pyaudio.paFloat32}
+    FORMAT_LABELS = {'s16': "16-bit", 's32': "32-bit", 'flt': "32-bit float"}
+    SAMPLE_DTYPES = {'s16': np.int16, 's32': np.int32, 'flt': np.float32}
+
+    def __init__(self):
+        super().__init__()
+        # 播放队列和命令队列都由界面线程写入、本线程读取；
+        # 每次写入都会置位 _wakeup，本线程在没有事可做时阻塞在它上面，不再轮询
+        self.play_queue = deque()
+        self.command_queue = deque()
+        self._queue_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = False
+        
+        self.p_audio = pyaudio.PyAudio()
+        self.stream = None
+        self.stream_format = None    # (采样率, 声道数, 声道布局名, 采样格式)，用于判断输出流能否复用
+        self._idle_since = None
+
+        # --- 回调模式输出 ---
+        # 解码线程(即本线程)往环形缓冲区里写，PortAudio 的回调线程从里面读
+        self.buffer_duration_ms = self.DEFAULT_BUFFER_MS
+        self._reopen_output = False
+        self.ring_buffer = None
+        self._callback_buffer = None
+        self._silence = b""
+        self._frame_bytes = 0
+        self._prime_bytes = 0
+        self._output_paused = False      # 回调线程直接读取，暂停可立即生效
+        self._output_gate_open = False   # 预缓冲完成前回调只输出静音
+        self._draining = False           # 曲目末尾排空缓冲区时，读空不算欠载
+        self._requested_seek = None
+        self.underrun_count = 0          # 回调时缓冲区里的数据不够
+        self.device_underflow_count = 0  # PortAudio 报告的设备级欠载
+        self._reported_underruns = 0
+
+        # --- 输出采样格式 ---
+        # 高位深或浮点音源优先以 flt/s32 直通，设备不支持时才退回 s16
+        self.high_resolution_output = True
+        self._format_support = {}        # (采样格式, 采样率, 声道数) -> 设备是否支持
+        self._dither = None              # 降到 s16 时使用的 TpdfDither
+        self._output_description = None
+        # --- 采样精确的播放时钟 ---
+        # 回调线程记录 (本次交给设备的起始帧, 结束帧, 回调时刻, 到达扬声器的延迟)，
+        # 帧序号与环形缓冲区的读写指针处于同一坐标系。
+        self._clock = (0, 0, time.perf_counter(), 0.0)
+        self._last_audible_frame = 0.0
+        self._output_latency = 0.0
+        # 每一段连续音频在缓冲区中的起始帧及其对应的媒体位置 (起始帧, 秒, 曲目信息或 None)
+        self._segments = deque()
+        self.position_update_hz = self.POSITION_UPDATE_HZ
+        self._next_position_emit = 0.0
+        self.published_position = 0.0   # 只由本线程写入，界面线程用 QTimer 轮询读取
+        
+        self.current_file = None
+        self.total_duration_sec = 0
+        
+        self._paused = False
+        self._pause_settled = False
+        self._interrupt = False
+        self.is_song_active = False
+        self._seek_target_sec = None
+        self._seek_requested_at = None
+        self.last_seek_latency_ms = 0.0
+
+        # --- 无缝播放 ---
+        self.gapless = True
+        self._next_file = None          # 由界面告知的下一首，受 _next_lock 保护
+        self._next_after = None         # 界面认为 _next_file 应该接在哪一首后面
+        self._next_lock = threading.Lock()
+        self._preloaded = None          # 只在播放线程内部访问的 PreparedTrack
+
+        # --- 音量标准化 ---
+        # 设置了音频库索引时，每首歌开始播放前查一次它的响度分析结果，换算成线性增益
+        self.normalization_index = None
+        self._gain = 1.0
+        self._sample_gain = SampleGain()
+        
+    @property
+    def is_active(self):
+        return self.is_song_active
+
+    def run(self):
+        while not self._stop:
+            with self._queue_lock:
+                file_path = self.play_queue.popleft() if self.play_queue else None
+            if file_path is None:
+                self._wait_while_idle()
+                continue
+
+            if not os.path.isfile(file_path):
+                continue
+            
+            self._interrupt = False
+            self.is_song_active = True
+            self._seek_requested_at = None # 重置
+            
+            track = None
+            try:
+                track = self._take_preloaded(file_path) or PreparedTrack(file_path)
+                is_gapless_transition = False
+                while track is not None:
+                    next_track = self._play_track(track, is_gapless_transition)
+                    track.close()
+                    track = next_track
+                    is_gapless_transition = True
+
+                if not self._stop and not self._interrupt:
+                    self.playback_finished.emit()
+
+            except Exception as e:
+                self.playback_error.emit(f"({os.path.basename(self.current_file or file_path)}): {e}")
+            finally:
+                self.is_song_active = False
+                self._output_gate_open = False
+                self._idle_since = time.time()
+                if self._interrupt and self.ring_buffer:
+                    # 用户主动切歌或停止，缓冲区里剩下的旧音频不应再播出来
+                    self.ring_buffer.discard_pending()
+                if track:
+                    track.close()
+        
+        self._discard_preloaded()
+        self._close_output_stream()
+        self.p_audio.terminate()
+
+    def _play_track(self, track, is_gapless_transition):
+        """
+        播放单个音轨直到结束。
+        如果可以无缝衔接下一首，返回已准备好的下一首 PreparedTrack，否则返回 None。
+        """
+        self._ensure_output_stream(track, is_gapless_transition)
+        self._gain = self._track_gain(track)
+        resampler = self._create_resampler(track)
+        self._report_output_format(track, resampler)
+
+        if is_gapless_transition:
+            # 上一首还有一个缓冲区的音频没播完，等新曲目真正被听到时再通知界面
+            self._mark_segment(0.0, (track.file_path, track.duration_sec))
+        else:
+            self._segments.clear()
+            self._mark_segment(0.0)
+            self._output_gate_open = False
+            self.published_position = 0.0
+            self.current_file = track.file_path
+            self.total_duration_sec = track.duration_sec
+            self.playback_started.emit(track.file_path, self.total_duration_sec)
+        self._paused = False
+        self._output_paused = False
+
+        seek_target = None
+        while True:
+            for frame in track.frames():
+                if self._stop or self._interrupt: break
+
+                if self._paused and self._seek_requested_at is not None:
+                    # 暂停状态下跳转：目标位置的首帧已经解码就绪，即视为跳转完成
+                    self._report_seek_completed()
+                
+                # --- 1. 命令处理与暂停等待区 ---
+                # 这是一个统一的循环，它会一直处理命令，直到播放器不处于暂停状态
+                # 并且没有 seek 请求。
+                while self._paused or self.command_queue:
+                    seek_val = self.process_commands()
+                    if seek_val is not None:
+                        seek_target = seek_val
+                        break # 收到 seek 指令，跳出等待循环
+                    
+                    # 如果处理完命令后仍然是暂停状态，就一直睡到下一条命令到来
+                    if self._paused:
+                        self._wait_while_paused()
+                    else:
+                        # 如果不是暂停状态了（比如收到了unpause），就跳出等待循环
+                        break
+                    
+                    if self._stop or self._interrupt: break
+                
+                if self._stop or self._interrupt or seek_target is not None: break
+
+                # --- 2. 音频帧处理区 ---
+                # 能走到这里，说明播放器一定处于“播放”状态
+                frames_to_process = [frame]
+                if resampler:
+                    frames_to_process = resampler.resample(frame)
+
+                for final_frame in frames_to_process:
+                    if not self._write_frame(final_frame): break
+
+                if self._requested_seek is not None:
+                    seek_target = self._requested_seek
+                    self._requested_seek = None
+                    break
+
+                if self._seek_requested_at is not None:
+                    self._report_seek_completed()
+                self._report_underruns()
+                self._publish_position()
+                if frame.pts is not None:
+                    self._maybe_preload_next(track, float(frame.pts * frame.time_base))
+
+            if seek_target is None and not (self._stop or self._interrupt) and resampler:
+                # 冲刷重采样器里攒着的最后不足一批的采样，否则每首歌结尾都会被截掉一点
+                for final_frame in resampler.resample(None):
+                    if not self._write_frame(final_frame): break
+
+            if seek_target is None and not (self._stop or self._interrupt):
+                successor = self._take_gapless_successor(track)
+                if successor is not None:
+                    return successor
+                # 没有可衔接的下一首：等缓冲区里剩下的音频播完，期间仍可响应跳转。
+                # 很短的曲目解码完时界面可能还没更新下一首，排空期间补上的照样可以衔接
+                seek_target = self._drain_output(lambda: self.gapless and self._next_file_after(track) is not None)
+                if seek_target is None and not (self._stop or self._interrupt):
+                    successor = self._take_gapless_successor(track)
+                    if successor is not None:
+                        return successor
+
+            if seek_target is None:
+                break
+            track.seek(seek_target)
+            resampler = self._create_resampler(track)
+            self.ring_buffer.discard_pending()
+            self._mark_segment(seek_target)
+            self._output_gate_open = False
+            seek_target = None
+
+        return None
+
+    # --- 输出流管理 ---
+    def _ensure_output_stream(self, track, is_gapless_transition):
+        """
+        采样率和声道数一致时直接复用已打开的输出流。
+        无缝切换时即使格式不同也不重开设备，而是把音频重采样到当前流的格式。
+        """
+        sample_format = self._negotiate_output_format(track)
+        if self.stream is not None:
+            rate, channels, _, current_format = self.stream_format
+            if is_gapless_transition:
+                return
+            if not self._reopen_output and rate == track.sample_rate and channels == track.channels \
+                    and current_format == sample_format:
+                return
+            self._close_output_stream()
+
+        self._frame_bytes = track.channels * self.p_audio.get_sample_size(self.OUTPUT_FORMATS[sample_format])
+        buffer_frames = max(int(track.sample_rate * self.buffer_duration_ms / 1000), self.FRAMES_PER_BUFFER * 2)
+        self.ring_buffer = AudioRingBuffer(buffer_frames * self._frame_bytes)
+        self._prime_bytes = min(int(track.sample_rate * self.PRIME_MS / 1000) * self._frame_bytes,
+                                self.ring_buffer.capacity // 2)
+        self._callback_buffer = np.zeros(self.FRAMES_PER_BUFFER * self._frame_bytes, dtype=np.uint8)
+        self._silence = bytes(self.FRAMES_PER_BUFFER * self._frame_bytes)
+        self._output_gate_open = False
+        self._reopen_output = False
+        self._clock = (0, 0, time.perf_counter(), 0.0)
+        self._last_audible_frame = 0.0
+        self._segments.clear()
+
+        self.stream_format = (track.sample_rate, track.channels, track.layout_name, sample_format)
+        self.stream = self.p_audio.open(
+            format=self.OUTPUT_FORMATS[sample_format], channels=track.channels, rate=track.sample_rate, output=True,
+            frames_per_buffer=self.FRAMES_PER_BUFFER, stream_callback=self._audio_callback)
+        self._output_latency = self.stream.get_output_latency()
+
+    def _negotiate_output_format(self, track):
+        """
+        根据音源选择输出采样格式：16 位及以下的音源直接用 s16；
+        浮点音源优先 flt，整数高位深音源优先 s32，设备都不支持时才退回 s16。
+        """
+        if not self.high_resolution_output or track.source_bits <= 16:
+            return 's16'
+        if track.source_format.startswith(('flt', 'dbl')):
+            candidates = ('flt', 's32')
+        else:
+            candidates = ('s32', 'flt')
+        for sample_format in candidates:
+            if self._output_format_supported(sample_format, track.sample_rate, track.channels):
+                return sample_format
+        return 's16'
+
+    def _output_format_supported(self, sample_format, rate, channels):
+        key = (sample_format, rate, channels)
+        if key not in self._format_support:
+            try:
+                device_index = self.p_audio.get_default_output_device_info()['index']
+                self._format_support[key] = self.p_audio.is_format_supported(
+                    rate, output_device=device_index, output_channels=channels,
+                    output_format=self.OUTPUT_FORMATS[sample_format])
+            except (ValueError, OSError):
+                # PyAudio 用 ValueError 表示格式不受支持，没有默认输出设备时抛出 OSError
+                self._format_support[key] = False
+        return self._format_support[key]
+
+    def _audio_callback(self, in_data, frame_count, time_info, status):
+        """
+        运行在 PortAudio 的回调线程中：只从环形缓冲区取数据，不解码、不加锁。
+        """
+        nbytes = frame_count * self._frame_bytes
+        if status & pyaudio.paOutputUnderflow:
+            self.device_underflow_count += 1
+
+        # 这一批数据从交给设备到真正被听到的延迟
+        delay = time_info['output_buffer_dac_time'] - time_info['current_time']
+        if not (0.0 <= delay < 1.0) or time_info['output_buffer_dac_time'] <= 0:
+            delay = self._output_latency
+        now = time.perf_counter()
+
+        ring = self.ring_buffer
+        if ring is None or self._output_paused or not self._output_gate_open:
+            # 输出静音时时钟保持不动，推算出的位置会停在最后一个真实采样上
+            return self._silence[:nbytes] if nbytes <= len(self._silence) else bytes(nbytes), pyaudio.paContinue
+
+        if nbytes > len(self._callback_buffer):
+            self._callback_buffer = np.zeros(nbytes, dtype=np.uint8)
+        out = self._callback_buffer
+        got = ring.read_into(out, nbytes)
+        if got > 0:
+            end_frame = ring.read_position // self._frame_bytes
+            self._clock = (end_frame - got // self._frame_bytes, end_frame, now, delay)
+        if got < nbytes:
+            out[got:nbytes] = 0
+            if not self._draining:
+                self.underrun_count += 1
+        if got > 0:
+            self._wakeup.set()   # 腾出了空间，唤醒可能在等待的解码线程
+        return out[:nbytes].tobytes(), pyaudio.paContinue
+
+    def _write_frame(self, frame):
+        """
+        把一帧交错格式的 PCM 直接从帧的数据平面复制进环形缓冲区。
+        不再经过 to_ndarray() 和 tobytes()，整条路径上只有这一次内存复制。
+        音量标准化的增益直接在帧的数据平面上原地相乘；降到 s16 时则交给 TpdfDither 并入量化。
+        """
+        if self._dither is not None:
+            samples = np.frombuffer(frame.planes[0], dtype=np.float32, count=frame.samples * self.stream_format[1])
+            return self._write_output(self._dither.process(samples, self._gain))
+        if self._gain != 1.0:
+            samples = np.frombuffer(frame.planes[0], dtype=self.SAMPLE_DTYPES[self.stream_format[3]],
+                                    count=frame.samples * self.stream_format[1])
+            self._sample_gain.apply(samples, self._gain)
+        nbytes = frame.samples * self._frame_bytes   # 平面缓冲区末尾可能有对齐填充
+        return self._write_output(memoryview(frame.planes[0])[:nbytes])
+
+    def _write_output(self, data):
+        """
+        把数据写入环形缓冲区，缓冲区满时等待回调线程腾出空间。
+        等待期间收到跳转、停止或切歌时放弃写入并返回 False。
+        """
+        view = memoryview(data).cast('B')
+        offset = 0
+        while offset < len(view):
+            if self._stop or self._interrupt:
+                return False
+            offset += self.ring_buffer.write(view[offset:])
+            if not self._output_gate_open and self.ring_buffer.available_read >= self._prime_bytes:
+                self._output_gate_open = True
+            if offset < len(view):
+                self._output_gate_open = True   # 缓冲区已满，必须开始输出
+                seek_val = self.process_commands()
+                if seek_val is not None:
+                    self._requested_seek = seek_val
+                    return False
+                if self._output_paused:
+                    # 暂停时回调不再读取数据，没有必要定时醒来
+                    self._wait_while_paused()
+                else:
+                    self._sleep_until_woken(self._time_to_next_publish())
+                    self._publish_position()
+        return True
+
+    def _drain_output(self, should_stop=None):
+        """
+        等待缓冲区中剩余的音频播放完毕。
+        期间如果收到跳转命令，返回跳转目标；否则返回 None。should_stop() 返回 True 时提前结束等待。
+        """
+        self._output_gate_open = True
+        self._draining = True
+        try:
+            # 缓冲区读空之后，设备里还有一段输出延迟的音频，同样要等它播完
+            while self.ring_buffer and self.stream.is_active() and \
+                  self._audible_frame() < self.ring_buffer.write_position // self._frame_bytes:
+                if self._stop or self._interrupt or (should_stop and should_stop()):
+                    return None
+                seek_val = self.process_commands()
+                if seek_val is not None:
+                    return seek_val
+                if self._output_paused:
+                    self._sleep_until_woken()
+                else:
+                    # 缓冲区读空后回调不会再唤醒我们，按发布周期醒来检查设备是否已播完
+                    self._sleep_until_woken(self._time_to_next_publish())
+                self._publish_position()
+        finally:
+            self._draining = False
+        # 排空后关闭闸门，否则空闲时的每次回调都会被当成欠载
+        self._output_gate_open = False
+        self._publish_position(force=True)
+        return None
+
+    # --- 播放时钟 ---
+    def _mark_segment(self, position_sec, track_info=None):
+        """记录从当前写指针开始写入的音频对应的媒体位置 (曲目开头或跳转目标)。"""
+        start_frame = self.ring_buffer.write_position // self._frame_bytes
+        self._segments.append((start_frame, position_sec, track_info))
+
+    def _audible_frame(self):
+        """根据回调线程最近一次记录的时钟，推算此刻扬声器正在播放的帧序号。"""
+        start_frame, end_frame, callback_time, delay = self._clock
+        frame = start_frame + (time.perf_counter() - callback_time - delay) * self.stream_format[0]
+        # 帧序号只会增长；暂停恢复后设备里先播的是之前排队的静音，位置不应倒退
+        frame = max(self._last_audible_frame, min(frame, end_frame))
+        self._last_audible_frame = frame
+        return frame
+
+    def current_position(self):
+        """
+        当前真正被听到的播放位置 (秒)。
+        由设备实际消耗的采样数推算，并扣除了输出延迟，不受解码超前或卡顿的影响。
+        """
+        if self.stream is None or not self._segments:
+            return 0.0
+        frame = self._audible_frame()
+        while len(self._segments) > 1 and self._segments[1][0] <= frame:
+            self._segments.popleft()
+            track_info = self._segments[0][2]
+            if track_info:
+                self._activate_track(*track_info)
+        start_frame, position_sec, _ = self._segments[0]
+        position = position_sec + max(0.0, frame - start_frame) / self.stream_format[0]
+        if self.total_duration_sec > 0:
+            position = min(position, self.total_duration_sec)
+        return position
+
+    def _activate_track(self, file_path, duration_sec):
+        """无缝衔接的下一首开始被听到了，此时才通知界面切换。"""
+        self.current_file = file_path
+        self.total_duration_sec = duration_sec
+        self.published_position = 0.0
+        self.track_changed.emit(file_path)
+        self.playback_started.emit(file_path, duration_sec)
+
+    def _publish_position(self, force=False):
+        """以固定频率把当前位置写入共享状态，界面按自己的刷新率读取，不产生跨线程信号。"""
+        now = time.perf_counter()
+        if not force and now < self._next_position_emit:
+            return
+        self._next_position_emit = now + 1.0 / self.position_update_hz
+        self.published_position = self.current_position()
+
+    def _report_underruns(self):
+        if self.underrun_count != self._reported_underruns:
+            self._reported_underruns = self.underrun_count
+            self.buffer_underrun.emit(self.underrun_count)
+
+    def _create_resampler(self, track):
+        rate, channels, layout_name, sample_format = self.stream_format
+        # 只有降低位深时才需要抖动：先转成 flt，再由 TpdfDither 量化到 s16。
+        # 16 位输出加了增益同样要重新量化，也走这条路径
+        needs_dither = track.source_bits > 16 or self._gain != 1.0
+        self._dither = TpdfDither() if sample_format == 's16' and needs_dither else None
+        target_format = 'flt' if self._dither else sample_format
+        if track.source_format == target_format and track.sample_rate == rate and track.channels == channels:
+            return None
+        # frame_size 让 MP3 这类短帧编码的输出攒成较大的批次，减少写缓冲区和唤醒的次数
+        return av.AudioResampler(format=target_format, layout=layout_name, rate=rate,
+                                 frame_size=self.OUTPUT_BATCH_FRAMES)
+
+    def _report_output_format(self, track, resampler):
+        rate, _, _, sample_format = self.stream_format
+        label = self.FORMAT_LABELS[sample_format]
+        if self._dither:
+            path = f"{track.source_format} → {label} (TPDF 抖动)"
+        elif resampler is None:
+            path = f"{label} 直通"
+        else:
+            path = f"{track.source_format} → {label}"
+        description = f"{rate / 1000:g} kHz · {path}"
+        if self._gain != 1.0:
+            description += f" · 增益 {20 * np.log10(self._gain):+.1f} dB"
+        if description != self._output_description:
+            self._output_description = description
+            self.output_format_changed.emit(description)
+
+    def _track_gain(self, track):
+        """按响度分析结果算出这首歌的线性增益；没有开启音量标准化或还没分析过的返回 1。"""
+        index = self.normalization_index
+        if index is None: return 1.0
+        try:
+            mtime = os.stat(track.file_path).st_mtime_ns
+        except OSError:
+            return 1.0
+        measured = index.cached_loudness([(track.file_path, mtime)]).get(track.file_path)
+        if measured is None: return 1.0
+        return 10 ** (normalization_gain(*measured) / 20)
+
+    def _close_output_stream(self):
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+            self.stream_format = None
+            self.ring_buffer = None
+
+    def _wait_while_idle(self):
+        """
+        没有曲目可播时阻塞等待新的请求。
+        输出流仍然打开时只等到空闲超时为止，然后释放音频设备；否则无限期地睡眠。
+        """
+        if self.stream is None:
+            self._sleep_until_woken()
+            return
+        remaining = self._idle_since + self.STREAM_IDLE_TIMEOUT - time.time()
+        if remaining > 0:
+            self._sleep_until_woken(remaining)
+            return
+        # 播放停止一段时间后再释放音频设备，以便紧接着的下一首能复用输出流
+        self._close_output_stream()
+        self._discard_preloaded()
+
+    def _wait_while_paused(self):
+        """暂停期间阻塞等待命令，不占用 CPU。"""
+        if not self._pause_settled:
+            # 暂停后设备里还会播完一个输出延迟的音频，等它结束后再记下最终位置
+            self._sleep_until_woken(self._output_latency)
+            self._publish_position(force=True)
+            self._pause_settled = True
+        else:
+            self._sleep_until_woken()
+
+    def _sleep_until_woken(self, timeout=None):
+        """
+        阻塞直到有新命令、回调腾出了缓冲区空间，或者超时。
+        调用方在醒来后必须重新检查自己等待的条件。
+        """
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def _time_to_next_publish(self):
+        return max(0.0, self._next_position_emit - time.perf_counter())
+
+    # --- 下一首的预加载 ---
+    def _maybe_preload_next(self, track, decode_pos):
+        if not self.gapless or self._preloaded is not None:
+            return
+        next_file = self._next_file_after(track)
+        if not next_file:
+            return
+        if track.duration_sec > 0 and decode_pos < track.duration_sec - self.PRELOAD_AHEAD_SEC:
+            return
+        try:
+            track = PreparedTrack(next_file)
+            track.prefetch(self.PRELOAD_FRAMES)
+            self._preloaded = track
+        except Exception:
+            # 预加载失败不影响当前播放，切歌时会按普通流程报告错误
+            self._preloaded = None
+
+    def _take_preloaded(self, file_path):
+        """如果预加载的正是要播放的文件，就直接交出它。"""
+        track = self._preloaded
+        self._preloaded = None
+        if track and track.file_path == file_path:
+            return track
+        if track:
+            track.close()
+        return None
+
+    def _next_file_after(self, track):
+        """
+        界面告知的、接在 track 后面的下一首。界面要等衔接的曲目真正被听到时才更新指针，
+        在那之前解码线程可能已经换到了下一首，这时旧的指针不能再用，否则同一首会播两遍。
+        """
+        with self._next_lock:
+            return self._next_file if self._next_after == track.file_path else None
+
+    def _take_gapless_successor(self, track):
+        if not self.gapless:
+            self._discard_preloaded()
+            return None
+        next_file = self._next_file_after(track)
+        if not next_file or not os.path.isfile(next_file):
+            self._discard_preloaded()
+            return None
+        track = self._take_preloaded(next_file)
+        if track is None:
+            try:
+                track = PreparedTrack(next_file)
+            except Exception:
+                return None
+        return track
+
+    def _discard_preloaded(self):
+        if self._preloaded:
+            self._preloaded.close()
+            self._preloaded = None
+
+    def _report_seek_completed(self):
+        """从收到跳转命令到目标位置的音频就绪的耗时，通过 seek_completed 报告出去。"""
+        self.last_seek_latency_ms = (time.perf_counter() - self._seek_requested_at) * 1000.0
+        self._seek_requested_at = None
+        self.seek_completed.emit(int(self._seek_target_sec), self.last_seek_latency_ms)
+
+    def process_commands(self):
+        try:
+            cmd, value = self.command_queue.popleft()
+        except IndexError:
+            return None
+
+        # 播放位置由播放时钟根据实际输出的采样数推算，这里不再需要记录时间偏移
+        if cmd == 'pause':
+            if not self._paused:
+                self._paused = True
+                self._pause_settled = False
+        
+        elif cmd == 'unpause':
+            self._paused = False
+
+        elif cmd == 'seek':
+            # 原地跳转代价很低，暂停时也立即执行，恢复播放时直接从新位置继续
+            self._seek_target_sec = value
+            self._seek_requested_at = time.perf_counter()
+            return value
+        return None
+
+    def _post_command(self, cmd, value=None):
+        self.command_queue.append((cmd, value))
+        self._wakeup.set()
+        
+    # --- 公共控制方法 ---
+    def pause(self):
+        self._output_paused = True   # 回调线程立即改为输出静音
+        self._post_command('pause')
+
+    def unpause(self):
+        self._output_paused = False
+        self._post_command('unpause')
+
+    def seek(self, position_sec): self._post_command('seek', position_sec)
+
+    def add_to_queue(self, file_path):
+        with self._queue_lock:
+            self.play_queue.append(file_path)
+        self._wakeup.set()
+
+    def play_now(self, file_path):
+        """打断当前播放并立即切换到指定文件 (切歌/下一首)，队列中原有的曲目被清空。"""
+        with self._queue_lock:
+            self._interrupt = True
+            self.is_song_active = False
+            self.play_queue.clear()
+            self.play_queue.append(file_path)
+        self._wakeup.set()
+
+    def set_next_track(self, file_path, after):
+        """告诉播放线程 after 这一首结束后应无缝衔接哪一首，None 表示没有下一首。"""
+        with self._next_lock:
+            self._next_file = file_path
+            self._next_after = after
+
+    def set_gapless(self, enabled):
+        self.gapless = enabled
+
+    def set_position_update_rate(self, hz):
+        """设置刷新 published_position 的频率 (次/秒)。"""
+        self.position_update_hz = max(1, hz)
+
+    def set_high_resolution_output(self, enabled):
+        """关闭后始终以 s16 输出，在下一次打开输出流时生效。"""
+        self.high_resolution_output = enabled
+        self._reopen_output = True
+
+    def set_normalization(self, library_index):
+        """传入音频库索引开启音量标准化，传 None 关闭；从下一首开始生效。"""
+        self.normalization_index = library_index
+
+    def set_buffer_duration(self, milliseconds):
+        """设置环形缓冲区的深度，在下一次打开输出流时生效。"""
+        self.buffer_duration_ms = milliseconds
+        self._reopen_output = True
+    
+    def interrupt(self):
+        self._interrupt = True
+        self.is_song_active = False
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop = True
+        self.interrupt()
+        
+    def clear_queue(self):
+        with self._queue_lock:
+            self.play_queue.clear()
+                
+    def remove_files_from_queue(self, file_paths):
+        """从播放队列中移除一批文件，队列只重建一次。"""
+        removed = set(file_paths)
+        with self._queue_lock:
+            self.play_queue = deque(item for item in self.play_queue if item not in removed)
+
+
+
+class ConversionCancelled(Exception):
+    """转换在完成前被取消。"""
+
+
+# 编码器名称 -> 它输出的编码在解码端的名称，用于判断源文件是否已经是目标编码
+STREAM_COPY_CODECS = {'mp3': 'mp3', 'libvorbis': 'vorbis'}
+
+# 转换预设，在速度和质量之间取舍。通过转换参数中的 'preset' 键选用：
+#   resampler: 传给 libswresample 的选项，filter_size/phase_shift 越大滤波越精确，也越慢；
+#   encoder:   按编码器区分的选项，LAME 的 compression_level 0 最好最慢、9 最快，FLAC 则是 0 最快、12 压缩率最高；
+#   threads:   解码器和编码器的线程数，0 表示由 FFmpeg 按核心数决定。
+#              FFmpeg 的音频编解码器里只有 FLAC、ALAC 等少数解码器支持多线程，其余会忽略这一设置。
+CONVERSION_PRESETS = {
+    'fast': {
+        'name': "快速",
+        'resampler': {'filter_size': '8', 'phase_shift': '6', 'linear_interp': '0'},
+        'encoder': {'mp3': {'compression_level': '7'}, 'flac': {'compression_level': '0'}},
+        'threads': 0,
+    },
+    'standard': {
+        'name': "标准 (FFmpeg 默认)",
+        'resampler': {},
+        'encoder': {},
+        'threads': 0,
+    },
+    'high_quality': {
+        'name': "高质量",
+        'resampler': {'filter_size': '64', 'phase_shift': '12', 'cutoff': '0.97'},
+        'encoder': {'mp3': {'compression_level': '2'}, 'flac': {'compression_level': '8'}},
+        'threads': 0,
+    },
+}
+DEFAULT_CONVERSION_PRESET = 'standard'
+
+
+def can_stream_copy(in_stream, target_format, options, encoder_options=None):
+    """
+    源音频流是否已经是目标编码、可以不经转码直接把数据包封装进目标容器。
+    例如 Ogg 里的 FLAC 转成 .flac，或同样格式的 PCM 转成 WAV。
+    MP3 只在指定的码率和源文件相同时才直接复制，否则用户要的码率就落空了；
+    转换预设为目标编码指定了编码器参数 (encoder_options，如 FLAC 的压缩级别) 时同理，总是重新编码。
+    """
+    if encoder_options:
+        return False
+    try:
+        target_codec = av.Codec(STREAM_COPY_CODECS.get(target_format, target_format), 'r')
+    except av.codec.codec.UnknownCodecError:
+        return False
+    if in_stream.codec_context.codec.id != target_codec.id:
+        return False
+    if 'b:a' in options:
+        return in_stream.bit_rate == int(options['b:a'].replace('k', '')) * 1000
+    return True
+
+
+def convert_audio(input_path, output_path, target_format='mp3', options=None, progress_callback=None, cancel_event=None,
+                  threads=None):
+    """
+    把 input_path 转换为 target_format 编码的 output_path。批量转换的工作进程调用这一实现。
+    源文件已经是目标编码时直接复制数据包换个容器，速度只受磁盘限制；目标容器不接受时再退回重新编码。
+    options 中的 'preset' 选择 CONVERSION_PRESETS 中的转换预设；threads 不为 None 时覆盖预设的线程数。
+    progress_callback(百分比) 在进度增加时调用；cancel_event 被置位后在下一帧中止，
+    删除写了一半的输出文件并抛出 ConversionCancelled。
+    """
+    options = dict(options) if options is not None else {}
+    preset = CONVERSION_PRESETS[options.pop('preset', DEFAULT_CONVERSION_PRESET)]
+    threads = preset['threads'] if threads is None else threads
+
+    def open_input():
+        container = av.open(input_path)
+        stream = container.streams.audio[0]
+        # 线程数必须在解码器打开(第一次解码)之前设置
+        stream.codec_context.thread_count = threads
+        stream.codec_context.thread_type = 'AUTO'
+        return container, stream
+
+    input_container, in_stream = open_input()
+    output_container = None
+    try:
+        
+        total_duration = in_stream.duration * in_stream.time_base if in_stream.duration else 1
+        if total_duration <= 0: total_duration = 1
+
+        last_progress = -1
+
+        def report(frame, time_base):
+            """frame 可以是解码后的帧，也可以是直接复制的数据包，两者都带 pts。"""
+            nonlocal last_progress
+            if cancel_event is not None and cancel_event.is_set():
+                raise ConversionCancelled()
+            current_time = frame.pts * time_base if frame.pts else 0
+            progress = int((current_time / total_duration) * 100)
+            if progress > last_progress:
+                last_progress = progress
+                if progress_callback: progress_callback(progress)
+
+        encoder_options = preset['encoder'].get(target_format, {})
+        if can_stream_copy(in_stream, target_format, options, encoder_options):
+            try:
+                output_container = av.open(output_path, mode='w')
+                out_stream = output_container.add_stream_from_template(in_stream)
+                for packet in input_container.demux(in_stream):
+                    if packet.dts is None: continue   # demux 在结尾产生的空包
+                    report(packet, in_stream.time_base)
+                    packet.stream = out_stream
+                    output_container.mux(packet)
+                # 文件尾在关闭时才写，目标容器也可能到这时才拒绝，所以关闭同样放在 try 里
+                output_container.close()
+                output_container = None
+                return
+            except (av.FFmpegError, ValueError) as e:
+                # 目标容器不接受这种编码等情况：丢掉写了一半的文件，从头重新编码
+                print(f"Stream copy failed, re-encoding: {e}")
+                if output_container is not None:
+                    try:
+                        output_container.close()
+                    except (av.FFmpegError, ValueError):
+                        pass
+                    output_container = None
+                if os.path.exists(output_path): os.remove(output_path)
+                input_container.close()
+                input_container, in_stream = open_input()
+                last_progress = -1
+
+        output_container = av.open(output_path, mode='w')
+
+        if target_format == 'mp3':
+            # --- MP3 转换路径: 融合了采样率和声道布局的正确处理 ---
+            
+            MP3_SUPPORTED_RATES = {8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000}
+            
+            target_rate = in_stream.rate
+            if in_stream.rate not in MP3_SUPPORTED_RATES:
+                target_rate = 44100 
+            
+            out_stream = output_container.add_stream(
+                target_format, 
+                rate=target_rate,
+                options=encoder_options
+                # layout 参数被永久、正确地移除了！
+            )
+            out_stream.codec_context.thread_count = threads
+
+            if 'b:a' in options:
+                out_stream.codec_context.bit_rate = int(options['b:a'].replace('k', '')) * 1000
+
+            # 现在，FFmpeg已经为out_stream选择了一个最佳的layout，我们用它来配置重采样器
+            resampler = av.AudioResampler(
+                format=out_stream.codec_context.format.name,
+                layout=out_stream.layout.name, # 使用FFmpeg自动选择的布局
+                rate=out_stream.rate,
+                options=preset['resampler'] or None,
+            )
+
+            for in_frame in input_container.decode(in_stream):
+                for out_frame in resampler.resample(in_frame):
+                    for packet in out_stream.encode(out_frame):
+                        output_container.mux(packet)
+                report(in_frame, in_stream.time_base)
+            
+            for out_frame in resampler.resample(None):
+                 for packet in out_stream.encode(out_frame):
+                    output_container.mux(packet)
+            for packet in out_stream.encode(None):
+                output_container.mux(packet)
+
+        else:
+            # --- 无损转换路径 (WAV, FLAC): 同样不建议强制设置 layout，让FFmpeg处理 ---
+            out_stream = output_container.add_stream(
+                target_format, 
+                rate=in_stream.rate,
+                options=encoder_options
+                # layout 参数在这里也移除，以获得更好的健壮性
+            )
+            out_stream.codec_context.thread_count = threads
+            
+            for frame in input_container.decode(in_stream):
+                for packet in out_stream.encode(frame):
+                    output_container.mux(packet)
+                report(frame, frame.time_base)
+            
+            for packet in out_stream.encode(None):
+                output_container.mux(packet)
+    except ConversionCancelled:
+        if output_container is not None:
+            output_container.close()
+            output_container = None
+            if os.path.exists(output_path): os.remove(output_path)
+        raise
+    finally:
+        input_container.close()
+        if output_container is not None:
+            output_container.close()
+
+
+# 批量转换工作进程中的全局状态，由进程池的 initializer 设置
+_worker_progress_queue = None
+_worker_cancel_event = None
+_worker_codec_threads = None
+
+
+def _init_conversion_worker(progress_queue, cancel_event, codec_threads):
+    global _worker_progress_queue, _worker_cancel_event, _worker_codec_threads
+    _worker_progress_queue = progress_queue
+    _worker_cancel_event = cancel_event
+    _worker_codec_threads = codec_threads
+
+
+def _run_conversion_job(job_id, input_path, output_path, target_format, options):
+    """在工作进程中执行一个转换任务，返回 (状态, 错误信息)。"""
+    if _worker_cancel_event.is_set():
+        return BatchConverterThread.CANCELLED, ""
+    try:
+        convert_audio(input_path, output_path, target_format, options,
+                      lambda progress: _worker_progress_queue.put((job_id, progress)), _worker_cancel_event,
+                      _worker_codec_threads)
+        return BatchConverterThread.DONE, ""
+    except ConversionCancelled:
+        return BatchConverterThread.CANCELLED, ""
+    except Exception as e:
+        return BatchConverterThread.FAILED, f"编码器: {target_format}, 选项: {options}\n错误: {e}"
+
+
+class BatchConverterThread(QThread):
+    """
+    批量转换队列。每个任务都调用 convert_audio，分发到进程池里并行执行，
+    进程数等于 CPU 核心数：编码是 CPU 密集型的，只有多进程才能绕开 GIL。
+    工作进程通过队列回报进度；取消时置位共享的事件，正在运行的任务在下一帧中止，排队的任务不再启动。
+    运行期间可以继续追加任务。
+    """
+    job_progress = pyqtSignal(int, int)        # 任务编号, 百分比
+    job_finished = pyqtSignal(int, str, str)   # 任务编号, 状态, 错误信息
+    progress = pyqtSignal(int, int, float)     # 已结束的任务数, 任务总数, 总体进度百分比
+    finished = pyqtSignal(dict)                # 汇总: 各状态的任务数、失败列表和耗时
+
+    DONE, FAILED, CANCELLED = "done", "failed", "cancelled"
+    MAX_WORKERS = os.cpu_count() or 1
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.jobs = []   # [(输入路径, 输出路径, 编码器, 选项)]
+        self._lock = threading.Lock()
+        self._next_job = 0
+        self._closed = False
+        # fork 一个已经启动了 Qt 线程的进程并不安全，各平台统一用 spawn
+        self._context = multiprocessing.get_context('spawn')
+        self._cancel_event = self._context.Event()
+        self._progress_queue = self._context.Queue()
+
+    def add_jobs(self, jobs):
+        """追加任务，返回第一个新任务的编号；本批次已经收尾或被取消时返回 None，调用方应另起一个批次。"""
+        with self._lock:
+            if self._closed or self._cancel_event.is_set(): return None
+            first_job_id = len(self.jobs)
+            self.jobs.extend(jobs)
+            return first_job_id
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self):
+        summary = {self.DONE: 0, self.FAILED: 0, self.CANCELLED: 0, 'failures': []}
+        start_time = time.perf_counter()
+        percents = {}    # 正在运行的任务编号 -> 最新进度
+        in_flight = {}
+        finished_count = 0
+        last_reported = None
+        # 进程池已经占满所有核心时，每个任务只用一个编解码线程，免得线程数成倍超额
+        codec_threads = 1 if self.MAX_WORKERS > 1 else None
+        executor = ProcessPoolExecutor(max_workers=self.MAX_WORKERS, mp_context=self._context,
+                                       initializer=_init_conversion_worker,
+                                       initargs=(self._progress_queue, self._cancel_event, codec_threads))
+        try:
+            while True:
+                with self._lock:
+                    if self._cancel_event.is_set():
+                        cancelled = range(self._next_job, len(self.jobs))
+                        self._next_job = len(self.jobs)
+                    else:
+                        cancelled = range(0)
+                    # 进程池里只放略多于进程数的任务，其余留在队列中，取消时不必逐个撤回
+                    while len(in_flight) < self.MAX_WORKERS * 2 and self._next_job < len(self.jobs):
+                        job_id = self._next_job
+                        self._next_job += 1
+                        in_flight[executor.submit(_run_conversion_job, job_id, *self.jobs[job_id])] = job_id
+                    total = len(self.jobs)
+                    if not in_flight and not cancelled:
+                        self._closed = True
+                        break
+                for job_id in cancelled:
+                    summary[self.CANCELLED] += 1
+                    finished_count += 1
+                    self.job_finished.emit(job_id, self.CANCELLED, "")
+
+                done, _ = wait(in_flight, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                self._drain_progress(percents)
+                for future in done:
+                    job_id = in_flight.pop(future)
+                    percents.pop(job_id, None)
+                    try:
+                        status, message = future.result()
+                    except Exception as e:   # 例如工作进程意外退出
+                        status, message = self.FAILED, str(e)
+                    summary[status] += 1
+                    if status == self.FAILED:
+                        summary['failures'].append((self.jobs[job_id][0], message))
+                    finished_count += 1
+                    self.job_finished.emit(job_id, status, message)
+
+                overall = (finished_count * 100 + sum(percents.values())) / max(total, 1)
+                if (finished_count, total, int(overall)) != last_reported:
+                    last_reported = (finished_count, total, int(overall))
+                    self.progress.emit(finished_count, total, overall)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._progress_queue.close()
+        summary['elapsed'] = time.perf_counter() - start_time
+        self.finished.emit(summary)
+
+    def _drain_progress(self, percents):
+        """取出工作进程回报的进度，同一任务只保留最新的值，每个任务每轮最多发出一次信号。"""
+        updated = {}
+        while True:
+            try:
+                job_id, percent = self._progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            updated[job_id] = percent
+        for job_id, percent in updated.items():
+            percents[job_id] = percent
+            self.job_progress.emit(job_id, percent)
+
+
+class LibraryIndex:
+    """
+    持久化在 SQLite 中的音频库索引，以路径为键记录文件大小和修改时间，以及文件标记、转换记录和各种分析结果的缓存。
+    打开目录时先用索引立即显示，再由扫描线程在后台只同步有变化的条目。
+    每次操作使用独立的连接，界面线程和后台线程可以同时访问；缓存都连同修改时间保存，对得上才算命中。
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".audiohub", "library.db")
+    LOOKUP_CHUNK = 500   # 每条 IN 查询带的路径数，低于旧版 SQLite 999 个参数的上限
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or self.DEFAULT_PATH
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                # WAL 模式下后台写入不会阻塞界面线程的读取
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS files (
+                        path TEXT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        mtime INTEGER NOT NULL
+                    )""")
+                # 文件标记。文件从磁盘上消失时标记不删除，而是填上当时的 size/mtime 成为游离标记，
+                # 同一个文件在别处出现时再转回来 (见 _reattach_marks)；非空即表示游离标记
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS marks (
+                        path TEXT PRIMARY KEY,
+                        size INTEGER,
+                        mtime INTEGER
+                    )""")
+                conn.execute("CREATE INDEX IF NOT EXISTS marks_detached ON marks (size, mtime) WHERE size IS NOT NULL")
+                # 每次成功转换时源文件和输出文件的状态及编码参数，增量转换据此跳过已是最新的输出
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS conversions (
+                        output_path TEXT PRIMARY KEY,
+                        source_path TEXT NOT NULL,
+                        source_size INTEGER NOT NULL,
+                        source_mtime INTEGER NOT NULL,
+                        encoder TEXT NOT NULL,
+                        options TEXT NOT NULL,
+                        output_size INTEGER NOT NULL,
+                        output_mtime INTEGER NOT NULL
+                    )""")
+                # 后台读取到的音频信息 (时长、编码、标签等)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS metadata (
+                        path TEXT PRIMARY KEY,
+                        mtime INTEGER NOT NULL,
+                        duration REAL,
+                        codec TEXT,
+                        sample_rate INTEGER,
+                        bit_depth INTEGER,
+                        bitrate INTEGER,
+                        title TEXT,
+                        artist TEXT,
+                        album TEXT
+                    )""")
+                # 响度分析结果，播放时据此计算音量标准化的增益。
+                # 响度无法测量(静音)的文件也记一行，两列为 NULL，免得每次都重新分析
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS loudness (
+                        path TEXT PRIMARY KEY,
+                        mtime INTEGER NOT NULL,
+                        integrated REAL,
+                        true_peak REAL
+                    )""")
+                # 查找重复音频用的声学指纹：粗签名很小，全部载入用来建局部敏感哈希；细指纹只在核实候选对时才读取
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS fingerprints (
+                        path TEXT PRIMARY KEY,
+                        mtime INTEGER NOT NULL,
+                        duration REAL NOT NULL,
+                        fingerprint BLOB NOT NULL,
+                        signature BLOB NOT NULL
+                    )""")
+                # 查找完全相同的文件时算出的部分哈希和完整哈希，完整哈希只在需要时才算
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS content_hashes (
+                        path TEXT PRIMARY KEY,
+                        mtime INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        partial BLOB,
+                        full BLOB
+                    )""")
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error opening library index: {e}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _path_range(directory):
+        """目录下所有路径(含子目录)在主键上的区间，可以直接走主键索引做范围查询。"""
+        prefix = directory if directory.endswith(('/', os.sep)) else directory + os.sep
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    @classmethod
+    def _select_by_path(cls, conn, table, columns, paths, key_column="path"):
+        """
+        按路径批量查询 table 中的 columns，返回 {路径: 各列组成的元组}。
+        路径按 LOOKUP_CHUNK 个一组用 IN 查询，不再每个路径单独执行一条 SELECT。
+        """
+        paths = list(paths)
+        rows = {}
+        for start in range(0, len(paths), cls.LOOKUP_CHUNK):
+            chunk = paths[start:start + cls.LOOKUP_CHUNK]
+            query = f"SELECT {key_column}, {columns} FROM {table} WHERE {key_column} IN ({','.join('?' * len(chunk))})"
+            for row in conn.execute(query, chunk):
+                rows[row[0]] = row[1:]
+        return rows
+
+    def load(self, directory, recursive=True):
+        """返回索引中记录的该目录下的文件，按路径排序。recursive=False 时不含子目录中的文件。"""
+        path_range = self._path_range(directory)
+        try:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    "SELECT path, name, size, mtime FROM files WHERE path >= ? AND path < ? ORDER BY path",
+                    path_range).fetchall()
+                # 标记单独走一次主键范围查询，比逐行联结 marks 表快
+                marked = {path for path, in conn.execute(
+                    "SELECT path FROM marks WHERE path >= ? AND path < ? AND size IS NULL", path_range)}
+        except sqlite3.Error as e:
+            print(f"Error reading library index: {e}")
+            return []
+        if not recursive:
+            prefix_length = len(path_range[0])
+            rows = [row for row in rows if '/' not in row[0][prefix_length:] and os.sep not in row[0][prefix_length:]]
+        return [{'name': name, 'path': path, 'size': size, 'mtime': mtime, 'marked': path in marked}
+                for path, name, size, mtime in rows]
+
+    def apply_changes(self, upserts=(), removed_paths=(), forget_marks=False):
+        """
+        在一个事务中写入新增/变化的条目并删除已不存在的路径。
+        被删除路径上的标记默认转为游离标记，forget_marks=True 时一并丢弃。
+        返回因匹配到游离标记而找回了标记的新路径列表。
+        """
+        upserts = list(upserts)
+        removed_paths = [(path,) for path in removed_paths]
+        try:
+            with closing(self._connect()) as conn, conn:
+                if forget_marks:
+                    conn.executemany("DELETE FROM marks WHERE path = ?", removed_paths)
+                else:
+                    conn.executemany(
+                        "UPDATE marks SET (size, mtime) = (SELECT size, mtime FROM files WHERE files.path = marks.path) "
+                        "WHERE path = ?", removed_paths)
+                conn.executemany("DELETE FROM files WHERE path = ?", removed_paths)
+                conn.executemany("DELETE FROM metadata WHERE path = ?", removed_paths)
+                conn.executemany("DELETE FROM loudness WHERE path = ?", removed_paths)
+                conn.executemany("DELETE FROM fingerprints WHERE path = ?", removed_paths)
+                # 游离标记的内容哈希留着，重命名后的文件要靠它确认身份
+                conn.executemany("DELETE FROM content_hashes WHERE path = ? AND NOT EXISTS "
+                                 "(SELECT 1 FROM marks WHERE marks.path = content_hashes.path)", removed_paths)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO files (path, name, size, mtime) VALUES (?, ?, ?, ?)",
+                    ((f['path'], f['name'], f['size'], f['mtime']) for f in upserts))
+                return self._reattach_marks(conn, upserts)
+        except sqlite3.Error as e:
+            print(f"Error writing library index: {e}")
+            return []
+
+    @staticmethod
+    def _reattach_marks(conn, upserts):
+        """
+        把游离标记转到大小和修改时间都相同的新文件上。两边都只有一个候选时才考虑：
+        文件名相同算移动；文件名不同时要游离标记留下的部分哈希与新文件一致才算重命名，否则宁可不转。
+        """
+        detached = {}
+        for path, size, mtime in conn.execute("SELECT path, size, mtime FROM marks WHERE size IS NOT NULL"):
+            detached.setdefault((size, mtime), []).append(path)
+        if not detached: return []
+        arrivals = {}
+        for f in upserts:
+            key = (f['size'], f['mtime'])
+            if key in detached: arrivals.setdefault(key, []).append(f['path'])
+        moves = []
+        for (size, mtime), new_paths in arrivals.items():
+            old_paths = detached[(size, mtime)]
+            if len(old_paths) != 1 or len(new_paths) != 1:
+                continue   # 拷贝或批量生成的文件常常大小和修改时间都一样，无法判断是哪一个
+            old_path, new_path = old_paths[0], new_paths[0]
+            if os.path.basename(old_path) == os.path.basename(new_path):
+                moves.append((old_path, new_path))
+                continue
+            row = conn.execute("SELECT partial FROM content_hashes WHERE path = ? AND size = ? AND mtime = ?",
+                               (old_path, size, mtime)).fetchone()
+            if row is None or row[0] is None: continue
+            try:
+                if content_hash(new_path, partial=True) == row[0]:
+                    moves.append((old_path, new_path))
+            except (OSError, ValueError):
+                pass
+        conn.executemany("DELETE FROM content_hashes WHERE path = ?", ((old_path,) for old_path, _ in moves))
+        conn.executemany("DELETE FROM marks WHERE path = ?", ((old_path,) for old_path, _ in moves))
+        conn.executemany("INSERT OR REPLACE INTO marks (path) VALUES (?)", ((new_path,) for _, new_path in moves))
+        return [new_path for _, new_path in moves]
+
+    def remove(self, paths):
+        """文件已在程序内删除：删掉记录，标记也不再保留。"""
+        self.apply_changes(removed_paths=paths, forget_marks=True)
+
+    def set_marked(self, paths, marked):
+        """在一个事务中标记或取消标记一批文件。"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                if marked:
+                    conn.executemany("INSERT OR REPLACE INTO marks (path) VALUES (?)", ((path,) for path in paths))
+                else:
+                    conn.executemany("DELETE FROM marks WHERE path = ?", ((path,) for path in paths))
+        except sqlite3.Error as e:
+            print(f"Error writing marks: {e}")
+
+    def clear_marks(self, directory):
+        """清除目录下(含子目录)的所有标记，包括游离标记。"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM marks WHERE path >= ? AND path < ?", self._path_range(directory))
+        except sqlite3.Error as e:
+            print(f"Error writing marks: {e}")
+
+    def cached_metadata(self, items):
+        """items: [(路径, 修改时间)]。返回 {路径: 元数据元组}，只包含修改时间与缓存一致的文件。"""
+        mtimes = dict(items)
+        cached = {}
+        try:
+            with closing(self._connect()) as conn:
+                rows = self._select_by_path(conn, "metadata", "mtime, duration, codec, sample_rate, bit_depth, "
+                                            "bitrate, title, artist, album", mtimes)
+            cached = {path: row[1:] for path, row in rows.items() if row[0] == mtimes[path]}
+        except sqlite3.Error as e:
+            print(f"Error reading metadata cache: {e}")
+        return cached
+
+    def save_metadata(self, entries):
+        """entries: [(路径, 修改时间, 元数据元组)]，在一个事务中写入。"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 ((path, mtime) + tuple(record) for path, mtime, record in entries))
+        except sqlite3.Error as e:
+            print(f"Error writing metadata cache: {e}")
+
+    def cached_loudness(self, items):
+        """items: [(路径, 修改时间)]。返回 {路径: (整合响度, 真峰值)}，只包含修改时间与分析时一致的文件。"""
+        mtimes = dict(items)
+        cached = {}
+        try:
+            with closing(self._connect()) as conn:
+                rows = self._select_by_path(conn, "loudness", "mtime, integrated, true_peak", mtimes)
+            cached = {path: row[1:] for path, row in rows.items() if row[0] == mtimes[path]}
+        except sqlite3.Error as e:
+            print(f"Error reading loudness data: {e}")
+        return cached
+
+    def save_loudness(self, entries):
+        """entries: [(路径, 修改时间, 整合响度, 真峰值)]，在一个事务中写入。"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?)", entries)
+        except sqlite3.Error as e:
+            print(f"Error writing loudness data: {e}")
+
+    def cached_signatures(self, items):
+        """items: [(路径, 修改时间)]。返回 {路径: (时长, 粗签名)}，只包含修改时间与计算指纹时一致的文件。"""
+        mtimes = dict(items)
+        cached = {}
+        try:
+            with closing(self._connect()) as conn:
+                rows = self._select_by_path(conn, "fingerprints", "mtime, duration, signature", mtimes)
+            cached = {path: row[1:] for path, row in rows.items() if row[0] == mtimes[path]}
+        except sqlite3.Error as e:
+            print(f"Error reading fingerprints: {e}")
+        return cached
+
+    def load_fingerprints(self, paths):
+        """返回 {路径: 细指纹}，调用方应已通过 cached_signatures 确认它们是最新的。"""
+        fingerprints = {}
+        try:
+            with closing(self._connect()) as conn:
+                rows = self._select_by_path(conn, "fingerprints", "fingerprint", paths)
+            fingerprints = {path: row[0] for path, row in rows.items()}
+        except sqlite3.Error as e:
+            print(f"Error reading fingerprints: {e}")
+        return fingerprints
+
+    def save_fingerprints(self, entries):
+        """entries: [(路径, 修改时间, 时长, 细指纹, 粗签名)]，在一个事务中写入。"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)", entries)
+        except sqlite3.Error as e:
+            print(f"Error writing fingerprints: {e}")
+
+    def cached_hashes(self, items):
+        """items: [(路径, 修改时间, 大小)]。返回 {路径: (部分哈希, 完整哈希或 None)}，只包含修改时间和大小都对得上的文件。"""
+        stats = {path: (mtime, size) for path, mtime, size in items}
+        cached = {}
+        try:
+            with closing(self._connect()) as conn:
+                rows = self._select_by_path(conn, "content_hashes", "mtime, size, partial, full", stats)
+            cached = {path: row[2:] for path, row in rows.items() if row[:2] == stats[path]}
+        except sqlite3.Error as e:
+            print(f"Error reading content hashes: {e}")
+        return cached
+
+    def save_hashes(self, entries):
+        """entries: [(路径, 修改时间, 大小, 部分哈希, 完整哈希)]，在一个事务中写入。"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO content_hashes VALUES (?, ?, ?, ?, ?)", entries)
+        except sqlite3.Error as e:
+            print(f"Error writing content hashes: {e}")
+
+    @staticmethod
+    def _options_key(options):
+        """编码参数的规范文本形式，键的顺序不影响比较。"""
+        return json.dumps(options or {}, sort_keys=True)
+
+    def record_conversion(self, input_path, output_path, target_format, options, source_stat):
+        """
+        记录一次成功的转换。source_stat 是排队时源文件的 (大小, 修改时间)：
+        转换期间源文件若又被修改，下次会因为对不上而重新转换，而不是被当成最新。
+        """
+        try:
+            output_stat = os.stat(output_path)
+        except OSError:
+            return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (output_path, input_path, source_stat[0], source_stat[1], target_format,
+                     self._options_key(options), output_stat.st_size, output_stat.st_mtime_ns))
+        except sqlite3.Error as e:
+            print(f"Error writing conversion record: {e}")
+
+    def conversion_outputs(self, paths):
+        """返回 paths 中由本程序转换生成的文件(有转换记录)。"""
+        outputs = set()
+        try:
+            with closing(self._connect()) as conn:
+                outputs = set(self._select_by_path(conn, "conversions", "1", paths, key_column="output_path"))
+        except sqlite3.Error as e:
+            print(f"Error reading conversion records: {e}")
+        return outputs
+
+    def conversion_states(self, jobs):
+        """
+        把转换任务 [(源路径, 输出路径, 编码器, 参数)] 的输出与转换记录对比，返回 (current, stale) 两个输出路径集合。
+        current：源文件的大小和修改时间、编码器和参数都与记录一致，输出文件自记录后也没被改动过；
+        stale：有记录但已过期。没有记录的输出两边都不包含。
+        """
+        jobs = list(jobs)
+        current, stale = set(), set()
+        try:
+            with closing(self._connect()) as conn:
+                records = self._select_by_path(
+                    conn, "conversions", "source_path, source_size, source_mtime, encoder, options, output_size, "
+                    "output_mtime", (output_path for _, output_path, _, _ in jobs), key_column="output_path")
+        except sqlite3.Error as e:
+            print(f"Error reading conversion records: {e}")
+            return current, stale
+        for input_path, output_path, target_format, options in jobs:
+            record = records.get(output_path)
+            if record is None: continue
+            try:
+                source, output = os.stat(input_path), os.stat(output_path)
+            except OSError:
+                stale.add(output_path)
+                continue
+            if record == (input_path, source.st_size, source.st_mtime_ns, target_format,
+                          self._options_key(options), output.st_size, output.st_mtime_ns):
+                current.add(output_path)
+            else:
+                stale.add(output_path)
+        return current, stale
+
+
+class FileScannerThread(QThread):
+    """
+    递归扫描目录树。各个子目录由线程池并发遍历，结果按块流式发送给界面，
+    文件总数在遍历过程中顺带统计，不再为了计数把目录再扫一遍。
+    传入索引中已知的文件时只报告差异：新增的文件照常按块发送，
+    大小或修改时间变化的通过 files_updated 发送，磁盘上已不存在的通过 files_removed 发送。
+    写入索引时从别处移动过来的文件找回了原来的标记，通过 marks_restored 发送。
+    """
+    chunk_ready = pyqtSignal(list)
+    files_updated = pyqtSignal(list)
+    files_removed = pyqtSignal(list)
+    marks_restored = pyqtSignal(list)
+    progress = pyqtSignal(int, float)   # 已找到的文件数, 每秒找到的文件数
+    finished = pyqtSignal(int)
+
+    AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg', '.m4a', '.wma', '.aac')
+    SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)   # 遍历目录主要在等待 I/O，线程数可以多于核心数
+
+    PROGRESS_INTERVAL = 0.2
+    CHUNK_INTERVAL = 0.1
+
+    def __init__(self, directory, known_files=None, library_index=None, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.known_files = known_files or []   # 索引中已有的记录，在扫描线程里才建成按路径的查找表
+        self.library_index = library_index
+        self.is_running = True
+        self.CHUNK_SIZE = 100
+        self.files_per_sec = 0.0
+        self.directories = [directory]   # 遍历过的所有目录，扫描结束后交给 LibraryWatcher 监视
+        self.added_count = 0
+        self.updated_count = 0
+        self.removed_count = 0
+
+    def run(self):
+        chunk = []
+        updated = []
+        index_upserts = []
+        unseen = {file_info['path']: (file_info['size'], file_info['mtime']) for file_info in self.known_files}
+        total_files = 0
+        start_time = time.perf_counter()
+        next_progress = start_time + self.PROGRESS_INTERVAL
+        next_chunk = start_time
+        completed = False
+        executor = ThreadPoolExecutor(max_workers=self.SCAN_WORKERS, thread_name_prefix="scanner")
+        try:
+            pending = {executor.submit(self._scan_directory, self.directory)}
+            while pending and self.is_running:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirectories = future.result()
+                    for subdirectory in subdirectories:
+                        pending.add(executor.submit(self._scan_directory, subdirectory))
+                    self.directories.extend(subdirectories)
+                    total_files += len(files)
+                    for file_info in files:
+                        known = unseen.pop(file_info['path'], None)
+                        if known is None:
+                            chunk.append(file_info)
+                        elif known != (file_info['size'], file_info['mtime']):
+                            updated.append(file_info)
+                        else:
+                            continue
+                        index_upserts.append(file_info)
+
+                if len(chunk) >= self.CHUNK_SIZE and time.perf_counter() >= next_chunk:
+                    # 第一块尽快发出让列表立刻有内容，之后按时间间隔合并发送；
+                    # 模型一次插入整块，块越大视图重新布局的次数越少
+                    next_chunk = time.perf_counter() + self.CHUNK_INTERVAL
+                    self.chunk_ready.emit(chunk)
+                    self.added_count += len(chunk)
+                    chunk = []
+                if time.perf_counter() >= next_progress:
+                    next_progress = time.perf_counter() + self.PROGRESS_INTERVAL
+                    self.progress.emit(total_files, self._files_per_sec(total_files, start_time))
+            completed = self.is_running and not pending
+            if self.is_running:
+                if chunk: self.chunk_ready.emit(chunk)
+                if updated: self.files_updated.emit(updated)
+                self.added_count += len(chunk)
+                self.updated_count = len(updated)
+        except Exception as e:
+            print(f"Error scanning directory: {e}")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.files_per_sec = self._files_per_sec(total_files, start_time)
+            # 只有完整遍历过整棵目录树，才能断定没见到的文件已被删除
+            removed_paths = list(unseen) if completed else []
+            if removed_paths and self.is_running:
+                self.files_removed.emit(removed_paths)
+                self.removed_count = len(removed_paths)
+            if self.library_index is not None:
+                restored = self.library_index.apply_changes(index_upserts, removed_paths)
+                if restored and self.is_running:
+                    self.marks_restored.emit(restored)
+            if self.is_running:
+                self.finished.emit(total_files)
+
+    def _scan_directory(self, directory):
+        """在线程池中运行：列出一个目录，返回其中的音频文件和需要继续遍历的子目录。"""
+        if not self.is_running:
+            return [], []
+        return self.list_directory(directory)
+
+    @classmethod
+    def list_directory(cls, directory):
+        """非递归地列出一个目录中的音频文件和子目录。"""
+        files, subdirectories = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        # 不跟随目录的符号链接，避免链接成环时无限递归
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif entry.is_file() and entry.name.lower().endswith(cls.AUDIO_EXTENSIONS):
+                            stat = entry.stat()
+                            files.append({'name': entry.name, 'path': entry.path,
+                                          'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+                    except OSError: continue
+        except OSError:
+            pass   # 没有访问权限，或目录在扫描过程中被删除
+        return files, subdirectories
+
+    @staticmethod
+    def _files_per_sec(total_files, start_time):
+        return total_files / max(time.perf_counter() - start_time, 1e-6)
+
+    def stop(self):
+        self.is_running = False
+
+class DirectorySyncThread(QThread):
+    """
+    对比发生变化的目录与库索引，只把差异写回索引并报告给界面。
+    新出现的子目录会被递归扫描，已不存在的目录连同其中的所有文件一起移除。
+    """
+    sync_finished = pyqtSignal(list, list, list, list, list)   # 新增, 更新, 移除, 新目录, 仍在写入的目录
+
+    SETTLE_SEC = 2.0   # 修改时间在这个范围内的文件可能还在写入，稍后需要再核对一次
+
+    def __init__(self, directories, watched_directories, library_index, parent=None):
+        super().__init__(parent)
+        self.directories = directories
+        self.watched_directories = watched_directories
+        self.library_index = library_index
+
+    def run(self):
+        added, updated, removed, new_directories, unsettled = [], [], [], [], []
+        settle_threshold = time.time_ns() - int(self.SETTLE_SEC * 1e9)
+        pending = list(self.directories)
+        try:
+            while pending:
+                directory = pending.pop()
+                if not os.path.isdir(directory):
+                    removed.extend(f['path'] for f in self.library_index.load(directory))
+                    continue
+                known = {f['path']: (f['size'], f['mtime'])
+                         for f in self.library_index.load(directory, recursive=False)}
+                files, subdirectories = FileScannerThread.list_directory(directory)
+                for file_info in files:
+                    previous = known.pop(file_info['path'], None)
+                    if previous is None:
+                        added.append(file_info)
+                    elif previous != (file_info['size'], file_info['mtime']):
+                        updated.append(file_info)
+                    if file_info['mtime'] > settle_threshold and directory not in unsettled:
+                        unsettled.append(directory)
+                removed.extend(known)
+                for subdirectory in subdirectories:
+                    if subdirectory not in self.watched_directories:
+                        new_directories.append(subdirectory)
+                        pending.append(subdirectory)
+            # 删除整棵目录树时，父目录和子目录会各报告一次同样的文件
+            removed = list(dict.fromkeys(removed))
+            restored = set(self.library_index.apply_changes(added + updated, removed))
+            for file_info in added:
+                # 被移动或重命名的文件带着原来的标记加入列表
+                if file_info['path'] in restored: file_info['marked'] = True
+        except Exception as e:
+            print(f"Error syncing directory changes: {e}")
+        self.sync_finished.emit(added, updated, removed, new_directories, unsettled)
+
+
+class LibraryWatcher(QObject):
+    """
+    用 QFileSystemWatcher 监视已打开的目录树，把创建、删除和重命名
+    转换成对文件列表的增量新增/删除/更新，不再需要整体重新扫描。
+    一连串的变化通知先合并(防抖)，再交给 DirectorySyncThread 在后台比对。
+    """
+    changes_detected = pyqtSignal(list, list, list)   # 新增的文件, 变化的文件, 移除的路径
+
+    DEBOUNCE_MS = 300
+
+    def __init__(self, library_index, parent=None):
+        super().__init__(parent)
+        self.library_index = library_index
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._on_directory_changed)
+        self._dirty_directories = set()
+        self._debounce_timer = QTimer(self)
+        self._debounce_timer.setSingleShot(True)
+        self._debounce_timer.timeout.connect(self._start_sync)
+        self._sync_thread = None
+
+    def watch(self, directories):
+        self.clear()
+        self._add_directories(directories)
+
+    def clear(self):
+        self._debounce_timer.stop()
+        self._dirty_directories.clear()
+        if self._sync_thread is not None:
+            # 旧目录树的比对结果已经没有意义，等它结束后丢弃
+            self._sync_thread.sync_finished.disconnect(self._on_sync_finished)
+            self._sync_thread.wait()
+            self._sync_thread = None
+        watched = self._watcher.directories()
+        if watched:
+            self._watcher.removePaths(watched)
+
+    def _add_directories(self, directories):
+        if not directories: return
+        failed = self._watcher.addPaths(directories)
+        if failed:
+            print(f"Unable to watch {len(failed)} directories (e.g. {failed[0]})")
+
+    def _on_directory_changed(self, directory):
+        self._dirty_directories.add(directory)
+        self._debounce_timer.start(self.DEBOUNCE_MS)
+
+    def _start_sync(self):
+        if self._sync_thread is not None:
+            return   # 上一轮比对结束后会再检查是否有新的变化
+        if not self._dirty_directories:
+            return
+        directories = list(self._dirty_directories)
+        self._dirty_directories.clear()
+        self._sync_thread = DirectorySyncThread(directories, set(self._watcher.directories()), self.library_index)
+        self._sync_thread.sync_finished.connect(self._on_sync_finished)
+        self._sync_thread.start()
+
+    def _on_sync_finished(self, added, updated, removed, new_directories, unsettled):
+        self._sync_thread.wait()
+        self._sync_thread = None
+        self._add_directories(new_directories)
+        if added or updated or removed:
+            self.changes_detected.emit(added, updated, removed)
+        if unsettled:
+            # 仍在写入的文件不会再触发目录变化通知，过一会儿主动再核对一次大小
+            self._dirty_directories.update(unsettled)
+            self._debounce_timer.start(int(DirectorySyncThread.SETTLE_SEC * 1000))
+        elif self._dirty_directories:
+            self._debounce_timer.start(self.DEBOUNCE_MS)
+
+
+class FileDeleterThread(QThread):
+    """
+    在后台批量删除文件。删除主要在等待文件系统，由线程池并发执行，界面线程不会卡住；
+    全部处理完后一次性报告结果，界面只需移除一次列表行、写一次索引。
+    """
+    progress = pyqtSignal(int, int)     # 已处理的文件数, 总数
+    finished = pyqtSignal(list, list)   # 已删除的路径, [(删除失败的路径, 错误信息)]
+
+    DELETE_WORKERS = min(16, (os.cpu_count() or 1) * 2)
+    PROGRESS_INTERVAL = 0.2
+
+    def __init__(self, file_paths, parent=None):
+        super().__init__(parent)
+        self.file_paths = list(file_paths)
+
+    def run(self):
+        deleted, failed = [], []
+        total = len(self.file_paths)
+        next_progress = time.perf_counter() + self.PROGRESS_INTERVAL
+        with ThreadPoolExecutor(max_workers=self.DELETE_WORKERS, thread_name_prefix="deleter") as executor:
+            for done, (file_path, error) in enumerate(executor.map(self._delete, self.file_paths), 1):
+                if error is None: deleted.append(file_path)
+                else: failed.append((file_path, error))
+                now = time.perf_counter()
+                if now >= next_progress:
+                    self.progress.emit(done, total)
+                    next_progress = now + self.PROGRESS_INTERVAL
+        self.finished.emit(deleted, failed)
+
+    @staticmethod
+    def _delete(file_path):
+        try:
+            os.remove(file_path)
+            return file_path, None
+        except OSError as e:
+            return file_path, str(e)
+
+
+# 元数据元组中各字段的顺序；读不到的字段为 None
+METADATA_FIELDS = ('duration', 'codec', 'sample_rate', 'bit_depth', 'bitrate', 'title', 'artist', 'album')
+PROBE_OPTIONS = {'probesize': '65536'}
+
+
+def _probe_bit_depth(codec_context):
+    """有损编码没有位深，返回 None；FLAC 解码输出总是 16 或 32 位，真实位深要从 STREAMINFO 中读。"""
+    name = codec_context.codec.canonical_name
+    extradata = codec_context.extradata
+    if name == 'flac' and extradata and len(extradata) >= 14:
+        return (((extradata[12] & 1) << 4) | (extradata[13] >> 4)) + 1
+    if name.startswith('pcm_'):
+        digits = ''.join(ch for ch in name if ch.isdigit())
+        return int(digits) if digits else None
+    if name in ('alac', 'wavpack', 'ape', 'tta', 'mlp', 'truehd'):
+        return codec_context.format.bits if codec_context.format else None
+    return None
+
+
+def probe_audio_metadata(file_path):
+    """
+    只解析文件头，读取时长、编码、采样率、位深、码率和常用标签，按 METADATA_FIELDS 的顺序返回元组。
+    文件无法打开时返回全为 None 的元组，同样写入缓存，文件没变就不会反复尝试。
+    """
+    try:
+        # 默认的 5 MB 探测量会让 WAV 解复用器把整个小文件读一遍来找 S/PDIF 数据，文件头信息用不着这么多
+        with av.open(file_path, options=PROBE_OPTIONS) as container:
+            stream = container.streams.audio[0]
+            codec_context = stream.codec_context
+            if stream.duration:
+                duration = float(stream.duration * stream.time_base)
+            elif container.duration:
+                duration = container.duration / av.time_base
+            else:
+                duration = None
+            # Ogg/FLAC 的标签在流上，MP3/MP4 的在容器上；键名大小写不统一
+            tags = {key.lower(): value for key, value in stream.metadata.items()}
+            tags.update((key.lower(), value) for key, value in container.metadata.items())
+            return (duration, codec_context.codec.canonical_name, stream.rate or None,
+                    _probe_bit_depth(codec_context), stream.bit_rate or container.bit_rate or None,
+                    tags.get('title'), tags.get('artist'), tags.get('album'))
+    except (av.FFmpegError, IndexError, OSError, UnicodeDecodeError) as e:
+        print(f"Error probing {file_path}: {e}")
+        return (None,) * len(METADATA_FIELDS)
+
+
+class MetadataProbeThread(QThread):
+    """
+    在后台读取列表中每个文件的音频信息(probe_audio_metadata)，由线程池并发执行，主要在等待磁盘。
+    每个文件先查索引中的缓存，路径和修改时间都没变就直接使用，不再重复读取；新读到的结果写回索引。
+    视图中当前可见的行通过 prioritize 插到队首；结果攒成批次发送，界面每个批次只刷新一次。
+    线程在打开目录时启动，一直等待新的文件，直到 stop。
+    """
+    metadata_ready = pyqtSignal(list)   # [(目录行号, 读取时的修改时间, 元数据元组)]
+
+    PROBE_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+    CACHE_BATCH = 64       # 每次从队列中取出、一起查缓存的文件数
+    EMIT_INTERVAL = 0.2
+
+    def __init__(self, library_index, parent=None):
+        super().__init__(parent)
+        self.library_index = library_index
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}          # 目录行号 -> (路径, 修改时间)
+        self._order = deque()       # 按加入顺序排列的行号，可能含已经处理过的行
+        self._priority = deque()    # 优先处理的行号
+        self._stopped = False
+
+    def enqueue(self, items):
+        """加入待读取的文件 [(目录行号, 路径, 修改时间)]；同一行再次加入时以新的修改时间为准。"""
+        with self._lock:
+            for row, path, mtime in items:
+                if row not in self._pending: self._order.append(row)
+                self._pending[row] = (path, mtime)
+        self._wakeup.set()
+
+    def prioritize(self, rows):
+        """下一批先处理这些行(通常是视图中可见的行)，取代之前的优先行。"""
+        with self._lock:
+            self._priority = deque(rows)
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def _take(self, count):
+        batch = []
+        with self._lock:
+            for source in (self._priority, self._order):
+                while source and len(batch) < count:
+                    row = source.popleft()
+                    item = self._pending.pop(row, None)
+                    if item is not None: batch.append((row,) + item)
+        return batch
+
+    def run(self):
+        in_flight = {}   # future -> (目录行号, 路径, 修改时间)
+        ready, to_store = [], []
+        next_emit = time.perf_counter() + self.EMIT_INTERVAL
+        executor = ThreadPoolExecutor(max_workers=self.PROBE_WORKERS, thread_name_prefix="probe")
+        try:
+            while not self._stopped:
+                # 正在读取的文件不超过线程数的两倍，新的优先行不会排在一长串已提交的任务后面
+                batch = self._take(self.CACHE_BATCH) if len(in_flight) < self.PROBE_WORKERS * 2 else []
+                if batch:
+                    cached = self.library_index.cached_metadata([(path, mtime) for _, path, mtime in batch])
+                    for row, path, mtime in batch:
+                        record = cached.get(path)
+                        if record is not None:
+                            ready.append((row, mtime, record))
+                        else:
+                            in_flight[executor.submit(probe_audio_metadata, path)] = (row, path, mtime)
+
+                if in_flight:
+                    timeout = 0 if batch and len(in_flight) < self.PROBE_WORKERS * 2 else self.EMIT_INTERVAL
+                    done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        row, path, mtime = in_flight.pop(future)
+                        record = future.result()
+                        ready.append((row, mtime, record))
+                        to_store.append((path, mtime, record))
+                elif not batch:
+                    # 队列已空：把攒下的结果发出去，等待新的文件
+                    if ready: self.metadata_ready.emit(ready)
+                    if to_store: self.library_index.save_metadata(to_store)
+                    ready, to_store = [], []
+                    self._wakeup.wait(self.EMIT_INTERVAL)
+                    self._wakeup.clear()
+                    continue
+
+                now = time.perf_counter()
+                if now >= next_emit:
+                    if ready: self.metadata_ready.emit(ready)
+                    if to_store: self.library_index.save_metadata(to_store)
+                    ready, to_store = [], []
+                    next_emit = now + self.EMIT_INTERVAL
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            # 目录已经换了，结果不再发给界面，但读到的信息仍然写进缓存
+            to_store.extend((path, mtime, future.result()) for future, (_, path, mtime) in in_flight.items()
+                            if future.done() and not future.cancelled())
+            if to_store: self.library_index.save_metadata(to_store)
+
+
+NORMALIZATION_TARGET_LUFS = -18.0   # 音量标准化的目标响度，与 ReplayGain 2.0 的参考响度一致
+NORMALIZATION_PEAK_CEILING = -1.0   # 加上增益后真峰值不超过 -1 dBTP
+
+
+class LoudnessMeter:
+    """
+    按 ITU-R BS.1770 / EBU R128 测量整合响度和真峰值。数据以 (声道, 采样数) 的 float32 块送入，
+    除最后一块外每块必须正好 block_size 个采样。
+    K 加权(高架 + 高通两级双二阶)用 FFT 重叠相加实现：频率响应由双二阶系数直接算出，
+    每块一次正反 FFT，整块一起在 NumPy 里完成，不需要逐样本的 IIR 循环；
+    真峰值用多相 FIR 做 4 倍过采样 (96 kHz 以上 2 倍)，写成滑动窗口上的一次矩阵乘法。
+    """
+    SHELF = (1681.974450955533, 3.999843853973347, 0.7071752369554196)   # 中心频率, 增益(dB), Q
+    HIGH_PASS = (38.13547087602444, 0.5003270373238773)                 # 截止频率, Q
+    ABSOLUTE_GATE = -70.0   # LUFS
+    RELATIVE_GATE = -10.0   # LU
+    CHANNEL_WEIGHTS = {'LFE': 0.0, 'BL': 1.41, 'BR': 1.41, 'SL': 1.41, 'SR': 1.41}   # 其余声道为 1
+    OVERSAMPLING_TAPS = 12  # 每个相位的抽头数
+
+    def __init__(self, rate, channel_names):
+        self.rate = rate
+        # 块长至少半秒：K 加权的冲激响应在这个长度内已衰减到可以忽略，重叠相加只需保留一块的尾巴
+        self.block_size = 1 << int(np.ceil(np.log2(rate / 2)))
+        self._response = self._k_weighting_response(rate, 2 * self.block_size)
+        self._weights = np.array([self.CHANNEL_WEIGHTS.get(name, 1.0) for name in channel_names])[:, None]
+        self._tail = np.zeros((len(channel_names), self.block_size))
+        self._subblock = int(round(rate * 0.1))   # 100 ms，四个子块组成一个 400 ms 的门限块
+        self._carry = np.empty(0)
+        self._energies = []
+        factor = 4 if rate < 96000 else 2 if rate < 192000 else 1
+        self._phases = self._oversampling_matrix(factor)
+        self._history = np.zeros((len(channel_names), self._phases.shape[0] - 1), dtype=np.float32)
+        self._peak = 0.0
+
+    @classmethod
+    def _k_weighting_response(cls, rate, fft_size):
+        """两级 K 加权滤波器在 rfft 各频点上的复数响应，系数的求法与 libebur128 相同。"""
+        def biquad(b, a):
+            z = np.exp(-2j * np.pi * np.arange(fft_size // 2 + 1) / fft_size)   # 各频点上的 z^-1
+            return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+        f0, gain_db, q = cls.SHELF
+        k = np.tan(np.pi * f0 / rate)
+        vh = 10 ** (gain_db / 20)
+        vb = vh ** 0.4996667741545416
+        a0 = 1 + k / q + k * k
+        shelf = biquad(((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0),
+                       (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0))
+        f0, q = cls.HIGH_PASS
+        k = np.tan(np.pi * f0 / rate)
+        a0 = 1 + k / q + k * k
+        high_pass = biquad((1.0, -2.0, 1.0), (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0))
+        return shelf * high_pass
+
+    @classmethod
+    def _oversampling_matrix(cls, factor):
+        """加窗 sinc 插值滤波器拆成 factor 个相位，按滑动窗口的顺序排成 (抽头数, 相位数) 的矩阵。"""
+        if factor == 1:
+            return np.ones((1, 1), dtype=np.float32)
+        n = np.arange(factor * cls.OVERSAMPLING_TAPS) - (factor * cls.OVERSAMPLING_TAPS - 1) / 2
+        h = np.sinc(n / factor) * np.kaiser(len(n), 8.0)
+        h *= factor / h.sum()
+        return np.ascontiguousarray(h.reshape(cls.OVERSAMPLING_TAPS, factor)[::-1], dtype=np.float32)
+
+    def process(self, samples):
+        count = samples.shape[1]
+        if not count: return
+        # 真峰值：接上一块末尾的几个采样，每个位置的各个插值相位一次算出
+        extended = np.concatenate((self._history, samples), axis=1)
+        windows = np.lib.stride_tricks.sliding_window_view(extended, self._phases.shape[0], axis=1)
+        self._peak = max(self._peak, float(np.abs(windows @ self._phases).max()), float(np.abs(samples).max()))
+        self._history = extended[:, extended.shape[1] - self._history.shape[1]:]
+
+        # K 加权：线性卷积的后半段留给下一块
+        fft_size = 2 * self.block_size
+        filtered = np.fft.irfft(np.fft.rfft(samples, fft_size, axis=1) * self._response, fft_size, axis=1)
+        filtered[:, :self.block_size] += self._tail
+        self._tail = filtered[:, self.block_size:]
+
+        # 各声道加权后的均方功率，按 100 ms 子块求和；凑不满一个子块的部分留到下一块
+        power = np.concatenate((self._carry, np.square(filtered[:, :count]).T @ self._weights[:, 0]))
+        whole = len(power) // self._subblock * self._subblock
+        self._energies.append(power[:whole].reshape(-1, self._subblock).mean(axis=1))
+        self._carry = power[whole:]
+
+    def integrated_loudness(self):
+        """门限后的整合响度 (LUFS)；没有任何块超过绝对门限(静音或不足 400 ms)时返回 None。"""
+        energies = np.concatenate(self._energies) if self._energies else np.empty(0)
+        if len(energies) < 4: return None
+        blocks = np.convolve(energies, np.full(4, 0.25), mode='valid')   # 400 ms 的块，相邻块重叠 75%
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10 * np.log10(blocks)
+        gated = loudness > self.ABSOLUTE_GATE
+        if not gated.any(): return None
+        relative_gate = -0.691 + 10 * np.log10(blocks[gated].mean()) + self.RELATIVE_GATE
+        gated &= loudness > relative_gate
+        return float(-0.691 + 10 * np.log10(blocks[gated].mean()))
+
+    def true_peak(self):
+        """真峰值 (dBTP)；全是静音时返回 None。"""
+        return float(20 * np.log10(self._peak)) if self._peak > 0 else None
+
+
+def measure_loudness(file_path, should_stop=None):
+    """
+    解码整首歌，返回 (整合响度 LUFS, 真峰值 dBTP)，无法测量的一项为 None。
+    解码出的帧由重采样器攒成 LoudnessMeter 要求的整块 fltp 数据，逐块送入。
+    should_stop() 返回 True 时中止并返回 None。
+    """
+    with av.open(file_path) as container:
+        stream = container.streams.audio[0]
+        if not stream.rate:
+            raise ValueError("无法获取采样率")
+        meter = LoudnessMeter(stream.rate, [channel.name for channel in stream.layout.channels])
+        resampler = av.AudioResampler(format='fltp', frame_size=meter.block_size)
+        for frame in container.decode(stream):
+            if should_stop is not None and should_stop():
+                return None
+            for block in resampler.resample(frame):
+                meter.process(block.to_ndarray())
+        for block in resampler.resample(None):
+            meter.process(block.to_ndarray())
+        return meter.integrated_loudness(), meter.true_peak()
+
+
+def normalization_gain(integrated, true_peak):
+    """
+    把这首歌调到目标响度所需的增益 (dB)。增益受真峰值限制，加上增益后不会超过峰值上限，
+    因此整数格式原地相乘也不会溢出。响度无法测量时返回 0。
+    """
+    if integrated is None: return 0.0
+    gain = NORMALIZATION_TARGET_LUFS - integrated
+    if true_peak is not None:
+        gain = min(gain, NORMALIZATION_PEAK_CEILING - true_peak)
+    return gain
+
+
+_loudness_cancel_event = None
+
+
+def _init_loudness_worker(cancel_event):
+    global _loudness_cancel_event
+    _loudness_cancel_event = cancel_event
+
+
+def _run_loudness_job(file_path):
+    """在工作进程中测量一个文件，返回 (状态, (整合响度, 真峰值) 或错误信息)。"""
+    if _loudness_cancel_event.is_set():
+        return LoudnessAnalyzerThread.CANCELLED, None
+    try:
+        result = measure_loudness(file_path, _loudness_cancel_event.is_set)
+    except Exception as e:
+        return LoudnessAnalyzerThread.FAILED, str(e)
+    if result is None:
+        return LoudnessAnalyzerThread.CANCELLED, None
+    return LoudnessAnalyzerThread.DONE, result
+
+
+class LoudnessAnalyzerThread(QThread):
+    """
+    批量测量文件的整合响度和真峰值(measure_loudness)，结果连同修改时间写入音频库索引。
+    测量要解码整首歌，是 CPU 密集型的，和批量转换一样分发到进程池里，进程数等于 CPU 核心数。
+    索引中已有结果且修改时间没变的文件直接跳过；取消时正在测量的文件在下一帧中止。
+    """
+    progress = pyqtSignal(int, int)   # 已处理的文件数, 总数
+    finished = pyqtSignal(dict)       # 汇总: 各状态的文件数、已有结果的文件数、失败列表和耗时
+
+    DONE, FAILED, CANCELLED = "done", "failed", "cancelled"
+    MAX_WORKERS = os.cpu_count() or 1
+    POLL_INTERVAL = 0.1
+    SAVE_BATCH = 32
+
+    def __init__(self, files, library_index, parent=None):
+        super().__init__(parent)
+        self.files = files   # [(路径, 修改时间)]
+        self.library_index = library_index
+        self._context = multiprocessing.get_context('spawn')
+        self._cancel_event = self._context.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self):
+        summary = {self.DONE: 0, self.FAILED: 0, self.CANCELLED: 0, 'cached': 0, 'failures': []}
+        start_time = time.perf_counter()
+        cached = self.library_index.cached_loudness(self.files)
+        pending = deque(item for item in self.files if item[0] not in cached)
+        summary['cached'] = finished_count = len(self.files) - len(pending)
+        self.progress.emit(finished_count, len(self.files))
+        in_flight, to_store = {}, []
+        executor = ProcessPoolExecutor(max_workers=self.MAX_WORKERS, mp_context=self._context,
+                                       initializer=_init_loudness_worker, initargs=(self._cancel_event,))
+        try:
+            while pending or in_flight:
+                if self._cancel_event.is_set():
+                    summary[self.CANCELLED] += len(pending)
+                    finished_count += len(pending)
+                    pending.clear()
+                while pending and len(in_flight) < self.MAX_WORKERS * 2:
+                    item = pending.popleft()
+                    in_flight[executor.submit(_run_loudness_job, item[0])] = item
+                if not in_flight: break
+
+                done, _ = wait(in_flight, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, mtime = in_flight.pop(future)
+                    try:
+                        status, result = future.result()
+                    except Exception as e:   # 例如工作进程意外退出
+                        status, result = self.FAILED, str(e)
+                    summary[status] += 1
+                    if status == self.DONE:
+                        to_store.append((path, mtime) + tuple(result))
+                    elif status == self.FAILED:
+                        summary['failures'].append((path, result))
+                    finished_count += 1
+                if len(to_store) >= self.SAVE_BATCH:
+                    self.library_index.save_loudness(to_store)
+                    to_store = []
+                if done: self.progress.emit(finished_count, len(self.files))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if to_store: self.library_index.save_loudness(to_store)
+        summary['elapsed'] = time.perf_counter() - start_time
+        self.finished.emit(summary)
+
+
+FINGERPRINT_RATE = 11025              # 指纹只看 300–2000 Hz，解码后先降到单声道 11025 Hz
+FINGERPRINT_SECONDS = 40              # 只取开头这么长的音频
+FINGERPRINT_FRAME, FINGERPRINT_HOP = 4096, 1024
+FINGERPRINT_BANDS = np.geomspace(300, 2000, 34)   # 33 个对数间隔的频带，相邻频带的能量差给出每帧 32 位
+SIGNATURE_GROUP, SIGNATURE_ROWS = 16, 24          # 粗签名: 每 16 帧 (约 1.5 秒) 合并一次，取前 24 行共 768 位
+LOSSLESS_CODECS = {'flac', 'alac', 'wavpack', 'ape', 'tta', 'mlp', 'truehd'}
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _energy_difference_bits(energies):
+    """相邻频带能量差在相邻两帧之间是增是减，每帧 32 位 (Haitsma–Kalker 指纹)。"""
+    difference = energies[:, :-1] - energies[:, 1:]
+    return difference[1:] > difference[:-1]
+
+
+def compute_fingerprint(file_path, should_stop=None):
+    """
+    解码开头 FINGERPRINT_SECONDS 秒，返回 (时长, 细指纹, 粗签名)：
+    细指纹是每帧一个 uint32，用来逐位比较两首歌；粗签名是把若干帧合并后算出的定长位串(packbits)，
+    对转码、重采样和几十毫秒的错位都很稳定，用作局部敏感哈希的键。
+    音频太短或是静音时两者都为空数组。should_stop() 返回 True 时中止并返回 None。
+    """
+    samples = np.empty(FINGERPRINT_RATE * FINGERPRINT_SECONDS, dtype=np.float32)
+    count = 0
+    with av.open(file_path) as container:
+        stream = container.streams.audio[0]
+        if stream.duration:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration:
+            duration = container.duration / av.time_base
+        else:
+            duration = None
+        resampler = av.AudioResampler(format='flt', layout='mono', rate=FINGERPRINT_RATE)
+
+        def take(frame):
+            nonlocal count
+            for block in resampler.resample(frame):
+                data = np.frombuffer(block.planes[0], dtype=np.float32, count=block.samples)
+                taken = min(len(data), len(samples) - count)
+                samples[count:count + taken] = data[:taken]
+                count += taken
+
+        for frame in container.decode(stream):
+            if should_stop is not None and should_stop():
+                return None
+            take(frame)
+            if count == len(samples): break
+        else:
+            take(None)
+    if duration is None:
+        duration = count / FINGERPRINT_RATE
+
+    empty = (duration, np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint8))
+    if count < FINGERPRINT_FRAME + SIGNATURE_GROUP * 2 * FINGERPRINT_HOP:
+        return empty
+    frames = np.lib.stride_tricks.sliding_window_view(samples[:count], FINGERPRINT_FRAME)[::FINGERPRINT_HOP]
+    spectrum = np.fft.rfft(frames * np.hanning(FINGERPRINT_FRAME).astype(np.float32), axis=1)
+    bins = np.searchsorted(np.fft.rfftfreq(FINGERPRINT_FRAME, 1 / FINGERPRINT_RATE), FINGERPRINT_BANDS)
+    power = np.square(np.abs(spectrum[:, :bins[-1]]))
+    energies = np.add.reduceat(power, bins[:-1], axis=1)
+    if not energies.any():
+        return empty
+
+    fine = _energy_difference_bits(energies).astype(np.uint32) << np.arange(32, dtype=np.uint32)
+    groups = len(energies) // SIGNATURE_GROUP
+    coarse = energies[:groups * SIGNATURE_GROUP].reshape(groups, SIGNATURE_GROUP, -1).sum(axis=1)
+    signature = np.zeros((SIGNATURE_ROWS, 32), dtype=bool)   # 比签名短的音频后面补 0
+    bits = _energy_difference_bits(coarse)[:SIGNATURE_ROWS]
+    signature[:len(bits)] = bits
+    return duration, fine.sum(axis=1, dtype=np.uint32), np.packbits(signature)
+
+
+def fingerprint_distance(a, b, max_shift=2):
+    """两个细指纹在重叠部分上不同位所占的比例 (误码率)，前后错开至多 max_shift 帧取最小值。"""
+    best = 1.0
+    for shift in range(-max_shift, max_shift + 1):
+        x, y = a[max(shift, 0):], b[max(-shift, 0):]
+        length = min(len(x), len(y))
+        if length:
+            best = min(best, int(_POPCOUNT[(x[:length] ^ y[:length]).view(np.uint8)].sum()) / (length * 32))
+    return best
+
+
+def audio_quality_key(record, mtime, is_conversion_output):
+    """
+    按 METADATA_FIELDS 元组比较音质，值越大越好：无损优先，其次位深、采样率，有损编码再比码率。
+    音质相同时保留不是由本程序转换出来的、修改时间更早的那个(通常是原始文件)。
+    """
+    _, codec, sample_rate, bit_depth, bitrate, _, _, _ = record
+    lossless = codec in LOSSLESS_CODECS or (codec or '').startswith('pcm_')
+    return (lossless, bit_depth or 0, sample_rate or 0, 0 if lossless else bitrate or 0,
+            not is_conversion_output, -mtime)
+
 
-                if self.value() != value:
-                    self.setValue(value)
+HASH_HEAD_TAIL = 64 * 1024   # 部分哈希只读文件开头和结尾各这么多字节
 
-                # 依然调用super()，以支持“点击后直接拖动”的无缝体验
-                super().mousePressEvent(event)
 
+def content_hash(file_path, partial=False):
+    """
+    用内存映射读取文件，返回 16 字节的 BLAKE2b 摘要。partial=True 时只读开头和结尾各 HASH_HEAD_TAIL 字节，
+    文件不超过两倍这么大时部分哈希就是全文哈希。哈希计算时会释放 GIL，适合放在线程池里并发执行。
+    """
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        digest = hashlib.blake2b(digest_size=16)
+        if partial and len(data) > 2 * HASH_HEAD_TAIL:
+            digest.update(data[:HASH_HEAD_TAIL])
+            digest.update(data[-HASH_HEAD_TAIL:])
+        else:
+            digest.update(data)
+        return digest.digest()
 
-class AudioPlayerThread(QThread):
-    # --- 信号部分保持不变 ---
-    position_changed = pyqtSignal(float)
-    playback_started = pyqtSignal(str, float)
-    playback_finished = pyqtSignal()
-    playback_error = pyqtSignal(str)
-    seek_completed = pyqtSignal(int)
 
-    CHUNK_SIZE = 4096
+_fingerprint_cancel_event = None
 
-    def __init__(self):
-        super().__init__()
-        self.play_queue = queue.Queue()
-        self.command_queue = queue.Queue()
-        self._stop = False
-        
-        self.p_audio = pyaudio.PyAudio()
-        self.stream = None
-        
-        self.current_file = None
-        self.total_duration_sec = 0
-        
-        self._paused = False
-        self._interrupt = False
-        self.is_song_active = False
-        self.playback_start_time = 0
-        self.paused_at_sec = 0
-        self.pending_seek_while_paused = None
-        
-    @property
-    def is_active(self):
-        return self.is_song_active
+
+def _init_fingerprint_worker(cancel_event):
+    global _fingerprint_cancel_event
+    _fingerprint_cancel_event = cancel_event
+
+
+def _run_fingerprint_job(file_path):
+    """在工作进程中计算一个文件的指纹，返回 (状态, (时长, 细指纹字节, 粗签名字节) 或错误信息)。"""
+    if _fingerprint_cancel_event.is_set():
+        return DuplicateFinderThread.CANCELLED, None
+    try:
+        result = compute_fingerprint(file_path, _fingerprint_cancel_event.is_set)
+    except Exception as e:
+        return DuplicateFinderThread.FAILED, str(e)
+    if result is None:
+        return DuplicateFinderThread.CANCELLED, None
+    duration, fine, signature = result
+    return DuplicateFinderThread.DONE, (duration, fine.tobytes(), signature.tobytes())
+
+
+class DuplicateFinderThread(QThread):
+    """
+    按声学指纹查找内容相同的音频，即使格式、码率或采样率不同 (例如转换前后的两个文件)。
+    0. 先找出字节完全相同的文件 (_find_exact)：按扫描时已有的文件大小分桶，只有大小相同的文件才计算
+       开头和结尾的部分哈希，部分哈希也相同的才读全文计算完整哈希。哈希由线程池经内存映射读取，
+       结果缓存在音频库索引中。每组完全相同的文件只取一个参与后面的指纹比较；acoustic=False 时到此为止。
+    1. 计算每个文件的指纹 (compute_fingerprint)，CPU 密集，分发到进程池；结果按修改时间缓存在音频库索引中。
+    2. 局部敏感哈希：每张表从粗签名中固定抽取若干位作为键，相似的签名大概率在某张表里同键，
+       只有同键的文件才互相比较，10 万个文件也不必两两比较。
+    3. 候选对先比时长，再逐位比较细指纹，误码率低于阈值即认为是同一首歌，用并查集合并成组。
+    4. 每组按 audio_quality_key 排序，音质最好的排在第一个。
+    """
+    progress = pyqtSignal(str, int, int)   # 阶段 (HASHING / FINGERPRINTING), 已处理的文件数, 总数
+    finished = pyqtSignal(dict)            # 汇总: 重复组 (每组音质最好的在前)、是否完整运行、各状态的文件数、失败列表和耗时
+
+    DONE, FAILED, CANCELLED = "done", "failed", "cancelled"
+    HASHING, FINGERPRINTING = "hashing", "fingerprinting"
+    MAX_WORKERS = os.cpu_count() or 1
+    HASH_WORKERS = min(8, (os.cpu_count() or 1) * 2)   # 哈希主要在等磁盘
+    POLL_INTERVAL = 0.1
+    SAVE_BATCH = 64
+    LSH_TABLES, LSH_BITS = 32, 24
+    MAX_BUCKET_PAIRS = 32        # 同键的文件超过这么多时只比较排序后相邻的文件，避免平方级的比较
+    MAX_BIT_ERROR_RATE = 0.25    # 转码后的同一首歌约 0.05，不同的歌接近 0.5
+    DURATION_TOLERANCE = 3.0     # 只比较了开头，时长还要对得上，避免把同一首歌的不同版本当成重复
+
+    def __init__(self, files, library_index, acoustic=True, parent=None):
+        super().__init__(parent)
+        self.files = files   # [(路径, 修改时间, 大小)]
+        self.library_index = library_index
+        self.acoustic = acoustic
+        self._context = multiprocessing.get_context('spawn')
+        self._cancel_event = self._context.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
 
     def run(self):
-        while not self._stop:
+        summary = {self.DONE: 0, self.FAILED: 0, self.CANCELLED: 0, 'cached': 0, 'hashed': 0, 'failures': [],
+                   'groups': [], 'exact_groups': 0, 'compared': 0}
+        start_time = time.perf_counter()
+        mtimes = {path: mtime for path, mtime, _ in self.files}
+        groups = self._find_exact(summary)
+        summary['exact_groups'] = len(groups)
+        if self.acoustic and not self._cancel_event.is_set():
+            # 完全相同的文件只让每组的第一个去算指纹，匹配后再把同组的其他文件带回来
+            copies = {group[0]: group for group in groups}
+            skipped = {path for group in groups for path in group[1:]}
+            signatures = self._fingerprint_all(summary, [(path, mtime) for path, mtime, _ in self.files
+                                                         if path not in skipped])
+            summary['compared'] = len(signatures)
+            if not self._cancel_event.is_set():
+                matched = self._match(signatures)
+                merged = {path for group in matched for path in group}
+                groups = [[copy for path in group for copy in copies.get(path, [path])] for group in matched]
+                groups += [group for first, group in copies.items() if first not in merged]
+        if not self._cancel_event.is_set():
+            summary['groups'] = self._rank(groups, mtimes)
+        summary['completed'] = not self._cancel_event.is_set()
+        summary['elapsed'] = time.perf_counter() - start_time
+        self.finished.emit(summary)
+
+    def _find_exact(self, summary):
+        """返回字节完全相同的文件组 [[路径]]。被取消时结果不完整，但已算出的哈希照样写入缓存。"""
+        by_size = {}
+        for path, mtime, size in self.files:
+            if size > 0: by_size.setdefault(size, []).append(path)
+        sizes = {path: size for size, paths in by_size.items() if len(paths) > 1 for path in paths}
+        if not sizes: return []
+        mtimes = {path: mtime for path, mtime, _ in self.files if path in sizes}
+        hashes = {path: list(digests) for path, digests in self.library_index.cached_hashes(
+                  (path, mtime, sizes[path]) for path, mtime in mtimes.items()).items()}
+        changed = set()
+        executor = ThreadPoolExecutor(max_workers=self.HASH_WORKERS, thread_name_prefix="hash")
+        try:
+            # 第一轮：大小相同的文件算部分哈希
+            self._hash_files(executor, [path for path in sizes if path not in hashes], True, hashes, changed, summary)
+            for path, digests in hashes.items():
+                if digests[1] is None and sizes.get(path, 0) <= 2 * HASH_HEAD_TAIL:
+                    digests[1] = digests[0]   # 小文件的部分哈希已经覆盖了全文
+            # 第二轮：大小和部分哈希都相同的才读全文
+            buckets = self._bucket(hashes, sizes, 0)
+            self._hash_files(executor, [path for bucket in buckets for path in bucket if hashes[path][1] is None],
+                             False, hashes, changed, summary)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.library_index.save_hashes((path, mtimes[path], sizes[path], *hashes[path])
+                                           for path in changed if path in hashes)
+        return [sorted(bucket) for bucket in self._bucket(hashes, sizes, 1)]
+
+    @staticmethod
+    def _bucket(hashes, sizes, which):
+        """按 (大小, 第 which 个摘要) 分组，返回不止一个文件的组。"""
+        buckets = {}
+        for path, digests in hashes.items():
+            if path in sizes and digests[which] is not None:
+                buckets.setdefault((sizes[path], digests[which]), []).append(path)
+        return [bucket for bucket in buckets.values() if len(bucket) > 1]
+
+    def _hash_files(self, executor, paths, partial, hashes, changed, summary):
+        if not paths: return
+        futures = {executor.submit(content_hash, path, partial): path for path in paths}
+        for done_count, future in enumerate(as_completed(futures), 1):
+            if self._cancel_event.is_set():
+                for pending in futures: pending.cancel()
+                return
+            path = futures[future]
             try:
-                file_path = self.play_queue.get(timeout=0.1)
-                if not file_path or not os.path.isfile(file_path):
-                    continue
-                
-                self._interrupt = False
-                self.is_song_active = True
-                self.current_file = file_path
-                self.pending_seek_while_paused = None # 重置
-                
-                container = None
-                seek_target = None
-                
-                try:
-                    while self.is_song_active and not self._interrupt and not self._stop:
-                        container = av.open(file_path)
-                        audio_stream = container.streams.audio[0]
-                        
-                        if seek_target is not None:
-                            pts_target = int(seek_target / audio_stream.time_base)
-                            container.seek(pts_target, stream=audio_stream, backward=True)
-                            seek_target = None
-                        else:
-                            self.total_duration_sec = float(audio_stream.duration * audio_stream.time_base)
-                            sample_rate = audio_stream.rate
-                            channels = audio_stream.layout.nb_channels
-                            self.playback_started.emit(file_path, self.total_duration_sec)
-                            self.stream = self.p_audio.open(
-                                format=pyaudio.paInt16, channels=channels, rate=sample_rate, output=True)
-                            self.playback_start_time = time.time()
-                            self.paused_at_sec = 0
-                            self._paused = False
-
-                        resampler = None
-                        source_format = audio_stream.codec_context.format.name
-                        if source_format != 's16':
-                            resampler = av.AudioResampler(format='s16', layout=audio_stream.layout.name, rate=audio_stream.rate)
-                        
-
-                        for frame in container.decode(audio_stream):
-                            if self._stop or self._interrupt: break
-                            
-                            # --- 1. 命令处理与暂停等待区 ---
-                            # 这是一个统一的循环，它会一直处理命令，直到播放器不处于暂停状态
-                            # 并且没有 seek 请求。
-                            while self._paused or not self.command_queue.empty():
-                                seek_val = self.process_commands()
-                                if seek_val is not None:
-                                    seek_target = seek_val
-                                    break # 收到 seek 指令，跳出等待循环
-                                
-                                # 如果处理完命令后仍然是暂停状态，就短暂休眠
-                                if self._paused:
-                                    time.sleep(0.01)
-                                else:
-                                    # 如果不是暂停状态了（比如收到了unpause），就跳出等待循环
-                                    break
-                                
-                                if self._stop or self._interrupt: break
-                            
-                            if self._stop or self._interrupt or seek_target is not None: break
-
-                            # --- 2. 音频帧处理区 ---
-                            # 能走到这里，说明播放器一定处于“播放”状态
-                            frames_to_process = [frame]
-                            if resampler:
-                                frames_to_process = resampler.resample(frame)
-
-                            for final_frame in frames_to_process:
-                                data = final_frame.to_ndarray().tobytes()
-                                if self.stream: self.stream.write(data)
-                            
-                            current_pos = time.time() - self.playback_start_time
-                            self.position_changed.emit(current_pos)
-                        
-                        container.close()
-                        container = None
-                        
-                        if seek_target is None:
-                            break
-
-                    if not self._stop and not self._interrupt:
-                        self.playback_finished.emit()
-
-                except Exception as e:
-                    self.playback_error.emit(f"({os.path.basename(file_path)}): {e}")
-                finally:
-                    self.is_song_active = False
-                    if self.stream:
-                        self.stream.stop_stream()
-                        self.stream.close()
-                        self.stream = None
-                    if container:
-                        container.close()
-
-            except queue.Empty:
+                digest = future.result()
+            except (OSError, ValueError) as e:   # 文件已被删除或无法读取
+                hashes.pop(path, None)
+                if not self.acoustic:   # 否则算指纹时还会再读一次，失败由那里记录
+                    summary[self.FAILED] += 1
+                    summary['failures'].append((path, str(e)))
                 continue
-        
-        self.p_audio.terminate()
-
-    # process_commands 方法保持我上次提供的版本，它本身是正确的
-    def process_commands(self):
+            hashes.setdefault(path, [None, None])[0 if partial else 1] = digest
+            changed.add(path)
+            summary['hashed'] += 1
+            if done_count % 64 == 0 or done_count == len(futures):
+                self.progress.emit(self.HASHING, done_count, len(futures))
+
+    def _fingerprint_all(self, summary, files):
+        """files: [(路径, 修改时间)]。返回 {路径: (修改时间, 时长, 粗签名)}，只含有可用指纹的文件。"""
+        signatures = {}
+        mtimes = dict(files)
+        cached = self.library_index.cached_signatures(files)
+        for path, (duration, signature) in cached.items():
+            if signature: signatures[path] = (mtimes[path], duration, signature)
+        summary['cached'] = len(cached)
+        pending = deque(item for item in files if item[0] not in cached)
+        finished_count = len(files) - len(pending)
+        self.progress.emit(self.FINGERPRINTING, finished_count, len(files))
+        in_flight, to_store = {}, []
+        executor = ProcessPoolExecutor(max_workers=self.MAX_WORKERS, mp_context=self._context,
+                                       initializer=_init_fingerprint_worker, initargs=(self._cancel_event,))
         try:
-            cmd, value = self.command_queue.get_nowait()
-            if cmd == 'pause':
-                if not self._paused:
-                    self.paused_at_sec = time.time() - self.playback_start_time
-                    self._paused = True
-            
-            elif cmd == 'unpause':
-                if self._paused:
-                    if self.pending_seek_while_paused is not None:
-                        seek_val = self.pending_seek_while_paused
-                        self.pending_seek_while_paused = None
-                        self.playback_start_time = time.time() - seek_val
-                        self._paused = False
-                        return seek_val
-                    else:
-                        self.playback_start_time = time.time() - self.paused_at_sec
-                        self._paused = False
-
-            elif cmd == 'seek':
-                self.paused_at_sec = value
-                self.seek_completed.emit(int(value))
-                
-                if self._paused:
-                    self.pending_seek_while_paused = value
+            while pending or in_flight:
+                if self._cancel_event.is_set():
+                    summary[self.CANCELLED] += len(pending)
+                    finished_count += len(pending)
+                    pending.clear()
+                while pending and len(in_flight) < self.MAX_WORKERS * 2:
+                    item = pending.popleft()
+                    in_flight[executor.submit(_run_fingerprint_job, item[0])] = item
+                if not in_flight: break
+
+                done, _ = wait(in_flight, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, mtime = in_flight.pop(future)
+                    try:
+                        status, result = future.result()
+                    except Exception as e:   # 例如工作进程意外退出
+                        status, result = self.FAILED, str(e)
+                    summary[status] += 1
+                    if status == self.DONE:
+                        duration, fine, signature = result
+                        to_store.append((path, mtime, duration, fine, signature))
+                        if signature: signatures[path] = (mtime, duration, signature)
+                    elif status == self.FAILED:
+                        summary['failures'].append((path, result))
+                    finished_count += 1
+                if len(to_store) >= self.SAVE_BATCH:
+                    self.library_index.save_fingerprints(to_store)
+                    to_store = []
+                if done: self.progress.emit(self.FINGERPRINTING, finished_count, len(files))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if to_store: self.library_index.save_fingerprints(to_store)
+        return signatures
+
+    def _match(self, signatures):
+        """用局部敏感哈希找出候选对，逐对核实后返回重复组 [[路径]]。"""
+        paths = list(signatures)
+        if len(paths) < 2: return []
+        durations = np.array([signatures[path][1] for path in paths])
+        packed = np.frombuffer(b"".join(signatures[path][2] for path in paths), dtype=np.uint8).reshape(len(paths), -1)
+        rng = np.random.default_rng(0)   # 抽取的位置固定，结果可以复现
+        candidates = set()
+        for _ in range(self.LSH_TABLES):
+            positions = rng.choice(packed.shape[1] * 8, self.LSH_BITS, replace=False)
+            bits = (packed[:, positions >> 3] >> (7 - (positions & 7)).astype(np.uint8)) & 1
+            keys = (bits.astype(np.int64) << np.arange(self.LSH_BITS)).sum(axis=1)
+            order = np.argsort(keys, kind='stable')
+            boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+            starts, ends = np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(keys)]))
+            shared = ends - starts > 1
+            for start, end in zip(starts[shared], ends[shared]):
+                bucket = order[start:end].tolist()
+                if len(bucket) <= self.MAX_BUCKET_PAIRS:
+                    candidates.update(itertools.combinations(bucket, 2))
                 else:
-                    self.playback_start_time = time.time() - value
-                    return value
+                    candidates.update(zip(bucket, bucket[1:]))
+        candidates = [(i, j) for i, j in candidates if abs(durations[i] - durations[j]) <= self.DURATION_TOLERANCE]
+
+        fingerprints = self.library_index.load_fingerprints(
+            paths[i] for i in sorted({i for pair in candidates for i in pair}))
+        parent = list(range(len(paths)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in sorted(candidates):
+            if self._cancel_event.is_set(): return []
+            root_i, root_j = find(i), find(j)
+            if root_i == root_j: continue   # 已经通过别的文件连在一起了
+            a = np.frombuffer(fingerprints.get(paths[i], b""), dtype=np.uint32)
+            b = np.frombuffer(fingerprints.get(paths[j], b""), dtype=np.uint32)
+            if len(a) and len(b) and fingerprint_distance(a, b) <= self.MAX_BIT_ERROR_RATE:
+                parent[root_j] = root_i
+        groups = {}
+        for i, path in enumerate(paths):
+            groups.setdefault(find(i), []).append(path)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def _rank(self, groups, mtimes):
+        """每组按音质从高到低排序。需要的音频信息优先取索引中的缓存，没有的才读文件头。"""
+        members = [(path, mtimes[path]) for group in groups for path in group]
+        records = self.library_index.cached_metadata(members)
+        probed = [(path, mtime, probe_audio_metadata(path)) for path, mtime in members if path not in records]
+        if probed:
+            self.library_index.save_metadata(probed)
+            records.update((path, record) for path, _, record in probed)
+        outputs = self.library_index.conversion_outputs(path for path, _ in members)
+        ranked = [sorted(group, reverse=True, key=lambda path: audio_quality_key(
+                      records[path], mtimes[path], path in outputs)) for group in groups]
+        return sorted(ranked)
+
+
+def format_file_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0: return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} GB"
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60: return f"{minutes}:{seconds:02d}"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class FileCatalog:
+    """
+    紧凑的列式文件目录，取代每个文件一个 dict、再按路径建字典的做法。
+    每个文件用一个整数行号标识；目录前缀只保存一次(驻留)，每行只记目录编号和文件名，
+    大小、修改时间和标记等状态存放在 NumPy 数组中。
+    删除只打墓碑标志，行号在整个会话中保持不变；重新打开目录时整体清空。
+    按路径查找走路径哈希的有序数组(二分查找)，最近追加的行先放在一个小字典里，攒够了再并入。
+    后台读取到的音频信息同样按列存放：数值各占一列，编码名称驻留后只记编号，标签只为有标签的行保存。
+    文件大小或修改时间变化后信息作废，等待重新读取。
+    """
+    MARKED = 1
+    DELETED = 2
+    PROBED = 4    # 已读取音频信息
+    MERGE_THRESHOLD = 4096
 
-        except queue.Empty:
-            pass
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._directories = []          # 目录编号 -> 目录前缀(含末尾分隔符)
+        self._directory_ids = {}
+        self._names = []
+        self._count = 0
+        self._dir_ids = np.empty(0, dtype=np.int32)
+        self._sizes = np.empty(0, dtype=np.int64)
+        self._mtimes = np.empty(0, dtype=np.int64)
+        self._flags = np.empty(0, dtype=np.uint8)
+        self._hashes = np.empty(0, dtype=np.int64)
+        self._durations = np.empty(0, dtype=np.float32)   # 未知为 NaN
+        self._sample_rates = np.empty(0, dtype=np.int32)  # 以下三列未知为 0
+        self._bit_depths = np.empty(0, dtype=np.uint8)
+        self._bitrates = np.empty(0, dtype=np.int32)
+        self._codec_ids = np.empty(0, dtype=np.int16)     # 未知为 -1
+        self._codecs = []
+        self._codec_index = {}
+        self._tags = {}                 # 行号 -> (标题, 艺术家, 专辑)
+        self._sorted_hashes = np.empty(0, dtype=np.int64)
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        self._recent = {}               # 尚未并入有序哈希数组的 路径 -> 行号
+        self.live_count = 0
+
+    def __len__(self):
+        """行号的上界 (包括已删除的行)。"""
+        return self._count
+
+    # --- 写入 ---
+    def append(self, file_infos):
+        """追加一批文件(调用方保证路径不重复)，返回新行号组成的数组。file_info 中可带 'marked'。"""
+        first = self._count
+        count = len(file_infos)
+        self._reserve(first + count)
+        end = first + count
+        # 逐行写 NumPy 标量很慢，先攒成列表再整段赋值
+        dir_ids, hashes = [], []
+        directory_ids, names, recent = self._directory_ids, self._names, self._recent
+        for row, file_info in enumerate(file_infos, first):
+            path = file_info['path']
+            cut = max(path.rfind('/'), path.rfind(os.sep)) + 1
+            directory = path[:cut]
+            directory_id = directory_ids.get(directory)
+            if directory_id is None:
+                directory_id = directory_ids[directory] = len(self._directories)
+                self._directories.append(directory)
+            dir_ids.append(directory_id)
+            names.append(path[cut:])
+            hashes.append(hash(path))
+            recent[path] = row
+        self._dir_ids[first:end] = dir_ids
+        self._hashes[first:end] = hashes
+        self._sizes[first:end] = [file_info['size'] for file_info in file_infos]
+        self._mtimes[first:end] = [file_info['mtime'] for file_info in file_infos]
+        self._flags[first:end] = [self.MARKED if file_info.get('marked') else 0 for file_info in file_infos]
+        self._count = end
+        self.live_count += count
+        if len(self._recent) >= max(self.MERGE_THRESHOLD, self._count // 8):
+            self._merge_recent()
+        return np.arange(first, end, dtype=np.int64)
+
+    def update(self, row, size, mtime):
+        self._sizes[row] = size
+        self._mtimes[row] = mtime
+        self._flags[row] &= ~np.uint8(self.PROBED)
+
+    def set_metadata(self, rows, records):
+        """写入一批行的音频信息，records 按 METADATA_FIELDS 的顺序排列。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows): return
+        durations, codec_ids = [], []
+        for row, (duration, codec, _, _, _, title, artist, album) in zip(rows.tolist(), records):
+            durations.append(np.nan if duration is None else duration)
+            if codec is None:
+                codec_ids.append(-1)
+            else:
+                codec_id = self._codec_index.get(codec)
+                if codec_id is None:
+                    codec_id = self._codec_index[codec] = len(self._codecs)
+                    self._codecs.append(codec)
+                codec_ids.append(codec_id)
+            if title or artist or album:
+                self._tags[row] = (title, artist, album)
+            else:
+                self._tags.pop(row, None)
+        self._durations[rows] = durations
+        self._codec_ids[rows] = codec_ids
+        self._sample_rates[rows] = [record[2] or 0 for record in records]
+        self._bit_depths[rows] = [record[3] or 0 for record in records]
+        self._bitrates[rows] = [record[4] or 0 for record in records]
+        self._flags[rows] |= self.PROBED
+
+    def set_marked(self, rows, marked):
+        if marked:
+            self._flags[rows] |= self.MARKED
+        else:
+            self._flags[rows] &= ~np.uint8(self.MARKED)
+
+    def remove(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[(self._flags[rows] & self.DELETED) == 0]
+        self._flags[rows] |= self.DELETED
+        self.live_count -= len(rows)
+        return rows
+
+    # --- 读取 ---
+    def find(self, path):
+        """路径对应的行号；不存在或已删除时返回 None。"""
+        row = self._recent.get(path)
+        if row is not None and not self._flags[row] & self.DELETED:
+            return row
+        path_hash = hash(path)
+        position = int(np.searchsorted(self._sorted_hashes, path_hash))
+        while position < len(self._sorted_hashes) and self._sorted_hashes[position] == path_hash:
+            row = int(self._sorted_rows[position])
+            if not self._flags[row] & self.DELETED and self.path(row) == path:
+                return row
+            position += 1
         return None
-        
-    def _cleanup_stream_resources(self):
-        pass # No longer needed, cleanup is in the `finally` block
-
-    # --- 公共控制方法 (无需修改) ---
-    def pause(self): self.command_queue.put(('pause', None))
-    def unpause(self): self.command_queue.put(('unpause', None))
-    def seek(self, position_sec): self.command_queue.put(('seek', position_sec))
-    def add_to_queue(self, file_path): self.play_queue.put(file_path)
-    
-    def interrupt(self):
-        self._interrupt = True
-        self.is_song_active = False
 
-    def stop(self):
-        self._stop = True
-        self.interrupt()
-        
-    def clear_queue(self):
-        while not self.play_queue.empty():
-            try: self.play_queue.get_nowait()
-            except queue.Empty: pass
-                
-    def remove_file_from_queue(self, file_path):
-        temp_queue = queue.Queue()
-        while not self.play_queue.empty():
-            try:
-                item = self.play_queue.get_nowait()
-                if item != file_path: temp_queue.put(item)
-            except queue.Empty: break
-        self.play_queue = temp_queue
+    def path(self, row):
+        return self._directories[self._dir_ids[row]] + self._names[row]
 
+    def name(self, row):
+        return self._names[row]
 
+    def size(self, row):
+        return int(self._sizes[row])
 
-class ConverterThread(QThread):
-    conversion_finished = pyqtSignal(str, str)
-    conversion_progress = pyqtSignal(int)
+    def mtime(self, row):
+        return int(self._mtimes[row])
 
-    def __init__(self, input_path, output_path, target_format='mp3', options=None, parent=None):
-        super().__init__(parent)
-        self.input_path = input_path
-        self.output_path = output_path
-        self.target_format = target_format
-        self.options = options if options is not None else {}
+    def is_marked(self, row):
+        return bool(self._flags[row] & self.MARKED)
 
-    def run(self):
-        try:
-            input_container = av.open(self.input_path)
-            in_stream = input_container.streams.audio[0]
-            
-            total_duration = in_stream.duration * in_stream.time_base if in_stream.duration else 1
-            if total_duration <= 0: total_duration = 1
+    def is_probed(self, row):
+        return bool(self._flags[row] & self.PROBED)
 
-            output_container = av.open(self.output_path, mode='w')
+    def unprobed(self, rows):
+        """rows 中尚未读取音频信息的行。"""
+        return rows[(self._flags[rows] & self.PROBED) == 0]
 
-            if self.target_format == 'mp3':
-                # --- MP3 转换路径: 融合了采样率和声道布局的正确处理 ---
-                
-                MP3_SUPPORTED_RATES = {8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000}
-                
-                target_rate = in_stream.rate
-                if in_stream.rate not in MP3_SUPPORTED_RATES:
-                    target_rate = 44100 
-                
-                out_stream = output_container.add_stream(
-                    self.target_format, 
-                    rate=target_rate
-                    # layout 参数被永久、正确地移除了！
-                )
+    def duration(self, row):
+        duration = self._durations[row]
+        return None if np.isnan(duration) else float(duration)
 
-                if 'b:a' in self.options:
-                    out_stream.codec_context.bit_rate = int(self.options['b:a'].replace('k', '')) * 1000
+    def codec(self, row):
+        codec_id = self._codec_ids[row]
+        return None if codec_id < 0 else self._codecs[codec_id]
 
-                # 现在，FFmpeg已经为out_stream选择了一个最佳的layout，我们用它来配置重采样器
-                resampler = av.AudioResampler(
-                    format=out_stream.codec_context.format.name,
-                    layout=out_stream.layout.name, # 使用FFmpeg自动选择的布局
-                    rate=out_stream.rate,
-                )
+    def sample_rate(self, row):
+        return int(self._sample_rates[row])
 
-                last_progress = -1
-                for in_frame in input_container.decode(in_stream):
-                    for out_frame in resampler.resample(in_frame):
-                        for packet in out_stream.encode(out_frame):
-                            output_container.mux(packet)
-                    
-                    current_time = in_frame.pts * in_stream.time_base if in_frame.pts else 0
-                    progress = int((current_time / total_duration) * 100)
-                    if progress > last_progress: self.conversion_progress.emit(progress); last_progress = progress
-                
-                for out_frame in resampler.resample(None):
-                     for packet in out_stream.encode(out_frame):
-                        output_container.mux(packet)
-                for packet in out_stream.encode(None):
-                    output_container.mux(packet)
+    def bit_depth(self, row):
+        return int(self._bit_depths[row])
 
-            else:
-                # --- 无损转换路径 (WAV, FLAC): 同样不建议强制设置 layout，让FFmpeg处理 ---
-                out_stream = output_container.add_stream(
-                    self.target_format, 
-                    rate=in_stream.rate
-                    # layout 参数在这里也移除，以获得更好的健壮性
-                )
-                
-                last_progress = -1
-                for frame in input_container.decode(in_stream):
-                    for packet in out_stream.encode(frame):
-                        output_container.mux(packet)
+    def bitrate(self, row):
+        return int(self._bitrates[row])
 
-                    current_time = frame.pts * frame.time_base if frame.pts else 0
-                    progress = int((current_time / total_duration) * 100)
-                    if progress > last_progress: self.conversion_progress.emit(progress); last_progress = progress
-                
-                for packet in out_stream.encode(None):
-                    output_container.mux(packet)
+    def tags(self, row):
+        """(标题, 艺术家, 专辑)，没有的为 None。"""
+        return self._tags.get(row, (None, None, None))
 
-            input_container.close()
-            output_container.close()
-            
-            self.conversion_finished.emit(self.output_path, None)
+    def live_rows(self):
+        return np.flatnonzero(self.live_mask())
 
-        except Exception as e:
-            error_info = f"编码器: {self.target_format}, 选项: {self.options}\n错误: {e}"
-            self.conversion_finished.emit(self.output_path, error_info)
+    def live_mask(self):
+        return (self._flags[:self._count] & self.DELETED) == 0
 
+    def marked_rows(self):
+        return np.flatnonzero((self._flags[:self._count] & (self.MARKED | self.DELETED)) == self.MARKED)
 
+    def has_marked(self):
+        return bool(np.any((self._flags[:self._count] & (self.MARKED | self.DELETED)) == self.MARKED))
 
-class FileScannerThread(QThread):
-    chunk_ready = pyqtSignal(list)
-    finished = pyqtSignal(int)
+    def marked_mask(self):
+        return (self._flags[:self._count] & self.MARKED) != 0
+
+    # --- 内部实现 ---
+    def _reserve(self, capacity):
+        if capacity <= len(self._sizes): return
+        new_capacity = max(capacity, len(self._sizes) * 2, 1024)
+        for attribute in ('_dir_ids', '_sizes', '_mtimes', '_flags', '_hashes', '_durations',
+                          '_sample_rates', '_bit_depths', '_bitrates', '_codec_ids'):
+            old = getattr(self, attribute)
+            grown = np.empty(new_capacity, dtype=old.dtype)
+            grown[:self._count] = old[:self._count]
+            setattr(self, attribute, grown)
+
+    def _merge_recent(self):
+        rows = np.fromiter(self._recent.values(), dtype=np.int64, count=len(self._recent))
+        hashes = self._hashes[rows]
+        order = np.argsort(hashes, kind='stable')
+        rows, hashes = rows[order], hashes[order]
+        positions = np.searchsorted(self._sorted_hashes, hashes)
+        self._sorted_hashes = np.insert(self._sorted_hashes, positions, hashes)
+        self._sorted_rows = np.insert(self._sorted_rows, positions, rows)
+        self._recent.clear()
 
-    def __init__(self, directory, parent=None):
+
+class FileNameIndex:
+    """
+    文件名搜索索引。所有文件名转成小写后以 UTF-8 首尾相接存进一个 NumPy 字节数组，
+    每个名字后面跟一个 \\0，另有一张按目录行号排列的起始偏移表。
+    搜索时先用查询的第一个字节在整块数据上向量化地找出候选位置，再逐字节收窄，
+    最后用偏移表把命中位置换算成行号。UTF-8 是自同步编码，字节上的子串匹配与字符上的一致。
+    最近几次查询的命中位置保存下来：在原查询后面继续输入时只需检查上次的命中位置，
+    删掉末尾字符时直接取回更早的结果。
+    """
+    HISTORY_SIZE = 32
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._bytes = np.empty(0, dtype=np.uint8)
+        self._size = 0
+        self._offsets = np.empty(0, dtype=np.int64)   # 目录行号 -> 名字在 _bytes 中的起始位置
+        self._count = 0
+        self._history = []   # [(查询字节串, 命中位置)]，每一项都是后一项的前缀
+
+    def add(self, names):
+        """按目录行号顺序追加一批文件名。"""
+        if not names: return
+        data = np.frombuffer(("\0".join(names).lower() + "\0").encode('utf-8'), dtype=np.uint8)
+        ends = np.flatnonzero(data == 0)
+        self._reserve(self._size + len(data), self._count + len(ends))
+        self._bytes[self._size:self._size + len(data)] = data
+        self._offsets[self._count] = self._size
+        self._offsets[self._count + 1:self._count + len(ends)] = self._size + ends[:-1] + 1
+        self._size += len(data)
+        self._count += len(ends)
+        self._history.clear()   # 缓存的命中位置不包括新加的名字
+
+    def search(self, text, first_row=0):
+        """名字中包含 text (不区分大小写) 的行号，升序排列；只考虑行号不小于 first_row 的行。"""
+        query = text.lower().replace("\0", "").encode('utf-8')
+        if not query:
+            return np.arange(first_row, self._count, dtype=np.int64)
+        if first_row:
+            positions = self._scan(query, int(self._offsets[first_row]) if first_row < self._count else self._size)
+        else:
+            positions = self._search_with_history(query)
+        # 命中位置是升序的，换算出的行号也是升序的，同一个名字里的多次命中相邻，去掉重复即可
+        rows = np.searchsorted(self._offsets[:self._count], positions, side='right') - 1
+        if len(rows) > 1:
+            rows = rows[np.concatenate(([True], rows[1:] != rows[:-1]))]
+        return rows
+
+    def _search_with_history(self, query):
+        while self._history and not query.startswith(self._history[-1][0]):
+            self._history.pop()
+        if self._history and self._history[-1][0] == query:
+            return self._history[-1][1]
+        if self._history:
+            known, positions = self._history[-1]
+            positions = self._narrow(positions, query, len(known))
+        else:
+            positions = self._scan(query, 0)
+        self._history.append((query, positions))
+        del self._history[:-self.HISTORY_SIZE]
+        return positions
+
+    def _scan(self, query, start):
+        """在 _bytes[start:] 中查找 query 的所有出现位置。"""
+        limit = self._size - len(query) + 1
+        if limit <= start:
+            return np.empty(0, dtype=np.int64)
+        positions = np.flatnonzero(self._bytes[start:limit] == query[0]) + start
+        return self._narrow(positions, query, 1)
+
+    def _narrow(self, positions, query, matched):
+        """positions 处已匹配了 query 的前 matched 个字节，逐字节检查剩下的部分。"""
+        for k in range(matched, len(query)):
+            positions = positions[positions + k < self._size]
+            positions = positions[self._bytes[positions + k] == query[k]]
+        return positions
+
+    def _reserve(self, size, count):
+        if size > len(self._bytes):
+            grown = np.empty(max(size, len(self._bytes) * 2, 1 << 16), dtype=np.uint8)
+            grown[:self._size] = self._bytes[:self._size]
+            self._bytes = grown
+        if count > len(self._offsets):
+            grown = np.empty(max(count, len(self._offsets) * 2, 1024), dtype=np.int64)
+            grown[:self._count] = self._offsets[:self._count]
+            self._offsets = grown
+
+
+class FileListModel(QAbstractTableModel):
+    """
+    文件列表的数据模型，数据全部来自 FileCatalog。
+    显示用的字符串在视图请求时才格式化，所以只有当前可见的行才有开销。
+    筛选也在模型内完成：视图只看得到 _visible 中列出的目录行号，不必对每一行调用 setRowHidden。
+    文件名搜索走 FileNameIndex；筛选结果变化时只对显示状态真正改变的行发出增删通知。
+    时长、格式等音频信息由后台线程陆续读取，读到之前这几列显示为空。
+    """
+    mark_toggled = pyqtSignal(str, bool)   # 用户点击了复选框: 路径, 是否标记
+
+    NAME_COLUMN = 0
+    SIZE_COLUMN = 1
+    DURATION_COLUMN = 2
+    FORMAT_COLUMN = 3
+    BITRATE_COLUMN = 4
+    ARTIST_COLUMN = 5
+    TITLE_COLUMN = 6
+    HEADERS = ("文件名", "大小", "时长", "格式", "码率", "艺术家", "标题")
+    RIGHT_ALIGNED_COLUMNS = (SIZE_COLUMN, DURATION_COLUMN, BITRATE_COLUMN)
+    MAX_ROW_RUNS = 64   # 可见行的变化超过这么多段时，改用一次布局变化通知
+
+    def __init__(self, catalog, parent=None):
         super().__init__(parent)
-        self.directory = directory
-        self.is_running = True
-        self.CHUNK_SIZE = 100
+        self.catalog = catalog
+        self.name_index = FileNameIndex()
+        self._visible = np.empty(0, dtype=np.int64)   # 视图行 -> 目录行号，递增
+        self._mark_filter = None  # None: 不按标记筛选; True/False: 只显示已标记/未标记
+        self._search_text = ""
+        self._name_flags = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsUserCheckable
+        self._size_flags = Qt.ItemIsSelectable | Qt.ItemIsEnabled
+
+    # --- Qt 模型接口 ---
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._visible)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = int(self._visible[index.row()]), index.column()
+        catalog = self.catalog
+        if role == Qt.DisplayRole:
+            if column == self.NAME_COLUMN:
+                return ("★ " if catalog.is_marked(row) else "") + catalog.name(row)
+            if column == self.SIZE_COLUMN:
+                return format_file_size(catalog.size(row))
+            return self._metadata_text(row, column) if catalog.is_probed(row) else ""
+        if role == Qt.CheckStateRole and column == self.NAME_COLUMN:
+            return Qt.Checked if catalog.is_marked(row) else Qt.Unchecked
+        if role == Qt.TextAlignmentRole and column in self.RIGHT_ALIGNED_COLUMNS:
+            return Qt.AlignRight | Qt.AlignVCenter
+        if role == Qt.ToolTipRole and column in (self.ARTIST_COLUMN, self.TITLE_COLUMN):
+            title, artist, album = catalog.tags(row)
+            if album: return f"{title or ''}\n{artist or ''}\n专辑: {album}"
+        if role == Qt.UserRole:
+            return catalog.path(row)
+        return None
 
-    def run(self):
-        audio_extensions = ('.mp3', '.wav', '.flac', '.ogg', '.m4a', '.wma', '.aac')
-        chunk = []
-        total_files = 0
-        try:
-            for entry in os.scandir(self.directory):
-                if not self.is_running: break
-                if entry.is_file() and entry.name.lower().endswith(audio_extensions):
-                    try:
-                        file_path = entry.path
-                        file_size = entry.stat().st_size
-                        chunk.append({'name': entry.name, 'path': file_path, 'size': file_size})
-                        if len(chunk) >= self.CHUNK_SIZE:
-                            self.chunk_ready.emit(chunk)
-                            chunk = []
-                    except OSError: continue
-            if self.is_running and chunk: self.chunk_ready.emit(chunk)
-            total_files = sum(1 for f in os.scandir(self.directory) if f.is_file() and f.name.lower().endswith(audio_extensions))
-        except Exception as e:
-            print(f"Error scanning directory: {e}")
-        finally:
-            if self.is_running:
-                self.finished.emit(total_files)
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or index.column() != self.NAME_COLUMN:
+            return False
+        marked = value == Qt.Checked
+        row = int(self._visible[index.row()])
+        self.set_marked_rows([row], marked)
+        self.mark_toggled.emit(self.catalog.path(row), marked)
+        return True
+
+    def _metadata_text(self, row, column):
+        catalog = self.catalog
+        if column == self.DURATION_COLUMN:
+            duration = catalog.duration(row)
+            return "" if duration is None else format_duration(duration)
+        if column == self.FORMAT_COLUMN:
+            codec = catalog.codec(row)
+            if codec is None: return ""
+            parts = [codec.split('_')[0].upper()]
+            if catalog.sample_rate(row): parts.append(f"{catalog.sample_rate(row) / 1000:g} kHz")
+            if catalog.bit_depth(row): parts.append(f"{catalog.bit_depth(row)} bit")
+            return " / ".join(parts)
+        if column == self.BITRATE_COLUMN:
+            bitrate = catalog.bitrate(row)
+            return f"{round(bitrate / 1000)} kbps" if bitrate else ""
+        title, artist, _ = catalog.tags(row)
+        return (artist if column == self.ARTIST_COLUMN else title) or ""
+
+    def flags(self, index):
+        # 视图布局时会对每一行调用，避免多余的调用开销
+        return self._name_flags if index.column() == self.NAME_COLUMN else self._size_flags
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    # --- 数据操作 ---
+    def clear(self):
+        self.beginResetModel()
+        self.catalog.clear()
+        self.name_index.clear()
+        self._visible = np.empty(0, dtype=np.int64)
+        self.endResetModel()
+
+    def append_files(self, file_infos):
+        """在目录末尾追加一批文件，可见的新行只发出一次插入通知。返回新行的目录行号。"""
+        if not file_infos: return np.empty(0, dtype=np.int64)
+        rows = self.catalog.append(file_infos)
+        self.name_index.add([self.catalog.name(row) for row in range(rows[0], rows[-1] + 1)])
+        new_visible = self._matching_rows(int(rows[0]))
+        if len(new_visible):
+            first_view_row = len(self._visible)
+            self.beginInsertRows(QModelIndex(), first_view_row, first_view_row + len(new_visible) - 1)
+            self._visible = np.concatenate((self._visible, new_visible))
+            self.endInsertRows()
+        return rows
+
+    def update_file(self, row, size, mtime):
+        self.catalog.update(row, size, mtime)
+        view_row = self._view_row(row)
+        if view_row is not None:
+            # 音频信息随之作废，那几列也一起刷新
+            self.dataChanged.emit(self.index(view_row, self.SIZE_COLUMN),
+                                  self.index(view_row, len(self.HEADERS) - 1), [Qt.DisplayRole])
+
+    def set_metadata(self, rows, records):
+        """后台读到了一批行的音频信息，可见的行只发出一次 dataChanged。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows): return
+        self.catalog.set_metadata(rows, records)
+        positions = self._view_positions(rows)
+        if len(positions):
+            self.dataChanged.emit(self.index(int(positions.min()), self.DURATION_COLUMN),
+                                  self.index(int(positions.max()), len(self.HEADERS) - 1),
+                                  [Qt.DisplayRole, Qt.ToolTipRole])
+
+    def set_marked_rows(self, rows, marked):
+        """批量设置标记状态，只发出一次 dataChanged；按标记筛选时不再符合条件的行随即隐藏。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows): return
+        self.catalog.set_marked(rows, marked)
+        if self._mark_filter is not None and self._mark_filter != marked:
+            self._set_visible(self._visible[~np.isin(self._visible, rows)])
+            return
+        positions = self._view_positions(rows)
+        if len(positions):
+            self.dataChanged.emit(self.index(int(positions.min()), self.NAME_COLUMN),
+                                  self.index(int(positions.max()), self.NAME_COLUMN),
+                                  [Qt.DisplayRole, Qt.CheckStateRole])
+
+    def set_all_marked(self, marked):
+        self.set_marked_rows(self.catalog.live_rows(), marked)
+
+    def remove_rows(self, rows):
+        """删除若干文件：目录中打墓碑标志，可见行一次过滤掉，再用一次布局变化通知视图。"""
+        rows = self.catalog.remove(rows)
+        if not len(rows): return
+        self._set_visible(self._visible[~np.isin(self._visible, rows)])
+
+    def set_filter(self, mark_filter, search_text):
+        """设置筛选条件。mark_filter 为 None 表示不按标记筛选。"""
+        self._mark_filter = mark_filter
+        self._search_text = search_text
+        self._set_visible(self._matching_rows())
+
+    def row_at(self, view_row):
+        return int(self._visible[view_row])
+
+    def path_at(self, view_row):
+        return self.catalog.path(int(self._visible[view_row]))
+
+    def view_rows_with_mark(self, marked):
+        """当前可见的行中，标记状态等于 marked 的视图行号。"""
+        return np.flatnonzero(self.catalog.marked_mask()[self._visible] == marked)
+
+    def unprobed_rows_in_view(self, first_view_row, last_view_row):
+        """视图行 first_view_row..last_view_row 中尚未读取音频信息的目录行号。"""
+        return self.catalog.unprobed(self._visible[first_view_row:last_view_row + 1])
+
+    def view_row_of(self, file_path):
+        """文件在视图中的行号；被筛选隐藏或不存在时返回 None。"""
+        row = self.catalog.find(file_path)
+        return None if row is None else self._view_row(row)
+
+    # --- 内部实现 ---
+    def _matching_rows(self, first_row=0):
+        """行号不小于 first_row 且符合当前筛选条件的目录行号，升序排列。"""
+        rows = self.name_index.search(self._search_text, first_row)
+        catalog = self.catalog
+        mask = catalog.live_mask()[rows]
+        if self._mark_filter is not None:
+            mask &= catalog.marked_mask()[rows] == self._mark_filter
+        return rows[mask]
+
+    def _view_positions(self, rows):
+        """rows 中当前可见的那些行的视图行号。"""
+        positions = np.searchsorted(self._visible, rows)
+        positions = positions[positions < len(self._visible)]
+        return positions[np.isin(self._visible[positions], rows)]
+
+    def _view_row(self, row):
+        view_row = int(np.searchsorted(self._visible, row))
+        if view_row < len(self._visible) and self._visible[view_row] == row:
+            return view_row
+        return None
+
+    def _set_visible(self, visible):
+        """
+        换成新的可见行列表。只有显示状态改变了的行才通知视图：连续的一段行合并成一次
+        删除或插入通知，视图不必重新布局其余的行，选中状态也自然保留。
+        变化零散到分成很多段时，逐段通知反而更慢，改为一次布局变化。
+        """
+        old_visible = self._visible
+        removed = np.flatnonzero(~np.isin(old_visible, visible, assume_unique=True))
+        added = np.flatnonzero(~np.isin(visible, old_visible, assume_unique=True))
+        if not len(removed) and not len(added): return
+        removed_runs, added_runs = self._row_runs(removed), self._row_runs(added)
+        if len(removed_runs) + len(added_runs) > self.MAX_ROW_RUNS:
+            self._relayout(visible)
+            return
+        # 先自下而上删除，剩下的行与新列表中保留的行顺序一致；再自上而下按新位置插入
+        for start, end in reversed(removed_runs):
+            self.beginRemoveRows(QModelIndex(), start, end - 1)
+            self._visible = np.delete(self._visible, slice(start, end))
+            self.endRemoveRows()
+        for start, end in added_runs:
+            self.beginInsertRows(QModelIndex(), start, end - 1)
+            self._visible = np.insert(self._visible, start, visible[start:end])
+            self.endInsertRows()
+
+    @staticmethod
+    def _row_runs(positions):
+        """把升序的位置数组切成连续的区间 [(start, end), ...]。"""
+        if not len(positions): return []
+        breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+        starts = np.concatenate(([positions[0]], positions[breaks]))
+        ends = np.concatenate((positions[breaks - 1], [positions[-1]])) + 1
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    def _relayout(self, visible):
+        """一次布局变化换掉整个可见行列表，选中状态等持久索引跟随目录行号迁移。"""
+        self.layoutAboutToBeChanged.emit()
+        old_visible = self._visible
+        self._visible = visible
+        old_indexes = self.persistentIndexList()
+        new_indexes = []
+        for index in old_indexes:
+            view_row = self._view_row(int(old_visible[index.row()]))
+            new_indexes.append(QModelIndex() if view_row is None else self.index(view_row, index.column()))
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+
+class ConversionQueueDialog(QDialog):
+    """
+    批量转换队列窗口：每个任务一行，显示进度或结果；底部是总体进度和取消按钮。
+    窗口不是模态的，关掉以后转换仍在后台继续。
+    """
+    cancel_requested = pyqtSignal()
+
+    STATUS_TEXT = {BatchConverterThread.DONE: "完成", BatchConverterThread.FAILED: "失败",
+                   BatchConverterThread.CANCELLED: "已取消"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("批量转换")
+        self.resize(760, 420)
+        layout = QVBoxLayout(self)
+
+        self.job_table = QTableWidget(0, 3)
+        self.job_table.setHorizontalHeaderLabels(["源文件", "输出文件", "状态"])
+        self.job_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.job_table.verticalHeader().setVisible(False)
+        self.job_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.job_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        self.job_table.setColumnWidth(2, 100)
+        layout.addWidget(self.job_table)
+
+        self.overall_progress = QProgressBar()
+        self.overall_progress.setRange(0, 100)
+        layout.addWidget(self.overall_progress)
+
+        button_layout = QHBoxLayout()
+        self.summary_label = QLabel()
+        button_layout.addWidget(self.summary_label, 1)
+        self.cancel_button = QPushButton("取消全部")
+        self.cancel_button.clicked.connect(self.cancel_requested.emit)
+        button_layout.addWidget(self.cancel_button)
+        close_button = QPushButton("关闭")
+        close_button.clicked.connect(self.hide)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+    def reset(self):
+        self.job_table.setRowCount(0)
+        self.overall_progress.setValue(0)
+        self.summary_label.clear()
+        self.cancel_button.setEnabled(True)
+
+    def add_jobs(self, first_job_id, jobs):
+        """任务编号就是表格的行号。"""
+        self.job_table.setRowCount(first_job_id + len(jobs))
+        for job_id, (input_path, output_path, _, _) in enumerate(jobs, first_job_id):
+            self.job_table.setItem(job_id, 0, QTableWidgetItem(os.path.basename(input_path)))
+            self.job_table.setItem(job_id, 1, QTableWidgetItem(os.path.basename(output_path)))
+            self.job_table.setItem(job_id, 2, QTableWidgetItem("等待中"))
+            self.job_table.item(job_id, 0).setToolTip(input_path)
+            self.job_table.item(job_id, 1).setToolTip(output_path)
+
+    def set_job_progress(self, job_id, percent):
+        self.job_table.item(job_id, 2).setText(f"{percent}%")
+
+    def set_job_finished(self, job_id, status, message):
+        item = self.job_table.item(job_id, 2)
+        item.setText(self.STATUS_TEXT[status])
+        if message: item.setToolTip(message)
+
+    def set_overall_progress(self, finished_count, total_count, percent):
+        self.overall_progress.setValue(int(percent))
+        self.summary_label.setText(f"已完成 {finished_count}/{total_count}")
+
+    def show_summary(self, text):
+        self.overall_progress.setValue(100)
+        self.summary_label.setText(text)
+        self.cancel_button.setEnabled(False)
 
-    def stop(self):
-        self.is_running = False
 
 class LoopMode(Enum):
     NO_LOOP = auto()      # 不循环
@@ -415,21 +3616,27 @@ class AudioFileManager(QMainWindow):
 
         # --- 1. 初始化核心数据和状态 ---
         self.current_dir = ""
-        self.audio_files = [] 
+        self.catalog = FileCatalog()
         self.playlist = []
         self.current_playlist_index = -1
         self.loop_mode = LoopMode.NO_LOOP
         self._initial_split_set = False
         self.is_paused = False
-        self.marked_files = set()
-        self.path_to_info_map = {}
-        self.path_to_item_map = {}
         self.current_song_duration = 0
         self.is_user_interacting = False
         self.is_seeking = False
-        self._is_programmatic_change = False
-        self.converter_thread = None
-        self.path_to_select_after_scan = None
+        self.batch_converter = None
+        self.conversion_dialog = None
+        self.metadata_thread = None
+        self.peak_thread = None
+        self.loudness_thread = None
+        self.duplicate_finder = None
+        self.conversion_sources = {}   # 输出路径 -> 排队时源文件的 (大小, 修改时间)，转换成功后写入转换记录
+        self.conversion_preset = DEFAULT_CONVERSION_PRESET
+        self.library_index = LibraryIndex()
+        self.library_watcher = LibraryWatcher(self.library_index, self)
+        self.library_watcher.changes_detected.connect(self.on_library_changed)
+        self._gapless_next_index = -1   # 已告知播放线程的无缝衔接目标索引
 
 
         # --- 2. 创建所有的UI“零件” (Widgets) ---
@@ -458,24 +3665,35 @@ class AudioFileManager(QMainWindow):
         # 中心分割区域
         self.splitter = QSplitter(Qt.Horizontal)
         
-        # 左侧文件列表
-        self.file_list = QTreeWidget()
-        self.file_list.setColumnCount(2)
-        self.file_list.setHeaderHidden(True)
-        self.file_list.setHeaderLabels(["文件名", "大小"])
-        self.file_list.setSelectionMode(QTreeWidget.ExtendedSelection)
+        # 左侧文件列表 (模型/视图，行数再多也只绘制可见的部分)
+        self.file_list_model = FileListModel(self.catalog, self)
+        self.file_list = QTableView()
+        self.file_list.setModel(self.file_list_model)
+        self.file_list.setShowGrid(False)
+        self.file_list.setWordWrap(False)
+        self.file_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.file_list.setSelectionBehavior(QAbstractItemView.SelectRows)
         font = QFont()
         font.setPointSize(11)
         self.file_list.setFont(font)
-        header = self.file_list.header()
+        # 所有行等高：行高由表头统一给出，不需要逐行计算尺寸
+        vertical_header = self.file_list.verticalHeader()
+        vertical_header.hide()
+        vertical_header.setSectionResizeMode(QHeaderView.Fixed)
+        vertical_header.setDefaultSectionSize(self.height_spinbox.value())
+        # 列多了以后需要表头说明每一列是什么
+        header = self.file_list.horizontalHeader()
         header.setStretchLastSection(False)
-        header.setSectionResizeMode(0, QHeaderView.Stretch)
-        header.setSectionResizeMode(1, QHeaderView.Interactive)
-        self.file_list.setColumnWidth(1, 150)
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setSectionResizeMode(FileListModel.NAME_COLUMN, QHeaderView.Stretch)
+        for column, width in ((FileListModel.SIZE_COLUMN, 100), (FileListModel.DURATION_COLUMN, 70),
+                              (FileListModel.FORMAT_COLUMN, 170), (FileListModel.BITRATE_COLUMN, 90),
+                              (FileListModel.ARTIST_COLUMN, 140), (FileListModel.TITLE_COLUMN, 180)):
+            self.file_list.setColumnWidth(column, width)
         self.file_list.setStyleSheet("""
-            QTreeWidget { background-color: #f0f0f0; border: 1px solid #ccc; border-radius: 5px; }
-            QTreeWidget::item { padding-top: 1px; padding-bottom: 1px; border-bottom: 1px solid #e0e0e0; }
-            QTreeWidget::item:selected { background-color: #e3f2fd; color: #000; }
+            QTableView { background-color: #f0f0f0; border: 1px solid #ccc; border-radius: 5px; }
+            QTableView::item { padding-top: 1px; padding-bottom: 1px; border-bottom: 1px solid #e0e0e0; }
+            QTableView::item:selected { background-color: #e3f2fd; color: #000; }
         """)
 
         # 右侧播放列表面板
@@ -500,6 +3718,7 @@ class AudioFileManager(QMainWindow):
         self.current_time_label = QLabel("00:00")
         self.progress_slider = ClickableSlider(Qt.Horizontal)
         self.progress_slider.setEnabled(False)
+        self.progress_slider.setMinimumHeight(36)   # 给后面的波形概览留出高度
         self.total_time_label = QLabel("00:00")
 
         # 底部主控制按钮
@@ -517,13 +3736,40 @@ class AudioFileManager(QMainWindow):
         # 状态栏、工具栏和菜单栏
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
+        self.underrun_label = QLabel()
+        self.underrun_label.setToolTip("音频输出缓冲区欠载(断音)的累计次数。")
+        self.underrun_label.hide()
+        self.status_bar.addPermanentWidget(self.underrun_label)
+        self.output_format_label = QLabel()
+        self.output_format_label.setToolTip("当前音频输出的采样格式与转换路径。")
+        self.output_format_label.hide()
+        self.status_bar.addPermanentWidget(self.output_format_label)
         self.toolbar = QToolBar("主工具栏")
         self.addToolBar(self.toolbar)
 
         # --- 5. 初始化后台线程 ---
         self.scanner_thread = None
+        self.deleter_thread = None
         self.player_thread = AudioPlayerThread()
         self.player_thread.start()
+        # 以显示刷新率轮询播放位置，代替播放线程逐帧发来的信号
+        self.position_timer = QTimer(self)
+        self.position_timer.setInterval(33)
+        # 搜索框输入停顿一小段时间后才筛选，连续打字时不会每个按键都过滤一遍
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.filter_files)
+
+        # 可见区域变化后稍等片刻，再让音频信息线程优先读取当前可见的行
+        self.metadata_priority_timer = QTimer(self)
+        self.metadata_priority_timer.setSingleShot(True)
+        self.metadata_priority_timer.setInterval(100)
+        self.metadata_priority_timer.timeout.connect(self.update_metadata_priority)
+        self.file_list.verticalScrollBar().valueChanged.connect(lambda: self.metadata_priority_timer.start())
+        for signal in (self.file_list_model.rowsInserted, self.file_list_model.rowsRemoved,
+                       self.file_list_model.layoutChanged, self.file_list_model.modelReset):
+            signal.connect(lambda: self.metadata_priority_timer.start())
 
         # --- 3. 创建菜单栏和工具栏 (在所有需要的控件都创建之后) ---
         self.create_menu_bar()
@@ -587,13 +3833,13 @@ class AudioFileManager(QMainWindow):
         # --- 6. 连接所有信号和槽 ---
         self.browse_button.clicked.connect(self.browse_directory)
         self.filter_combo.currentIndexChanged.connect(self.filter_files)
-        self.search_input.textChanged.connect(self.filter_files)
+        self.search_input.textChanged.connect(lambda: self.search_timer.start())
         self.height_spinbox.valueChanged.connect(self.adjust_item_height)
-        self.file_list.itemSelectionChanged.connect(self.update_button_states)
-        self.file_list.itemDoubleClicked.connect(self.play_audio)
+        self.file_list.selectionModel().selectionChanged.connect(self.update_button_states)
+        self.file_list.doubleClicked.connect(self.play_audio)
         self.file_list.setContextMenuPolicy(Qt.CustomContextMenu)
         self.file_list.customContextMenuRequested.connect(self.show_context_menu)
-        self.file_list.itemChanged.connect(self.on_item_changed)
+        self.file_list_model.mark_toggled.connect(self.on_mark_toggled)
         self.playlist_widget.itemDoubleClicked.connect(self.play_from_playlist)
         self.prev_button.clicked.connect(self.play_previous)
         self.playlist_widget.setContextMenuPolicy(Qt.CustomContextMenu)
@@ -612,8 +3858,11 @@ class AudioFileManager(QMainWindow):
         self.player_thread.playback_started.connect(self.on_playback_started)
         self.player_thread.playback_finished.connect(self.on_playback_finished)
         self.player_thread.playback_error.connect(self.on_playback_error)
-        self.player_thread.position_changed.connect(self.on_position_changed)
+        self.position_timer.timeout.connect(self._poll_playback_position)
         self.player_thread.seek_completed.connect(self.on_seek_completed)
+        self.player_thread.track_changed.connect(self.on_track_changed)
+        self.player_thread.buffer_underrun.connect(self.on_buffer_underrun)
+        self.player_thread.output_format_changed.connect(self.on_output_format_changed)
 
         self._update_menu_actions_state()
         
@@ -636,11 +3885,11 @@ class AudioFileManager(QMainWindow):
         """
         在操作系统的文件管理器中显示选中的文件。
         """
-        selected_items = self.file_list.selectedItems()
-        if not selected_items:
+        selected_paths = self.selected_paths()
+        if not selected_paths:
             return
 
-        file_path = selected_items[0].data(0, Qt.UserRole)
+        file_path = selected_paths[0]
         
         self._reveal_file_in_explorer(file_path) 
             
@@ -726,6 +3975,7 @@ class AudioFileManager(QMainWindow):
         elif self.current_playlist_index != -1:
             # 如果当前正在播放，但移除的歌曲在后面，只需重新高亮
             self.highlight_current_song()
+        self._update_gapless_next_track()
             
         self.status_bar.showMessage(f"已从播放列表移除文件: {os.path.basename(removed_path)}")
     
@@ -740,16 +3990,29 @@ class AudioFileManager(QMainWindow):
         if self.scanner_thread and self.scanner_thread.isRunning():
             self.scanner_thread.stop()
             self.scanner_thread.wait()
-        self.file_list.clear()
-        self.audio_files = []
-        self.path_to_info_map.clear()
-        self.path_to_item_map.clear()
+        # 目录行号在清空后会重新编号，旧线程的结果不能再用
+        self.stop_metadata_probe()
+        self.library_watcher.clear()
+        self.file_list_model.clear()
         
         if not self.current_dir: return
-        self.set_controls_enabled(False)
-        self.status_bar.showMessage("正在扫描目录，请稍候...")
-        self.scanner_thread = FileScannerThread(self.current_dir)
+        self.metadata_thread = MetadataProbeThread(self.library_index)
+        self.metadata_thread.metadata_ready.connect(self.on_metadata_ready)
+        self.metadata_thread.start()
+        # 先用索引里的记录立即显示列表，再在后台扫描磁盘，只同步有变化的条目
+        cached_files = self.library_index.load(self.current_dir)
+        if cached_files:
+            self.add_file_chunk(cached_files)
+            self.status_bar.showMessage(f"已从索引载入 {len(cached_files)} 个音频文件，正在后台同步目录...")
+        else:
+            self.set_controls_enabled(False)
+            self.status_bar.showMessage("正在扫描目录，请稍候...")
+        self.scanner_thread = FileScannerThread(self.current_dir, cached_files, self.library_index)
         self.scanner_thread.chunk_ready.connect(self.add_file_chunk)
+        self.scanner_thread.files_updated.connect(self.on_files_updated)
+        self.scanner_thread.files_removed.connect(self.on_files_removed)
+        self.scanner_thread.marks_restored.connect(self.on_marks_restored)
+        self.scanner_thread.progress.connect(self.on_scan_progress)
         self.scanner_thread.finished.connect(self.on_scan_finished)
         self.scanner_thread.start()
 
@@ -777,6 +4040,13 @@ class AudioFileManager(QMainWindow):
             self.status_bar.showMessage("已暂停")
             self.is_paused = True
 
+    def _poll_playback_position(self):
+        """
+        由 position_timer 定时调用，读取播放线程发布的最新位置。
+        后台更新再频繁，界面每个周期也最多刷新一次，事件队列不会积压。
+        """
+        self.on_position_changed(self.player_thread.published_position)
+
     def on_position_changed(self, position_sec):
         """
         这个槽函数现在由一个“门卫”标志保护。
@@ -785,6 +4055,10 @@ class AudioFileManager(QMainWindow):
         if self.is_user_interacting:
             return
 
+        # 进度条和时间标签都只精确到秒，秒数没变时不必重绘
+        if int(position_sec) == self.progress_slider.value():
+            return
+
         # 如果用户没有在操作，则像以前一样忠实地更新UI
         if position_sec <= self.current_song_duration:
             self.progress_slider.blockSignals(True)
@@ -792,14 +4066,16 @@ class AudioFileManager(QMainWindow):
             self.progress_slider.blockSignals(False)
             self.current_time_label.setText(self.format_time(position_sec))
 
-    def on_seek_completed(self, seek_time):
+    def on_seek_completed(self, seek_time, latency_ms):
         """
         这是后台发来的“投降”信号，表示它已成功跳转到指定位置。
         只有在此刻，我们才安全地将UI的控制权交还给后台。
         """
         # 作为最后的保险，确保UI在视觉上与后台确认的时间完全同步
-        self.progress_slider.setValue(seek_time)
-        self.current_time_label.setText(self.format_time(seek_time))
+        if not self.is_user_interacting:
+            self.progress_slider.setValue(seek_time)
+            self.current_time_label.setText(self.format_time(seek_time))
+        self.progress_slider.setToolTip(f"上次跳转耗时: {latency_ms:.1f} ms")
         
         
     def slider_pressed(self):
@@ -819,8 +4095,31 @@ class AudioFileManager(QMainWindow):
         # ★★★ 核心：在发出seek命令后，立刻允许后台信号恢复UI更新 ★★★
         self.is_user_interacting = False
 
+    def show_waveform(self, file_path):
+        """在进度条后面显示波形概览：有缓存时立即画出，否则在后台边算边画。"""
+        self.stop_waveform()
+        peaks = load_cached_peaks(file_path)
+        self.progress_slider.set_peaks(peaks)
+        if peaks is not None: return
+        self.peak_thread = PeakOverviewThread(file_path)
+        self.peak_thread.peaks_updated.connect(self.on_peaks_updated)
+        self.peak_thread.start()
+
+    def on_peaks_updated(self, file_path, peaks, fraction):
+        if self.sender() is self.peak_thread:
+            self.progress_slider.set_peaks(peaks, fraction)
+
+    def stop_waveform(self):
+        if self.peak_thread is not None:
+            self.peak_thread.stop()
+            self.peak_thread.wait()
+            self.peak_thread = None
+
     def reset_progress_ui(self):
         """重置进度条和时间标签"""
+        self.stop_waveform()
+        self.progress_slider.set_peaks(None)
+        self.position_timer.stop()
         self.progress_slider.setValue(0)
         self.progress_slider.setEnabled(False)
         self.current_time_label.setText("00:00")
@@ -829,126 +4128,140 @@ class AudioFileManager(QMainWindow):
 
 
     def add_file_chunk(self, chunk):
-        for file_info_from_thread in chunk:
-            file_path = file_info_from_thread['path']
-            marked = file_path in self.marked_files
-            file_info = {
-                'name': file_info_from_thread['name'],
-                'path': file_path,
-                'size': file_info_from_thread['size'],
-                'marked': marked
-            }
-            self.audio_files.append(file_info)
-            
-            item = self.create_and_add_list_item(file_info)
-            self.path_to_info_map[file_path] = file_info
-            self.path_to_item_map[file_path] = item
-            
-        QApplication.processEvents()
+        new_files = []
+        catalog = self.catalog
+        for file_info in chunk:
+            if catalog.find(file_info['path']) is not None:
+                # 同一个文件可能先由转换完成时单独加入，之后又被扫描到
+                self.on_files_updated([file_info])
+                continue
+            new_files.append(file_info)
+
+        # 整块只通知视图一次，筛选条件由模型自己应用；
+        # 不再逐块调用 processEvents，每块本身就是一个排队的信号
+        rows = self.file_list_model.append_files(new_files)
+        self.queue_metadata(rows)
+
+    def on_files_updated(self, chunk):
+        """后台同步发现文件大小或修改时间变了，只刷新对应的条目，并重新读取音频信息。"""
+        rows = []
+        for file_info in chunk:
+            row = self.catalog.find(file_info['path'])
+            if row is None: continue
+            self.file_list_model.update_file(row, file_info['size'], file_info['mtime'])
+            rows.append(row)
+        self.queue_metadata(rows)
+
+    def queue_metadata(self, rows):
+        """把这些行交给音频信息线程读取 (索引中有缓存的不会真正读文件)。"""
+        if self.metadata_thread is None or not len(rows): return
+        catalog = self.catalog
+        self.metadata_thread.enqueue([(row, catalog.path(row), catalog.mtime(row)) for row in map(int, rows)])
+
+    def on_metadata_ready(self, results):
+        """音频信息线程送来一批结果。读取期间文件又变了或已被删除的结果丢弃，变化后的文件已重新排队。"""
+        if self.sender() is not self.metadata_thread:
+            return   # 换目录之前已经排进事件队列的旧结果
+        catalog = self.catalog
+        live = catalog.live_mask()
+        results = [(row, record) for row, mtime, record in results if live[row] and catalog.mtime(row) == mtime]
+        if results:
+            rows, records = zip(*results)
+            self.file_list_model.set_metadata(rows, records)
+
+    def update_metadata_priority(self):
+        """让音频信息线程先读取视图中当前可见、还没有信息的行。"""
+        if self.metadata_thread is None: return
+        first = self.file_list.rowAt(0)
+        if first < 0: return
+        last = self.file_list.rowAt(self.file_list.viewport().height() - 1)
+        if last < 0: last = self.file_list_model.rowCount() - 1
+        rows = self.file_list_model.unprobed_rows_in_view(first, last)
+        if len(rows): self.metadata_thread.prioritize(rows.tolist())
+
+    def stop_metadata_probe(self):
+        if self.metadata_thread is not None:
+            self.metadata_thread.stop()
+            self.metadata_thread.wait()
+            self.metadata_thread = None
+
+    def on_files_removed(self, paths):
+        """后台同步发现索引中的文件已不在磁盘上，从列表中移除。"""
+        rows = [row for row in map(self.catalog.find, paths) if row is not None]
+        self.file_list_model.remove_rows(rows)
+        self.update_button_states()
+
+    def on_marks_restored(self, paths):
+        """后台同步发现这些文件是从别处移动过来的，恢复它们原来的标记。"""
+        rows = [row for row in map(self.catalog.find, paths) if row is not None]
+        self.file_list_model.set_marked_rows(rows, True)
+        self.update_button_states()
+
+    def add_single_file(self, file_path, select=False):
+        """把单个新文件(例如转换输出)写入索引并加入列表，不必重新扫描整个目录。"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        file_info = {'name': os.path.basename(file_path), 'path': file_path,
+                     'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        self.library_index.apply_changes([file_info])
+
+        prefix, _ = LibraryIndex._path_range(self.current_dir) if self.current_dir else ("", "")
+        if not prefix or not file_path.startswith(prefix):
+            return   # 不在当前打开的目录中，只记入索引
+        self.add_file_chunk([file_info])
+        view_row = self.file_list_model.view_row_of(file_path)
+        if select and view_row is not None:
+            self.select_paths([file_path])
+            self.file_list.scrollTo(self.file_list_model.index(view_row, 0))
+
+    def on_scan_progress(self, found_count, files_per_sec):
+        self.status_bar.showMessage(f"正在扫描目录，已找到 {found_count} 个音频文件 ({files_per_sec:.0f} 个/秒)...")
 
     def on_scan_finished(self, total_count):
-        self.status_bar.showMessage(f"加载完成，共找到 {len(self.audio_files)} 个音频文件")
+        scanner = self.scanner_thread
+        message = f"加载完成，共找到 {self.catalog.live_count} 个音频文件 ({scanner.files_per_sec:.0f} 个/秒)"
+        if scanner.known_files:
+            message += f"，新增 {scanner.added_count}、更新 {scanner.updated_count}、移除 {scanner.removed_count}"
+        self.status_bar.showMessage(message)
         self.set_controls_enabled(True)
-        self.filter_files() # 确保所有文件都根据当前筛选器正确显示
-
-        # ★★★ 核心改动：检查是否有待选中的文件 ★★★
-        if self.path_to_select_after_scan:
-            item_to_select = self.path_to_item_map.get(self.path_to_select_after_scan)
-            if item_to_select:
-                self.file_list.clearSelection() # 清除之前的选择
-                item_to_select.setSelected(True)
-                self.file_list.scrollToItem(item_to_select) # 滚动到该项，确保可见
-            
-            # ★★★ 重置标记，防止下次刷新时再次选中 ★★★
-            self.path_to_select_after_scan = None
+        # 之后目录里的变化由监视器增量同步，不再需要重新扫描
+        self.library_watcher.watch(scanner.directories)
+
+    def on_library_changed(self, added, updated, removed):
+        if added: self.add_file_chunk(added)
+        if updated: self.on_files_updated(updated)
+        if removed: self.on_files_removed(removed)
+        self.status_bar.showMessage(f"目录内容已变化：新增 {len(added)}、更新 {len(updated)}、移除 {len(removed)}")
 
     def set_controls_enabled(self, enabled):
         self.browse_button.setEnabled(enabled)
         self.filter_combo.setEnabled(enabled)
         self.search_input.setEnabled(enabled)
 
-    # --- 已修改为创建 QTreeWidgetItem ---
-    def create_and_add_list_item(self, file_info):
-        item = QTreeWidgetItem()
-        
-        initial_height = self.height_spinbox.value() 
-        item.setSizeHint(0, QSize(0, initial_height)) # 为第0列设置高度
-        
-        item.setData(0, Qt.UserRole, file_info['path']) # 将路径数据存储在第0列
-        item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
-        item.setCheckState(0, Qt.Checked if file_info['marked'] else Qt.Unchecked)
-        
-        self.update_item_text(item, file_info)
-        self.file_list.addTopLevelItem(item) # 使用 addTopLevelItem 添加项
-        return item
-
-    # --- 已重写为 QTreeWidget 更新文本 ---
-    def update_item_text(self, item, file_info):
-        # 第0列: 标记 + 文件名
-        star = "★ " if file_info['marked'] else ""
-        name_text = f"{star}{file_info['name']}"
-        item.setText(0, name_text)
-
-        # 第1列: 文件大小
-        size_str = self.format_file_size(file_info.get('size', 0))
-        item.setText(1, size_str)
-        
-        # 将文件大小列右对齐
-        item.setTextAlignment(1, Qt.AlignRight | Qt.AlignVCenter)
-
-    # --- 已修改为适配 QTreeWidget ---
     def adjust_item_height(self):
-        new_height = self.height_spinbox.value()
-        new_size_hint = QSize(0, new_height)
-        # 遍历 QTreeWidget 的顶层项目
-        for i in range(self.file_list.topLevelItemCount()):
-            item = self.file_list.topLevelItem(i)
-            if item:
-                item.setSizeHint(0, new_size_hint) # 为第0列设置高度
-
-    # --- 已修改以处理 QTreeWidget 的 itemChanged 信号 ---
-    def on_item_changed(self, item, column):
-        # 确保我们只响应复选框列(第0列)的变化
-        if self._is_programmatic_change or column != 0: 
-            return
-            
-        file_path = item.data(0, Qt.UserRole) # 从第0列获取数据
-        is_checked = (item.checkState(0) == Qt.Checked) # 从第0列获取状态
-        
-        if is_checked: self.marked_files.add(file_path)
-        else: self.marked_files.discard(file_path)
-        
-        file_info = self.path_to_info_map.get(file_path)
-        if file_info:
-            file_info['marked'] = is_checked
-            self.update_item_text(item, file_info)
-            filter_type = self.filter_combo.currentText()
-            if (filter_type == "已标记" and not is_checked) or \
-               (filter_type == "未标记" and is_checked):
-                item.setHidden(True)
+        # 所有行等高，只需修改表头的默认行高
+        self.file_list.verticalHeader().setDefaultSectionSize(self.height_spinbox.value())
+
+    def on_mark_toggled(self, file_path, is_checked):
+        """用户直接点击了复选框。模型已更新了自己的显示，这里把标记写入索引。"""
+        self.library_index.set_marked([file_path], is_checked)
         self.update_button_states()
 
     def filter_files(self):
-        if self.scanner_thread and self.scanner_thread.isRunning(): return
+        self.search_timer.stop()
         filter_type = self.filter_combo.currentText()
-        search_text = self.search_input.text().lower()
-
-        for file_path, file_info in self.path_to_info_map.items():
-            item = self.path_to_item_map.get(file_path)
-            if not item: continue
-
-            show = True
-            if filter_type == "已标记" and not file_info['marked']: show = False
-            if filter_type == "未标记" and file_info['marked']: show = False
-            if search_text and search_text not in file_info['name'].lower(): show = False
-            item.setHidden(not show)
+        mark_filter = {"已标记": True, "未标记": False}.get(filter_type)
+        self.file_list_model.set_filter(mark_filter, self.search_input.text())
             
-    def _create_conversion_submenu(self, parent_menu):
+    def _create_conversion_submenu(self, parent_menu, title="格式转换", source="selection"):
         """
         一个辅助函数，用于创建格式转换的子菜单。
         这避免了在右键菜单和顶部菜单中重复定义，确保两者完全一致。
+        source 为 "selection" 时转换选中的文件，为 "marked" 时转换所有已标记的文件。
         """
-        convert_menu = parent_menu.addMenu("格式转换")
+        convert_menu = parent_menu.addMenu(title)
 
         # ★★★ 最终确认版：移除OGG，只保留可靠的转换选项 ★★★
         supported_formats = [
@@ -962,7 +4275,7 @@ class AudioFileManager(QMainWindow):
         for display_name, codec, extension, options in supported_formats:
             action = convert_menu.addAction(display_name)
             action.triggered.connect(
-                lambda checked=False, c=codec, e=extension, o=options: self.start_conversion(c, e, o)
+                lambda checked=False, c=codec, e=extension, o=options: self.start_conversion(c, e, o, source)
             )
         
         return convert_menu
@@ -1037,8 +4350,32 @@ class AudioFileManager(QMainWindow):
         self.prev_action.triggered.connect(self.play_previous)
         playback_menu.addAction(self.prev_action)
         playback_menu.addSeparator()
+        self.gapless_action = QAction("无缝播放", self, checkable=True)
+        self.gapless_action.setChecked(self.player_thread.gapless)
+        self.gapless_action.setToolTip("提前解码下一首并复用音频输出流，消除曲目之间的停顿。")
+        self.gapless_action.triggered.connect(self.set_gapless_playback)
+        playback_menu.addAction(self.gapless_action)
+        self.high_resolution_action = QAction("高精度输出", self, checkable=True)
+        self.high_resolution_action.setChecked(self.player_thread.high_resolution_output)
+        self.high_resolution_action.setToolTip("24 位或浮点音源以 32 位整数/浮点格式直接输出，关闭后统一转换为 16 位。")
+        self.high_resolution_action.triggered.connect(self.set_high_resolution_output)
+        playback_menu.addAction(self.high_resolution_action)
+        self.normalization_action = QAction("音量标准化", self, checkable=True)
+        self.normalization_action.setToolTip(
+            f"按响度分析的结果把每首歌调到 {NORMALIZATION_TARGET_LUFS:g} LUFS，真峰值不超过 "
+            f"{NORMALIZATION_PEAK_CEILING:g} dBTP；没有分析过的歌曲保持原音量。")
+        self.normalization_action.triggered.connect(self.set_volume_normalization)
+        playback_menu.addAction(self.normalization_action)
+        buffer_menu = playback_menu.addMenu("输出缓冲")
+        buffer_group = QActionGroup(self)
+        buffer_group.setExclusive(True)
+        for milliseconds in (100, 250, 500, 1000):
+            action = QAction(f"{milliseconds} ms", self, checkable=True)
+            action.setChecked(milliseconds == self.player_thread.buffer_duration_ms)
+            action.triggered.connect(lambda checked=False, ms=milliseconds: self.set_output_buffer(ms))
+            buffer_group.addAction(action)
+            buffer_menu.addAction(action)
         loop_menu = playback_menu.addMenu("循环模式")
-        from PyQt5.QtWidgets import QActionGroup
         loop_group = QActionGroup(self)
         loop_group.setExclusive(True)
         self.loop_none_action = QAction("关闭循环", self, checkable=True)
@@ -1057,6 +4394,47 @@ class AudioFileManager(QMainWindow):
 
         tools_menu = menu_bar.addMenu("工具(&T)")
         self.convert_menu = self._create_conversion_submenu(tools_menu)
+        self.convert_marked_menu = self._create_conversion_submenu(tools_menu, "转换所有已标记文件", "marked")
+        tools_menu.addSeparator()
+        preset_menu = tools_menu.addMenu("转换预设")
+        preset_group = QActionGroup(self)
+        preset_group.setExclusive(True)
+        for key, preset in CONVERSION_PRESETS.items():
+            action = QAction(preset['name'], self, checkable=True)
+            action.setChecked(key == self.conversion_preset)
+            action.triggered.connect(lambda checked=False, k=key: self.set_conversion_preset(k))
+            preset_menu.addAction(action)
+            preset_group.addAction(action)
+        self.incremental_conversion_action = QAction("增量转换", self, checkable=True)
+        self.incremental_conversion_action.setChecked(True)
+        self.incremental_conversion_action.setToolTip(
+            "目标文件已存在时，源文件和转换参数都没有变化就直接跳过，有变化的自动重新转换。")
+        tools_menu.addAction(self.incremental_conversion_action)
+        tools_menu.addSeparator()
+        loudness_menu = tools_menu.addMenu("响度分析")
+        self.analyze_selected_loudness_action = QAction("分析选中文件", self)
+        self.analyze_selected_loudness_action.triggered.connect(lambda: self.start_loudness_analysis("selection"))
+        loudness_menu.addAction(self.analyze_selected_loudness_action)
+        self.analyze_all_loudness_action = QAction("分析所有文件", self)
+        self.analyze_all_loudness_action.triggered.connect(lambda: self.start_loudness_analysis("all"))
+        loudness_menu.addAction(self.analyze_all_loudness_action)
+        self.cancel_loudness_action = QAction("取消响度分析", self)
+        self.cancel_loudness_action.triggered.connect(self.cancel_loudness_analysis)
+        loudness_menu.addAction(self.cancel_loudness_action)
+        duplicate_menu = tools_menu.addMenu("查找重复音频")
+        self.find_duplicates_action = QAction("查找并标记多余的副本", self)
+        self.find_duplicates_action.setToolTip(
+            "按声学指纹找出内容相同的音频 (格式或码率不同也能识别)，每组保留音质最好的一个，其余的标记出来。")
+        self.find_duplicates_action.triggered.connect(lambda: self.start_duplicate_search(acoustic=True))
+        duplicate_menu.addAction(self.find_duplicates_action)
+        self.find_exact_duplicates_action = QAction("只查找完全相同的文件", self)
+        self.find_exact_duplicates_action.setToolTip(
+            "按文件大小和内容哈希找出字节完全相同的文件，不解码音频，速度很快；其余的副本同样会被标记。")
+        self.find_exact_duplicates_action.triggered.connect(lambda: self.start_duplicate_search(acoustic=False))
+        duplicate_menu.addAction(self.find_exact_duplicates_action)
+        self.cancel_duplicates_action = QAction("取消查找", self)
+        self.cancel_duplicates_action.triggered.connect(self.cancel_duplicate_search)
+        duplicate_menu.addAction(self.cancel_duplicates_action)
 
         # --- 4. 视图菜单 (View) ---
         view_menu = menu_bar.addMenu("视图(&V)")
@@ -1090,6 +4468,7 @@ class AudioFileManager(QMainWindow):
         """由菜单栏调用，用于设置循环模式并更新UI。"""
         self.loop_mode = mode
         self.update_loop_button_ui() # 更新按钮文本
+        self._update_gapless_next_track()
         # 注意：菜单的状态由 QActionGroup 自动管理，我们无需手动更新
 
     def update_loop_menu_state(self):
@@ -1125,31 +4504,46 @@ class AudioFileManager(QMainWindow):
         open_action.triggered.connect(self.browse_directory)
         self.toolbar.addAction(open_action)
 
-    def format_file_size(self, size):
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size < 1024.0: return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} GB"
-
-    # --- 已修改为从第0列获取数据 ---
-    def get_selected_file_info(self):
-        selected_items = self.file_list.selectedItems()
-        if selected_items:
-            file_path = selected_items[0].data(0, Qt.UserRole)
-            return self.path_to_info_map.get(file_path)
-        return None
+    def selected_paths(self):
+        """按行顺序返回所有选中文件的路径。"""
+        rows = sorted(index.row() for index in self.file_list.selectionModel().selectedRows())
+        return [self.file_list_model.path_at(row) for row in rows]
+
+    def select_paths(self, paths):
+        """用给定路径替换当前选择。"""
+        model = self.file_list_model
+        self.select_view_rows(row for row in map(model.view_row_of, paths) if row is not None)
+
+    def select_view_rows(self, rows):
+        """用给定的视图行替换当前选择，相邻的行合并成一个选择区间，只产生一次选择变化信号。"""
+        model = self.file_list_model
+        rows = sorted(int(row) for row in rows)
+        selection = QItemSelection()
+        start = previous = None
+        for row in rows + [None]:
+            if row is not None and previous is not None and row == previous + 1:
+                previous = row
+                continue
+            if start is not None:
+                selection.select(model.index(start, 0), model.index(previous, model.columnCount() - 1))
+            start = previous = row
+        self.file_list.selectionModel().select(selection, QItemSelectionModel.ClearAndSelect)
+
+    def current_row(self):
+        """第一个选中文件在目录中的行号；没有选择时返回 None。"""
+        view_rows = [index.row() for index in self.file_list.selectionModel().selectedRows()]
+        return self.file_list_model.row_at(min(view_rows)) if view_rows else None
 
     def update_button_states(self):
-        selected_items = self.file_list.selectedItems()
-        has_selection = len(selected_items) > 0
+        has_selection = self.file_list.selectionModel().hasSelection()
         
         self.play_button.setEnabled(has_selection)
         self.mark_button.setEnabled(has_selection)
         self.delete_button.setEnabled(has_selection)
         
         if has_selection:
-            file_info = self.get_selected_file_info()
-            if file_info: self.mark_button.setText("取消标记" if file_info['marked'] else "标记")
+            row = self.current_row()
+            if row is not None: self.mark_button.setText("取消标记" if self.catalog.is_marked(row) else "标记")
         
         # ★★★ 新增：调用方法来同步更新菜单栏的状态 ★★★
         self._update_menu_actions_state()
@@ -1158,10 +4552,10 @@ class AudioFileManager(QMainWindow):
         """
         根据当前程序状态，集中更新所有菜单栏动作(QAction)的启用/禁用状态。
         """
-        selected_count = len(self.file_list.selectedItems())
+        selected_count = len(self.file_list.selectionModel().selectedRows())
         has_selection = selected_count > 0
         is_single_selection = selected_count == 1
-        has_marked = bool(self.marked_files)
+        has_marked = self.catalog.has_marked()
         has_playlist = bool(self.playlist)
         is_playing_or_paused = self.player_thread.is_active
 
@@ -1188,112 +4582,85 @@ class AudioFileManager(QMainWindow):
         self.prev_action.setEnabled(has_playlist)
 
         # 工具菜单
-        self.convert_menu.menuAction().setEnabled(is_single_selection)
+        self.convert_menu.menuAction().setEnabled(has_selection)
+        self.convert_marked_menu.menuAction().setEnabled(has_marked)
+        is_analyzing = self.loudness_thread is not None
+        self.analyze_selected_loudness_action.setEnabled(has_selection and not is_analyzing)
+        self.analyze_all_loudness_action.setEnabled(not is_analyzing)
+        self.cancel_loudness_action.setEnabled(is_analyzing)
+        self.find_duplicates_action.setEnabled(self.duplicate_finder is None)
+        self.find_exact_duplicates_action.setEnabled(self.duplicate_finder is None)
+        self.cancel_duplicates_action.setEnabled(self.duplicate_finder is not None)
         
-    # --- 已修改为适配 QTreeWidget ---
     def toggle_mark(self):
-        selected_items = self.file_list.selectedItems()
-        if not selected_items: return
-        marked_count = sum(1 for item in selected_items if item.data(0, Qt.UserRole) in self.marked_files)
-        new_state_is_marked = marked_count <= len(selected_items) / 2
-        filter_type = self.filter_combo.currentText()
-        self._is_programmatic_change = True
-        for item in selected_items:
-            file_path = item.data(0, Qt.UserRole) # 从第0列获取数据
-            if new_state_is_marked: self.marked_files.add(file_path)
-            else: self.marked_files.discard(file_path)
-            
-            file_info = self.path_to_info_map.get(file_path)
-            if file_info:
-                file_info['marked'] = new_state_is_marked
-                item.setCheckState(0, Qt.Checked if new_state_is_marked else Qt.Unchecked) # 在第0列设置状态
-                self.update_item_text(item, file_info)
-            if (filter_type == "已标记" and not new_state_is_marked) or \
-               (filter_type == "未标记" and new_state_is_marked):
-                item.setHidden(True)
-        self._is_programmatic_change = False
+        model = self.file_list_model
+        rows = np.array([model.row_at(index.row()) for index in self.file_list.selectionModel().selectedRows()], dtype=np.int64)
+        if not len(rows): return
+        marked_count = int(np.count_nonzero(self.catalog.marked_mask()[rows]))
+        new_state_is_marked = marked_count <= len(rows) / 2
+        paths = [self.catalog.path(int(row)) for row in rows]
+        self.library_index.set_marked(paths, new_state_is_marked)
+        # 按标记筛选时，不再符合条件的行由模型一并隐藏
+        model.set_marked_rows(rows, new_state_is_marked)
         self.update_button_states()
 
-    # --- 已修改为适配 QTreeWidget ---
     def clear_all_marks(self):
         reply = QMessageBox.question(self, '确认清除标记', "确定要清除所有文件的标记吗?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            self.marked_files.clear()
-            
-            self._is_programmatic_change = True
-            for file_path, file_info in self.path_to_info_map.items():
-                file_info['marked'] = False
-                item = self.path_to_item_map.get(file_path)
-                if item:
-                    item.setCheckState(0, Qt.Unchecked) # 在第0列设置状态
-                    self.update_item_text(item, file_info)
-                    if self.filter_combo.currentText() == "已标记":
-                        item.setHidden(True)
-            self._is_programmatic_change = False
+            self.library_index.clear_marks(self.current_dir)
+            self.file_list_model.set_all_marked(False)
             
             self.status_bar.showMessage("已清除所有标记")
             self.update_button_states()
 
-    # --- 已修改为适配 QTreeWidget ---
     def delete_file(self):
-        selected_items = self.file_list.selectedItems()
-        if not selected_items: return
-        confirm_text = f"确定要删除选中的 {len(selected_items)} 个文件吗?"
-        if len(selected_items) == 1: confirm_text = f"确定要删除文件 '{os.path.basename(selected_items[0].data(0, Qt.UserRole))}' 吗?"
+        selected_paths = self.selected_paths()
+        if not selected_paths: return
+        confirm_text = f"确定要删除选中的 {len(selected_paths)} 个文件吗?"
+        if len(selected_paths) == 1: confirm_text = f"确定要删除文件 '{os.path.basename(selected_paths[0])}' 吗?"
         reply = QMessageBox.question(self, '确认删除', confirm_text, QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            failed_deletions = []
-            items_to_remove = list(selected_items)
-            for item in items_to_remove:
-                file_path = item.data(0, Qt.UserRole)
-                try:
-                    if self.player_thread.current_file == file_path: self.player_thread.interrupt()
-                    self.player_thread.remove_file_from_queue(file_path)
-                    os.remove(file_path)
-                    self.marked_files.discard(file_path)
-                    
-                    if file_path in self.path_to_item_map: del self.path_to_item_map[file_path]
-                    if file_path in self.path_to_info_map: del self.path_to_info_map[file_path]
-                    
-                    self.audio_files = [f for f in self.audio_files if f['path'] != file_path]
-                    
-                    # 使用新的删除方法
-                    index = self.file_list.indexOfTopLevelItem(item)
-                    if index != -1:
-                        self.file_list.takeTopLevelItem(index)
+            self.start_deleting_files(selected_paths)
 
-                except Exception as e: failed_deletions.append(os.path.basename(file_path))
-            if failed_deletions: QMessageBox.warning(self, "删除错误", f"以下文件删除失败:\n" + "\n".join(failed_deletions))
-            else: self.status_bar.showMessage(f"已成功删除 {len(items_to_remove)} 个文件")
-
-    # --- 已修改为适配 QTreeWidget ---
     def delete_marked_files(self):
-        if not self.marked_files:
+        marked_paths = [self.catalog.path(int(row)) for row in self.catalog.marked_rows()]
+        if not marked_paths:
             QMessageBox.information(self, "提示", "没有已标记的文件可供删除。")
             return
-        reply = QMessageBox.question(self, '确认删除', f"确定要删除所有 {len(self.marked_files)} 个已标记的文件吗？\n此操作无法撤销。", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        reply = QMessageBox.question(self, '确认删除', f"确定要删除所有 {len(marked_paths)} 个已标记的文件吗？\n此操作无法撤销。", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            failed_deletions = []
-            marked_paths_to_delete = list(self.marked_files)
-            for file_path in marked_paths_to_delete:
-                try:
-                    if self.player_thread.current_file == file_path: self.player_thread.interrupt()
-                    self.player_thread.remove_file_from_queue(file_path)
-                    os.remove(file_path)
-                    self.marked_files.discard(file_path)
-                    item_to_remove = self.path_to_item_map.get(file_path)
-                    if item_to_remove:
-                        index = self.file_list.indexOfTopLevelItem(item_to_remove)
-                        if index != -1:
-                            self.file_list.takeTopLevelItem(index)
-                    
-                    if file_path in self.path_to_item_map: del self.path_to_item_map[file_path]
-                    if file_path in self.path_to_info_map: del self.path_to_info_map[file_path]
-                    
-                    self.audio_files = [f for f in self.audio_files if f['path'] != file_path]
-                except Exception as e: failed_deletions.append(os.path.basename(file_path))
-            if failed_deletions: QMessageBox.warning(self, "删除完成", f"部分文件删除失败:\n" + "\n".join(failed_deletions))
-            else: self.status_bar.showMessage(f"已成功删除 {len(marked_paths_to_delete)} 个已标记文件")
+            self.start_deleting_files(marked_paths)
+
+    def start_deleting_files(self, file_paths):
+        """
+        在后台删除一批文件。播放队列在开始前只过滤一次；
+        正在播放的文件先停下来，否则在 Windows 上无法删除。
+        """
+        if self.deleter_thread and self.deleter_thread.isRunning():
+            self.status_bar.showMessage("上一批文件仍在删除中，请稍候...")
+            return
+        if self.player_thread.current_file in set(file_paths): self.player_thread.interrupt()
+        self.player_thread.remove_files_from_queue(file_paths)
+
+        self.deleter_thread = FileDeleterThread(file_paths)
+        self.deleter_thread.progress.connect(self.on_delete_progress)
+        self.deleter_thread.finished.connect(self.on_files_deleted)
+        self.deleter_thread.start()
+        self.status_bar.showMessage(f"正在删除 {len(file_paths)} 个文件...")
+
+    def on_delete_progress(self, done_count, total_count):
+        self.status_bar.showMessage(f"正在删除文件 {done_count}/{total_count}...")
+
+    def on_files_deleted(self, deleted_paths, failed_deletions):
+        """删除结束：列表和索引(连同标记)各更新一次。"""
+        self.file_list_model.remove_rows([row for row in map(self.catalog.find, deleted_paths) if row is not None])
+        self.library_index.remove(deleted_paths)
+        self.update_button_states()
+        if failed_deletions:
+            names = [os.path.basename(file_path) for file_path, _ in failed_deletions[:20]]
+            if len(failed_deletions) > len(names): names.append(f"... 等共 {len(failed_deletions)} 个文件")
+            QMessageBox.warning(self, "删除完成", f"已删除 {len(deleted_paths)} 个文件，以下文件删除失败:\n" + "\n".join(names))
+        else: self.status_bar.showMessage(f"已成功删除 {len(deleted_paths)} 个文件")
 
     def play_next(self):
         """播放下一首歌曲，会考虑列表循环模式。"""
@@ -1344,6 +4711,7 @@ class AudioFileManager(QMainWindow):
         
         self.update_loop_button_ui()
         self.update_loop_menu_state() # ★★★ 新增：同步更新菜单栏的选中状态 ★★★
+        self._update_gapless_next_track()
 
     def update_loop_button_ui(self):
         """根据当前循环模式更新按钮的文本"""
@@ -1358,30 +4726,28 @@ class AudioFileManager(QMainWindow):
         """
         【新逻辑】立即播放选中的文件（预览模式），不影响播放列表。
         """
-        file_info = self.get_selected_file_info()
-        if file_info:
-            file_path = file_info['path']
+        row = self.current_row()
+        if row is not None:
+            file_path = self.catalog.path(row)
             
             # 1. 关键：将自己标记为“非播放列表模式”
             self.current_playlist_index = -1
             
             # 2. 清除播放列表中的所有高亮，因为我们现在是预览模式
             self.highlight_current_song()
+            self._update_gapless_next_track()
             
             # 3. 直接将这“一首”歌交给后台去播放
-            self.player_thread.interrupt()
-            self.player_thread.clear_queue()
-            self.player_thread.add_to_queue(file_path)
+            self.player_thread.play_now(file_path)
 
     def add_to_queue(self):
-        selected_items = self.file_list.selectedItems()
-        if not selected_items:
+        selected_paths = self.selected_paths()
+        if not selected_paths:
             return
 
         original_count = len(self.playlist)
 
-        for selected_item in selected_items:
-            file_path = selected_item.data(0, Qt.UserRole)
+        for file_path in selected_paths:
             file_name = os.path.basename(file_path)
             
             self.playlist.append(file_path)
@@ -1398,10 +4764,12 @@ class AudioFileManager(QMainWindow):
             self.playlist_widget.setItemWidget(item, label)
             # --- 改动结束 ---
 
-        self.status_bar.showMessage(f"已将 {len(selected_items)} 个文件添加到播放列表")
+        self.status_bar.showMessage(f"已将 {len(selected_paths)} 个文件添加到播放列表")
 
         if original_count == 0 and self.current_playlist_index == -1:
             self.play_song_at_index(0)
+        else:
+            self._update_gapless_next_track()
 
     def play_next_in_playlist(self):
         # 停止当前可能正在播放的任何内容
@@ -1446,11 +4814,64 @@ class AudioFileManager(QMainWindow):
 
         # 更新UI高亮
         self.highlight_current_song()
+        self._update_gapless_next_track()
 
         # 将这“一首”歌交给后台去播放
-        self.player_thread.interrupt()
-        self.player_thread.clear_queue()
-        self.player_thread.add_to_queue(song_path)
+        self.player_thread.play_now(song_path)
+
+    def _next_playlist_index(self):
+        """
+        根据循环模式计算当前曲目播放完后应该播放的索引。
+        预览模式或列表已播完时返回 -1。
+        """
+        if self.current_playlist_index == -1 or not self.playlist:
+            return -1
+        if self.loop_mode == LoopMode.LOOP_ONE:
+            return self.current_playlist_index
+        if self.loop_mode == LoopMode.LOOP_LIST:
+            return (self.current_playlist_index + 1) % len(self.playlist)
+        next_index = self.current_playlist_index + 1
+        return next_index if next_index < len(self.playlist) else -1
+
+    def _update_gapless_next_track(self):
+        """把下一首告诉播放线程，让它可以提前解码并无缝衔接。"""
+        self._gapless_next_index = self._next_playlist_index()
+        next_path = self.playlist[self._gapless_next_index] if self._gapless_next_index != -1 else None
+        self.player_thread.set_next_track(next_path, self.playlist[self.current_playlist_index]
+                                          if next_path is not None else None)
+
+    def set_gapless_playback(self, enabled):
+        self.player_thread.set_gapless(enabled)
+        self.status_bar.showMessage("已开启无缝播放" if enabled else "已关闭无缝播放")
+
+    def set_high_resolution_output(self, enabled):
+        self.player_thread.set_high_resolution_output(enabled)
+        self.status_bar.showMessage(("已开启" if enabled else "已关闭") + "高精度输出，将在下一首开始时生效")
+
+    def set_volume_normalization(self, enabled):
+        self.player_thread.set_normalization(self.library_index if enabled else None)
+        self.status_bar.showMessage(("已开启" if enabled else "已关闭") + "音量标准化，将在下一首开始时生效")
+
+    def set_output_buffer(self, milliseconds):
+        self.player_thread.set_buffer_duration(milliseconds)
+        self.status_bar.showMessage(f"输出缓冲已设为 {milliseconds} ms，将在下一首开始时生效")
+
+    def on_buffer_underrun(self, count):
+        self.underrun_label.setText(f"欠载: {count}")
+        self.underrun_label.show()
+
+    def on_output_format_changed(self, description):
+        self.output_format_label.setText(f"输出: {description}")
+        self.output_format_label.show()
+
+    def on_track_changed(self, file_path):
+        """播放线程已无缝切换到下一首，只需同步播放列表的指针和高亮。"""
+        index = self._gapless_next_index
+        if not (0 <= index < len(self.playlist)) or self.playlist[index] != file_path:
+            index = self.playlist.index(file_path) if file_path in self.playlist else -1
+        self.current_playlist_index = index
+        self.highlight_current_song()
+        self._update_gapless_next_track()
         
     def highlight_current_song(self):
         """
@@ -1478,6 +4899,7 @@ class AudioFileManager(QMainWindow):
         self.stop_audio() # 清空列表前先停止播放
         self.playlist.clear()
         self.playlist_widget.clear()
+        self._update_gapless_next_track()
         self.status_bar.showMessage("播放列表已清空")
         
     def stop_audio(self):
@@ -1488,6 +4910,7 @@ class AudioFileManager(QMainWindow):
         
         self.current_playlist_index = -1
         self.highlight_current_song() # 清除高亮
+        self._update_gapless_next_track()
         
         self.play_button.setEnabled(True)
         self.stop_button.setEnabled(False)
@@ -1513,6 +4936,8 @@ class AudioFileManager(QMainWindow):
             self.progress_slider.setRange(0, int(self.current_song_duration))
             self.total_time_label.setText(self.format_time(self.current_song_duration))
             self.progress_slider.setEnabled(True)
+            self.position_timer.start()
+            self.show_waveform(file_path)
         else:
             # 如果pygame也获取不到时长，就禁用进度条
             self.status_bar.showMessage(f"正在播放: {os.path.basename(file_path)} (无法获取时长)")
@@ -1532,26 +4957,14 @@ class AudioFileManager(QMainWindow):
             return
 
         # --- 如果代码能执行到这里，说明我们一定在“播放列表模式”中 ---
-        
-        # 2. 单曲循环模式
-        if self.loop_mode == LoopMode.LOOP_ONE:
-            self.play_song_at_index(self.current_playlist_index)
-            return
-
-        # 3. 列表循环模式
-        if self.loop_mode == LoopMode.LOOP_LIST:
-            next_index = (self.current_playlist_index + 1) % len(self.playlist)
-            self.play_song_at_index(next_index)
-            return
-                
-        # 4. 不循环模式 (NO_LOOP)
-        next_index = self.current_playlist_index + 1
-        if next_index >= len(self.playlist):
+        # 开启无缝播放时，下一首已由播放线程直接衔接，只有没有可衔接的曲目时才会走到这里
+        next_index = self._next_playlist_index()
+        if next_index == -1:
             # 列表结束，重置状态
             self._reset_ui_to_stopped_state()
             self.status_bar.showMessage("播放列表已播完")
         else:
-            # 播放下一首
+            # 播放下一首 (单曲循环时就是当前这一首)
             self.play_song_at_index(next_index)
 
     
@@ -1568,6 +4981,7 @@ class AudioFileManager(QMainWindow):
         """一个辅助函数，将UI控件重置为完全停止的状态。"""
         self.current_playlist_index = -1
         self.highlight_current_song()
+        self._update_gapless_next_track()
         self.reset_progress_ui()
         self.status_bar.showMessage("播放完毕")
         self.play_button.setEnabled(True)
@@ -1576,92 +4990,271 @@ class AudioFileManager(QMainWindow):
         self.pause_button.setText("暂停")
         self.is_paused = False   
         
-    # 以下选择函数无需修改，因为它们的操作对 QTreeWidgetItem 同样有效
+    # 选择操作都合并成一次 select() 调用，选择变化信号只触发一次
     def select_marked(self):
-        self.file_list.blockSignals(True)
-        self.file_list.clearSelection()
-        for file_path in self.marked_files:
-            item = self.path_to_item_map.get(file_path)
-            if item:
-                item.setSelected(True)
-        self.file_list.blockSignals(False)
-        self.update_button_states()
+        self.select_view_rows(self.file_list_model.view_rows_with_mark(True))
 
     def select_unmarked(self):
-        self.file_list.blockSignals(True)
-        self.file_list.clearSelection()
-        for file_path in self.path_to_item_map.keys():
-            if file_path not in self.marked_files:
-                item = self.path_to_item_map[file_path]
-                item.setSelected(True)
-        self.file_list.blockSignals(False)
-        self.update_button_states()
+        self.select_view_rows(self.file_list_model.view_rows_with_mark(False))
 
     def invert_selection(self):
-        self.file_list.blockSignals(True)
-        for item in self.path_to_item_map.values():
-            item.setSelected(not item.isSelected())
-        self.file_list.blockSignals(False)
-        self.update_button_states()
+        model = self.file_list_model
+        if model.rowCount() == 0: return
+        everything = QItemSelection(model.index(0, 0), model.index(model.rowCount() - 1, model.columnCount() - 1))
+        self.file_list.selectionModel().select(everything, QItemSelectionModel.Toggle)
         
-    def start_conversion(self, target_format, extension, options):
-        """启动选中文件的转换过程。"""
-        # ★★★ 在这里加上打印语句来调试 ★★★
-        print(f"请求转换 -> 格式: {target_format}, 扩展名: {extension}, 参数: {options}")
+    def set_conversion_preset(self, key):
+        """之后加入队列的转换任务使用这个预设，已在队列中的不受影响。"""
+        self.conversion_preset = key
+        self.status_bar.showMessage(f"转换预设: {CONVERSION_PRESETS[key]['name']}")
 
-        if self.converter_thread and self.converter_thread.isRunning():
-            QMessageBox.warning(self, "正在转换", "已有文件正在转换中，请稍后再试。")
-            return
+    def start_conversion(self, target_format, extension, options, source="selection"):
+        """
+        把选中的文件 (source="selection") 或所有已标记的文件 (source="marked") 加入转换队列。
+        队列已在运行时新任务直接追加进去。
+        开启增量转换时，已存在的目标文件若按转换记录仍是最新就跳过，记录已过期的直接重新转换，
+        只有没有转换记录的才询问是否覆盖。
+        """
+        options = dict(options, preset=self.conversion_preset)
 
-        selected_items = self.file_list.selectedItems()
-        # 这个检查其实在菜单禁用时已经做了，但作为双重保险
-        if not selected_items or len(selected_items) > 1:
+        if source == "marked":
+            input_paths = [self.catalog.path(int(row)) for row in self.catalog.marked_rows()]
+        else:
+            input_paths = self.selected_paths()
+        if not input_paths:
             return
 
-        input_path = selected_items[0].data(0, Qt.UserRole)
-        base, _ = os.path.splitext(input_path)
-        output_path = base + "." + extension
+        jobs, outputs, existing = [], set(), []
+        for input_path in input_paths:
+            base, _ = os.path.splitext(input_path)
+            output_path = base + "." + extension
+            # 源文件已是目标格式，或另一个源文件已经会生成同名的输出
+            if output_path == input_path or output_path in outputs:
+                continue
+            outputs.add(output_path)
+            jobs.append((input_path, output_path, target_format, options))
+            if os.path.exists(output_path): existing.append(output_path)
+        skipped = len(input_paths) - len(jobs)
 
-        if input_path == output_path:
+        if not jobs:
             QMessageBox.information(self, "提示", "源文件和目标文件格式相同，无需转换。")
             return
 
-        if os.path.exists(output_path):
-            reply = QMessageBox.question(self, '文件已存在', 
-                                         f"文件 '{os.path.basename(output_path)}' 已存在。\n您要覆盖它吗？",
+        up_to_date = 0
+        if existing and self.incremental_conversion_action.isChecked():
+            existing_set = set(existing)
+            current, stale = self.library_index.conversion_states(job for job in jobs if job[1] in existing_set)
+            if current:
+                jobs = [job for job in jobs if job[1] not in current]
+                up_to_date = len(current)
+            existing = [path for path in existing if path not in current and path not in stale]
+            if not jobs:
+                self.status_bar.showMessage(f"{up_to_date} 个目标文件都已是最新，无需转换")
+                return
+
+        if existing:
+            if len(existing) == 1:
+                question = f"文件 '{os.path.basename(existing[0])}' 已存在。\n您要覆盖它吗？"
+            else:
+                question = f"有 {len(existing)} 个目标文件已存在。\n您要覆盖它们吗？选择“否”将跳过这些文件。"
+            reply = QMessageBox.question(self, '文件已存在', question,
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.No:
-                return
+                existing = set(existing)
+                jobs = [job for job in jobs if job[1] not in existing]
+                skipped += len(existing)
+                if not jobs: return
 
-        self.status_bar.showMessage(f"正在准备转换: {os.path.basename(input_path)}...")
-        
-        # ★★★ 将参数字典传递给线程 ★★★
-        self.converter_thread = ConverterThread(input_path, output_path, target_format, options)
-        self.converter_thread.conversion_progress.connect(self.on_conversion_progress)
-        self.converter_thread.conversion_finished.connect(self.on_conversion_finished)
-        self.converter_thread.start()
-
-    def on_conversion_progress(self, progress):
-        """当转换线程报告进度时更新状态栏。"""
-        self.status_bar.showMessage(f"正在转换... {progress}%")
-
-    def on_conversion_finished(self, output_path, error_message):
-        """当转换完成时调用。"""
-        if error_message:
-            QMessageBox.critical(self, "转换失败", f"转换文件时发生错误：\n{error_message}")
-            self.status_bar.showMessage("转换失败！")
+        for input_path, output_path, _, _ in jobs:
+            try:
+                stat = os.stat(input_path)
+                self.conversion_sources[output_path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                pass   # 源文件读不到，转换本身也会失败
+
+        first_job_id = self.batch_converter.add_jobs(jobs) if self.batch_converter else None
+        if first_job_id is None:
+            self.batch_converter = BatchConverterThread()
+            self.batch_converter.job_progress.connect(self.on_conversion_job_progress)
+            self.batch_converter.job_finished.connect(self.on_conversion_job_finished)
+            self.batch_converter.progress.connect(self.on_conversion_progress)
+            self.batch_converter.finished.connect(self.on_conversion_finished)
+            first_job_id = self.batch_converter.add_jobs(jobs)
+            if self.conversion_dialog is None:
+                self.conversion_dialog = ConversionQueueDialog(self)
+                self.conversion_dialog.cancel_requested.connect(self.cancel_conversion)
+            self.conversion_dialog.reset()
+            self.batch_converter.start()
+        self.conversion_dialog.add_jobs(first_job_id, jobs)
+        if len(self.batch_converter.jobs) > 1:
+            self.conversion_dialog.show()
+            self.conversion_dialog.raise_()
+
+        message = f"已加入转换队列: {len(jobs)} 个文件"
+        if up_to_date: message += f"，{up_to_date} 个已是最新"
+        if skipped: message += f"，跳过 {skipped} 个"
+        self.status_bar.showMessage(message)
+
+    def cancel_conversion(self):
+        if self.batch_converter and self.batch_converter.isRunning():
+            self.batch_converter.cancel()
+            self.status_bar.showMessage("正在取消转换...")
+
+    def on_conversion_job_progress(self, job_id, progress):
+        if self.sender() is self.batch_converter:
+            self.conversion_dialog.set_job_progress(job_id, progress)
+
+    def on_conversion_job_finished(self, job_id, status, error_message):
+        converter = self.sender()
+        # 取消后又开始了新的批次时，旧批次余下的任务不再更新已经重置的队列窗口，但转换结果照样记录
+        if converter is self.batch_converter:
+            self.conversion_dialog.set_job_finished(job_id, status, error_message)
+        input_path, output_path, target_format, options = converter.jobs[job_id]
+        source_stat = self.conversion_sources.pop(output_path, None)
+        if status == BatchConverterThread.DONE:
+            if source_stat is not None:
+                self.library_index.record_conversion(input_path, output_path, target_format, options, source_stat)
+            # 只把新文件加入索引和列表，不再重新扫描整个目录；单个文件的转换顺便选中它
+            self.add_single_file(output_path, select=len(converter.jobs) == 1)
+
+    def on_conversion_progress(self, finished_count, total_count, percent):
+        """转换线程报告总体进度时更新状态栏。"""
+        if self.sender() is not self.batch_converter:
+            return
+        if total_count == 1:
+            self.status_bar.showMessage(f"正在转换... {int(percent)}%")
         else:
-            # ★★★ 核心改动：在刷新前，先把要选中的路径记下来 ★★★
-            self.path_to_select_after_scan = output_path
-            
-            QMessageBox.information(self, "转换成功", f"文件已成功转换为：\n{output_path}")
-            self.status_bar.showMessage("转换完成！")
-            
-            # 刷新文件列表以显示新文件
-            self.start_loading_files()
+            self.status_bar.showMessage(f"正在转换 {finished_count}/{total_count}... {percent:.0f}%")
+        self.conversion_dialog.set_overall_progress(finished_count, total_count, percent)
+
+    def on_conversion_finished(self, summary):
+        """整个批次结束后给出一次汇总，不再每个文件弹一次对话框。"""
+        converter = self.sender()
+        converter.wait()
+        is_current_batch = converter is self.batch_converter
+        if is_current_batch:
+            self.batch_converter = None
+
+        done, failed = summary[BatchConverterThread.DONE], summary[BatchConverterThread.FAILED]
+        cancelled = summary[BatchConverterThread.CANCELLED]
+        text = f"转换结束：成功 {done} 个，失败 {failed} 个"
+        if cancelled: text += f"，取消 {cancelled} 个"
+        text += f"，耗时 {summary['elapsed']:.1f} 秒"
+        if is_current_batch:
+            self.conversion_dialog.show_summary(text)
+            self.status_bar.showMessage(text)
+
+        if len(converter.jobs) == 1 and done:
+            QMessageBox.information(self, "转换成功", f"文件已成功转换为：\n{converter.jobs[0][1]}")
+        elif summary['failures']:
+            details = "\n\n".join(f"{os.path.basename(path)}\n{error}" for path, error in summary['failures'][:10])
+            if failed > 10: details += f"\n\n... 等共 {failed} 个文件"
+            QMessageBox.warning(self, "转换完成" if done else "转换失败", f"{text}\n\n{details}")
+        elif not self.conversion_dialog.isVisible():
+            QMessageBox.information(self, "转换完成", text)
+
+    def start_loudness_analysis(self, source="selection"):
+        """测量选中的文件 (source="selection") 或列表中所有文件 (source="all") 的响度，已分析过的自动跳过。"""
+        if self.loudness_thread is not None:
+            return
+        if source == "all":
+            rows = self.catalog.live_rows()
+        else:
+            rows = [self.file_list_model.row_at(index.row()) for index in self.file_list.selectionModel().selectedRows()]
+        files = [(self.catalog.path(row), self.catalog.mtime(row)) for row in map(int, rows)]
+        if not files:
+            return
+        self.loudness_thread = LoudnessAnalyzerThread(files, self.library_index)
+        self.loudness_thread.progress.connect(self.on_loudness_progress)
+        self.loudness_thread.finished.connect(self.on_loudness_finished)
+        self.loudness_thread.start()
+        self.status_bar.showMessage(f"正在分析 {len(files)} 个文件的响度...")
+        self._update_menu_actions_state()
+
+    def cancel_loudness_analysis(self):
+        if self.loudness_thread is not None:
+            self.loudness_thread.cancel()
+            self.status_bar.showMessage("正在取消响度分析...")
+
+    def on_loudness_progress(self, done_count, total_count):
+        if self.sender() is self.loudness_thread:
+            self.status_bar.showMessage(f"正在分析响度 {done_count}/{total_count}...")
+
+    def on_loudness_finished(self, summary):
+        analyzer = self.sender()
+        analyzer.wait()
+        if analyzer is self.loudness_thread:
+            self.loudness_thread = None
+        done, failed = summary[LoudnessAnalyzerThread.DONE], summary[LoudnessAnalyzerThread.FAILED]
+        cancelled = summary[LoudnessAnalyzerThread.CANCELLED]
+        text = f"响度分析结束：分析 {done} 个"
+        if summary['cached']: text += f"，{summary['cached']} 个已有结果"
+        if failed: text += f"，失败 {failed} 个"
+        if cancelled: text += f"，取消 {cancelled} 个"
+        text += f"，耗时 {summary['elapsed']:.1f} 秒"
+        self.status_bar.showMessage(text)
+        self._update_menu_actions_state()
+        if summary['failures']:
+            details = "\n\n".join(f"{os.path.basename(path)}\n{error}" for path, error in summary['failures'][:10])
+            if failed > 10: details += f"\n\n... 等共 {failed} 个文件"
+            QMessageBox.warning(self, "响度分析", f"{text}\n\n{details}")
+
+    def start_duplicate_search(self, acoustic=True):
+        """在列表中的所有文件里查找重复音频，结束后把每组中多余的副本标记出来。acoustic=False 时只找字节完全相同的文件。"""
+        if self.duplicate_finder is not None:
+            return
+        rows = self.catalog.live_rows()
+        if len(rows) < 2:
+            return
+        files = [(self.catalog.path(row), self.catalog.mtime(row), self.catalog.size(row)) for row in map(int, rows)]
+        self.duplicate_finder = DuplicateFinderThread(files, self.library_index, acoustic)
+        self.duplicate_finder.progress.connect(self.on_duplicate_progress)
+        self.duplicate_finder.finished.connect(self.on_duplicates_found)
+        self.duplicate_finder.start()
+        self.status_bar.showMessage(f"正在查找 {len(files)} 个文件中的重复音频...")
+        self._update_menu_actions_state()
+
+    def cancel_duplicate_search(self):
+        if self.duplicate_finder is not None:
+            self.duplicate_finder.cancel()
+            self.status_bar.showMessage("正在取消查找重复音频...")
+
+    def on_duplicate_progress(self, stage, done_count, total_count):
+        if self.sender() is self.duplicate_finder:
+            action = "比对文件内容" if stage == DuplicateFinderThread.HASHING else "计算音频指纹"
+            self.status_bar.showMessage(f"正在{action} {done_count}/{total_count}...")
+
+    def on_duplicates_found(self, summary):
+        """每组保留排在第一个的 (音质最好的)，其余仍在列表中的文件标记出来，交给“删除所有已标记文件”处理。"""
+        finder = self.sender()
+        finder.wait()
+        if finder is self.duplicate_finder:
+            self.duplicate_finder = None
+        self._update_menu_actions_state()
+        if not summary['completed']:
+            self.status_bar.showMessage("已取消查找重复音频")
+            return
 
-        # 清理线程对象
-        self.converter_thread = None
+        duplicates = [path for group in summary['groups'] for path in group[1:]]
+        rows = [row for row in map(self.catalog.find, duplicates) if row is not None]
+        if rows:
+            self.library_index.set_marked([self.catalog.path(row) for row in rows], True)
+            self.file_list_model.set_marked_rows(rows, True)
+            self.update_button_states()
+        text = f"找到 {len(summary['groups'])} 组重复音频"
+        if summary['exact_groups']: text += f" (其中 {summary['exact_groups']} 组内容完全相同)"
+        text += f"，已标记 {len(rows)} 个多余的副本"
+        if summary[DuplicateFinderThread.FAILED]: text += f"，{summary[DuplicateFinderThread.FAILED]} 个文件无法读取"
+        text += f"，耗时 {summary['elapsed']:.1f} 秒"
+        self.status_bar.showMessage(text)
+        if not summary['groups']:
+            QMessageBox.information(self, "查找重复音频", text)
+            return
+        details = "\n\n".join("保留: " + os.path.basename(group[0]) + "".join(
+            "\n标记: " + os.path.basename(path) for path in group[1:]) for group in summary['groups'][:10])
+        if len(summary['groups']) > 10: details += f"\n\n... 等共 {len(summary['groups'])} 组"
+        QMessageBox.information(self, "查找重复音频",
+                                f"{text}。\n每组保留音质最好的一个，确认无误后可用“删除所有已标记文件”删除。\n\n{details}")
 
     def show_context_menu(self, position):
         menu = QMenu()
@@ -1673,6 +5266,7 @@ class AudioFileManager(QMainWindow):
         
         # ★★★ 复用我们的辅助函数来创建子菜单 ★★★
         convert_menu = self._create_conversion_submenu(menu)
+        convert_marked_menu = self._create_conversion_submenu(menu, "转换所有已标记文件", "marked")
         
         menu.addSeparator()
         mark_action = menu.addAction("标记/取消标记选中项")
@@ -1686,10 +5280,10 @@ class AudioFileManager(QMainWindow):
         clear_marks_action = menu.addAction("清除所有标记")
         clear_queue_action = menu.addAction("清空播放队列")
         
-        selected_count = len(self.file_list.selectedItems())
+        selected_count = len(self.file_list.selectionModel().selectedRows())
         has_selection = selected_count > 0
         is_single_selection = selected_count == 1
-        has_marked_files = bool(self.marked_files)
+        has_marked_files = self.catalog.has_marked()
         has_playlist = bool(self.playlist)
 
         # --- 3. 根据状态，统一设置所有菜单项 ---
@@ -1701,7 +5295,8 @@ class AudioFileManager(QMainWindow):
         
         # ★★★ Bug修复：这两个功能严格要求只能选中一个 ★★★
         reveal_action.setEnabled(is_single_selection)
-        convert_menu.setEnabled(is_single_selection)
+        convert_menu.setEnabled(has_selection)
+        convert_marked_menu.setEnabled(has_marked_files)
         
         # 需要有已标记的文件
         delete_marked_action.setEnabled(has_marked_files)
@@ -1731,11 +5326,27 @@ class AudioFileManager(QMainWindow):
         if self.scanner_thread and self.scanner_thread.isRunning():
             self.scanner_thread.stop()
             self.scanner_thread.wait()
+        if self.deleter_thread and self.deleter_thread.isRunning():
+            self.deleter_thread.wait()
+        self.stop_metadata_probe()
+        self.stop_waveform()
+        if self.loudness_thread is not None:
+            self.loudness_thread.cancel()
+            self.loudness_thread.wait()
+        if self.duplicate_finder is not None:
+            self.duplicate_finder.cancel()
+            self.duplicate_finder.wait()
+        if self.batch_converter and self.batch_converter.isRunning():
+            self.batch_converter.cancel()
+            self.batch_converter.wait()
+        self.library_watcher.clear()
         self.player_thread.stop()
         self.player_thread.wait(500)
         super().closeEvent(event)
 
 if __name__ == "__main__":
+    # 打包后的程序中，批量转换的工作进程也从这个入口启动
+    multiprocessing.freeze_support()
     if sys.platform == "win32" and hasattr(sys, '_MEIPASS'):
         os.environ["PATH"] = sys._MEIPASS + ";" + os.environ["PATH"]
     app = QApplication(sys.argv)